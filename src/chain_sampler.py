@@ -0,0 +1,90 @@
+"""
+Batched sampler for the chain and chain-with-sink baseline relabels.
+
+For every trace, chain_length of its (non-empty) events are picked uniformly
+at random, in order, to form a chain goal. With num_avoid > 0, each link of
+the chain also gets num_avoid propositions, not seen since the previous link,
+that send the goal to a rejecting sink. The goals are never built as DFA
+objects: their transition tables are filled in with NumPy over the whole batch
+and their integer encodings are computed from the tables by table_to_int.
+
+Chain states are 0, ..., chain_length (accepting) and chain_length + 1 (sink),
+all of which accept different languages, so the tables are minimal.
+"""
+
+import numpy as np
+
+from compiled_dfa import table_to_int
+
+
+class ChainSampler():
+
+    def __init__(self, propositions, chain_length, num_avoid=0, n_tries=10):
+        self.inputs = sorted(propositions)
+        self.input_inds = {a: i for i, a in enumerate(self.inputs)}
+        self.chain_length = chain_length
+        self.num_avoid = num_avoid
+        self.n_tries = n_tries
+        self.n_states = chain_length + 2 # Including the sink
+        self.accepting = np.arange(self.n_states) == chain_length
+
+    def sample(self, events_clean):
+        """
+        events_clean is a list of event sequences (without empty events). Returns
+        the index of each chain event in the sorted inputs, shape (B, chain_length),
+        the avoid sets as masks over the sorted inputs, shape (B, chain_length, P),
+        and a mask of the traces for which a chain was found, shape (B,).
+        """
+        n, k, P = self.chain_length, self.num_avoid, len(self.inputs)
+        B = len(events_clean)
+        L = max([len(events) for events in events_clean] + [n])
+        lengths = np.array([len(events) for events in events_clean], dtype=np.int64)
+        event_inds = np.zeros((B, L), dtype=np.int64)
+        for b, events in enumerate(events_clean):
+            event_inds[b, :len(events)] = [self.input_inds[e] for e in events]
+        # seen_counts[b, t, a] is the number of times the a-th input occurs in events_clean[b][:t]
+        seen_counts = np.zeros((B, L + 1, P), dtype=np.int64)
+        np.cumsum(np.eye(P, dtype=np.int64)[event_inds] * (np.arange(L)[None, :] < lengths[:, None])[..., None], axis=1, out=seen_counts[:, 1:])
+
+        chain_events = np.zeros((B, n), dtype=np.int64)
+        avoids = np.zeros((B, n, P), dtype=bool)
+        valid = np.zeros(B, dtype=bool)
+        todo = np.flatnonzero(lengths >= n)
+        for _ in range(self.n_tries):
+            if len(todo) == 0:
+                break
+            rows = todo[:, None]
+            # Uniformly pick n of the events of each trace and keep them in order
+            keys = np.random.rand(len(todo), L)
+            keys[np.arange(L)[None, :] >= lengths[todo, None]] = np.inf
+            positions = np.sort(np.argsort(keys, axis=1)[:, :n], axis=1)
+            slice_starts = np.concatenate([np.zeros((len(todo), 1), dtype=np.int64), positions[:, :-1] + 1], axis=1)
+            # Propositions not seen in events_clean[slice_start:position + 1] can be avoided
+            unseen = (seen_counts[rows, positions + 1] - seen_counts[rows, slice_starts]) == 0
+            ok = (unseen.sum(axis=2) >= k).all(axis=1)
+            # Pick k of the unseen propositions uniformly for each link
+            keys = np.where(unseen, np.random.rand(*unseen.shape), np.inf)
+            picked = np.argsort(keys, axis=2)[..., :k]
+            link_avoids = np.zeros(unseen.shape, dtype=bool)
+            np.put_along_axis(link_avoids, picked, True, axis=2)
+
+            done = todo[ok]
+            chain_events[done] = event_inds[done[:, None], positions[ok]]
+            avoids[done] = link_avoids[ok]
+            valid[done] = True
+            todo = todo[~ok]
+        return chain_events, avoids, valid
+
+    def get_transitions(self, chain_events, avoids):
+        """ Transition tables over the sorted inputs of the sampled chains, shape (B, chain_length + 2, P) """
+        n, P = self.chain_length, len(self.inputs)
+        B = chain_events.shape[0]
+        transitions = np.broadcast_to(np.arange(self.n_states)[None, :, None], (B, self.n_states, P)).copy()
+        links = np.arange(n)
+        transitions[:, :n][avoids] = n + 1 # Avoided propositions lead to the sink
+        transitions[np.arange(B)[:, None], links[None, :], chain_events] = links[None, :] + 1
+        return transitions
+
+    def to_ints(self, transitions):
+        """ Integer encoding of each chain started at each of its states, shape (B, chain_length + 2) """
+        return [[table_to_int(table, self.accepting, s) for s in range(self.n_states)] for table in transitions]
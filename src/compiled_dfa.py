@@ -0,0 +1,402 @@
+"""
+DFAs compiled to integer tables.
+
+A dfa.DFA is defined by closures, so each transition of a DFA obtained by
+products or advances goes through all their layers. A CompiledDFA instead holds
+NumPy arrays over its sorted inputs: transitions[s, i] is the state reached
+from s on the i-th input and labels[s] is the label of s. State 0 is the start
+and all the states are reachable from it.
+
+Minimization is canonical (partition refinement, then the states are numbered
+in BFS order), so two minimized CompiledDFAs are equal iff they accept
+the same language. to_int and from_int use the same integer encoding as
+DFA.to_int and DFA.from_int.
+"""
+
+import operator as OP
+from functools import reduce
+
+import numpy as np
+from dfa import DFA
+
+
+def bits_needed(n):
+    return 0 if n < 2 else len(bin(n - 1)) - 2
+
+
+def table_to_int(transitions, accepting, start):
+    """
+    Same integer as DFA.to_int for a minimal DFA given as a transition table
+    over its sorted inputs, i.e., transitions[s, i] is the state reached from s
+    on the i-th input, and a boolean accepting array indexed by state.
+    """
+    n_inputs = transitions.shape[1]
+    transitions = transitions.tolist()
+
+    # Reindex the reachable states in the DFS order of DFA.walk
+    index = {}
+    stack = [start]
+    while stack:
+        curr = stack.pop()
+        if curr in index:
+            continue
+        index[curr] = len(index)
+        stack.extend(transitions[curr])
+    states = list(index)
+    n_states = len(states)
+
+    state_bits = bits_needed(n_states)
+    input_bits = bits_needed(n_inputs)
+    encoding = 1 # Start with 1 for int conversion.
+
+    def push(value, n_bits):
+        nonlocal encoding
+        if n_bits:
+            encoding = (encoding << n_bits) | value
+
+    push((1 << state_bits) - 1, state_bits)
+    push(0, 1)
+    push(n_states - 1, state_bits)
+    push((1 << input_bits) - 1, input_bits)
+    push(0, 1)
+    push(n_inputs - 1, input_bits)
+
+    # Built and iterated as sets, like DFA.to_int does, for the same order
+    accepting_inds = {i for i, s in enumerate(states) if accepting[s]}
+    specify_rejecting = len(accepting_inds) * 2 >= n_states + 1
+    if specify_rejecting:
+        inds = set(range(n_states)) - accepting_inds
+    else:
+        inds = accepting_inds
+    push(int(specify_rejecting), 1)
+    push(len(inds) - 1, state_bits)
+    for i in inds:
+        push(i, state_bits)
+
+    for i, s in enumerate(states):
+        for a, t in enumerate(transitions[s]):
+            if t == s:
+                continue
+            push(i, state_bits)
+            push(a, input_bits)
+            push(index[t], state_bits)
+    return encoding
+
+
+def int_to_table(encoding, n_inputs):
+    """ The (transitions, labels) of DFA.from_int(encoding), start 0, over n_inputs sorted inputs """
+    bits = bin(encoding)[3:] # Ignore leading 1.
+    pos = 0
+
+    def read(n_bits):
+        nonlocal pos
+        value = int(bits[pos:pos + n_bits], 2) if n_bits else 0
+        pos += n_bits
+        return value
+
+    state_bits = bits.index("0")
+    pos = state_bits + 1
+    n_states = read(state_bits) + 1 if state_bits > 0 else 1
+    input_bits = bits.index("0", pos) - pos
+    pos += input_bits + 1
+    n_encoded_inputs = read(input_bits) + 1
+    assert n_encoded_inputs == n_inputs or input_bits == 0
+    specify_rejecting = bool(read(1))
+
+    transitions = np.repeat(np.arange(n_states, dtype=np.int64)[:, None], n_inputs, axis=1)
+    labels = np.zeros(n_states, dtype=bool)
+    if pos < len(bits):
+        n_inds = read(state_bits) + 1
+        labels[[read(state_bits) for _ in range(n_inds)]] = True
+        while pos < len(bits):
+            s = read(state_bits)
+            a = read(input_bits)
+            transitions[s, a] = read(state_bits)
+    return transitions, labels ^ specify_rejecting
+
+
+def reachable_table(transitions, labels, start):
+    """ The table restricted to the states reachable from start, numbered in BFS order from 0 """
+    rows = transitions.tolist()
+    index = {start: 0}
+    states = [start]
+    for s in states:
+        for t in rows[s]:
+            if t not in index:
+                index[t] = len(states)
+                states.append(t)
+    if states == list(range(len(rows))): # Already reachable and in BFS order
+        return transitions, labels
+    states = np.array(states, dtype=np.int64)
+    relabel = np.zeros(len(rows), dtype=np.int64)
+    relabel[states] = np.arange(len(states))
+    return relabel[transitions[states]], labels[states]
+
+
+class CompiledDFA():
+
+    def __init__(self, inputs, transitions, labels):
+        self.inputs = tuple(inputs)
+        self.input_inds = {a: i for i, a in enumerate(self.inputs)}
+        self.transitions = np.asarray(transitions, dtype=np.int64).reshape(-1, len(self.inputs))
+        self.labels = np.asarray(labels, dtype=bool)
+        self._key = None
+
+    @staticmethod
+    def from_table(inputs, transitions, labels, start=0):
+        return CompiledDFA(inputs, *reachable_table(np.asarray(transitions, dtype=np.int64), np.asarray(labels, dtype=bool), start))
+
+    @staticmethod
+    def from_dfa(dfa_, inputs=None):
+        """ Compiles the states of dfa_ reachable from its start, over inputs (default: its sorted inputs) """
+        inputs = tuple(sorted(dfa_.inputs)) if inputs is None else tuple(inputs)
+        index = {dfa_.start: 0}
+        states = [dfa_.start]
+        transitions = []
+        for s in states:
+            row = []
+            for a in inputs:
+                t = dfa_._transition(s, a)
+                if t not in index:
+                    index[t] = len(states)
+                    states.append(t)
+                row.append(index[t])
+            transitions.append(row)
+        return CompiledDFA(inputs, transitions, [dfa_._label(s) for s in states])
+
+    @staticmethod
+    def from_int(encoding, inputs):
+        """ Same DFA as DFA.from_int(encoding, inputs), with the same state numbering """
+        return CompiledDFA(inputs, *int_to_table(encoding, len(inputs)))
+
+    def to_dfa(self):
+        transitions = self.transitions.tolist()
+        labels = self.labels.tolist()
+        input_inds = self.input_inds
+        return DFA(
+            start=0,
+            inputs=self.inputs,
+            label=labels.__getitem__,
+            transition=lambda s, c: transitions[s][input_inds[c]],
+        )
+
+    def to_int(self):
+        minimized = self.minimize()
+        return table_to_int(minimized.transitions, minimized.labels, 0)
+
+    @property
+    def n_states(self):
+        return len(self.labels)
+
+    def __len__(self):
+        return self.n_states
+
+    def key(self):
+        if self._key is None:
+            self._key = (self.inputs, self.transitions.tobytes(), self.labels.tobytes())
+        return self._key
+
+    def __hash__(self):
+        return hash(self.key())
+
+    def __eq__(self, other):
+        """ Equal tables, i.e., equal languages for minimized DFAs """
+        return isinstance(other, CompiledDFA) and self.key() == other.key()
+
+    def transition(self, state, word):
+        for a in word:
+            state = int(self.transitions[state, self.input_inds[a]])
+        return state
+
+    def accepts(self, word):
+        return bool(self.labels[self.transition(0, word)])
+
+    def with_start(self, state):
+        return CompiledDFA.from_table(self.inputs, self.transitions, self.labels, state)
+
+    def advance(self, word):
+        return self.with_start(self.transition(0, word))
+
+    def minimize(self):
+        # Moore's partition refinement, the blocks are the states of the minimal DFA
+        rows = self.transitions.tolist()
+        blocks = [int(label) for label in self.labels.tolist()]
+        n_blocks = len(set(blocks))
+        while True:
+            signatures = {}
+            blocks = [signatures.setdefault((blocks[s],) + tuple(blocks[t] for t in row), len(signatures)) for s, row in enumerate(rows)]
+            if len(signatures) == n_blocks:
+                break
+            n_blocks = len(signatures)
+        blocks = np.array(blocks, dtype=np.int64)
+        transitions = np.zeros((n_blocks, len(self.inputs)), dtype=np.int64)
+        labels = np.zeros(n_blocks, dtype=bool)
+        transitions[blocks] = blocks[self.transitions]
+        labels[blocks] = self.labels
+        return CompiledDFA.from_table(self.inputs, transitions, labels, int(blocks[0]))
+
+    def product(self, other, op):
+        """ The product DFA, labeled by op of the labels of its components """
+        assert self.inputs == other.inputs
+        n = other.n_states
+        transitions = (self.transitions[:, None, :] * n + other.transitions[None, :, :]).reshape(-1, len(self.inputs))
+        labels = op(self.labels[:, None], other.labels[None, :]).reshape(-1)
+        return CompiledDFA.from_table(self.inputs, transitions, labels)
+
+    def __and__(self, other):
+        return self.product(other, OP.and_)
+
+    def __or__(self, other):
+        return self.product(other, OP.or_)
+
+    def __xor__(self, other):
+        return self.product(other, OP.xor)
+
+    def __invert__(self):
+        return CompiledDFA(self.inputs, self.transitions, ~self.labels)
+
+    def is_empty(self):
+        return not self.labels.any() # All the states are reachable
+
+    def min_distance_to_accept(self):
+        """ The number of transitions from each state to an accepting one, inf if none is reachable """
+        distances = np.where(self.labels, 0.0, np.inf)
+        while True:
+            next_distances = np.minimum(distances, 1 + distances[self.transitions].min(axis=1))
+            if np.array_equal(next_distances, distances):
+                return distances
+            distances = next_distances
+
+    def find_word(self):
+        """ A shortest accepted word, None if the language is empty """
+        parents = {0: None}
+        queue = [0]
+        rows = self.transitions.tolist()
+        for s in queue:
+            if self.labels[s]:
+                word = []
+                while parents[s] is not None:
+                    s, a = parents[s]
+                    word.append(self.inputs[a])
+                return tuple(reversed(word))
+            for a, t in enumerate(rows[s]):
+                if t not in parents:
+                    parents[t] = (s, a)
+                    queue.append(t)
+        return None
+
+
+class DFAGoal(tuple):
+    """
+    A CNF goal, i.e., a tuple of clauses of DFAs, with the integer encodings of
+    its DFAs (as in to_int) attached, so it can be keyed and compared by ints.
+    Goals are made DFAGoals when they are sampled and when they are advanced.
+    """
+
+    def __new__(cls, dfa_goal, ints=None):
+        goal = super().__new__(cls, (tuple(dfa_clause) for dfa_clause in dfa_goal))
+        goal.ints = goal_ints(tuple(goal)) if ints is None else ints
+        return goal
+
+
+def goal_ints(dfa_goal):
+    """ The integer encodings of the DFAs of a goal, by clause """
+    if isinstance(dfa_goal, DFAGoal):
+        return dfa_goal.ints
+    return tuple(tuple(CompiledDFA.from_dfa(dfa_).to_int() for dfa_ in dfa_clause) for dfa_clause in dfa_goal)
+
+
+def compile_cnf(dfa_goal):
+    """ The (minimized) product DFA of a CNF goal, i.e., a tuple of clauses of DFAs """
+    clauses = [reduce(lambda x, y: (x | y).minimize(), map(CompiledDFA.from_dfa, dfa_clause)) for dfa_clause in dfa_goal]
+    return reduce(lambda x, y: (x & y).minimize(), clauses)
+
+
+def find_subset_ce(smaller, bigger):
+    """
+    Same word as dfa.utils.find_subset_counterexample(smaller, bigger), i.e., a
+    word accepted by smaller but not by bigger, found by the DFS of DFA.walk over
+    the product of the two CompiledDFAs.
+    """
+    small_trans, small_labels = smaller.transitions.tolist(), smaller.labels.tolist()
+    big_trans, big_labels = bigger.transitions.tolist(), bigger.labels.tolist()
+    visited = set()
+    stack = [(0, 0, None, 0)]
+    word = []
+    while stack:
+        s, b, a, depth = stack.pop()
+        if (s, b) in visited:
+            continue
+        visited.add((s, b))
+        del word[depth - 1:]
+        if a is not None:
+            word.append(a)
+        if small_labels[s] and not big_labels[b]:
+            return tuple(word)
+        stack.extend((t, u, x, depth + 1) for t, u, x in zip(small_trans[s], big_trans[b], smaller.inputs))
+    return None
+
+
+class TableEncoding():
+    """
+    Fixed width observation encoding of CNF goals. Each DFA of the goal is
+    minimized and stored as [n_states, transitions, labels], its transition
+    table over the inputs and its labels padded to max_states states, and the
+    DFA slots of the goal are laid out like the int seqs of DFAEnv, with zeros
+    (n_states = 0) for the missing DFAs. The entries are unsigned ints of the
+    smallest type that holds max_states.
+    """
+
+    def __init__(self, inputs, max_states, n_conjunctions, n_disjunctions):
+        self.inputs = tuple(inputs)
+        self.max_states = max_states
+        self.n_conjunctions = n_conjunctions
+        self.n_disjunctions = n_disjunctions
+        self.per_dfa_size = 1 + max_states * (len(self.inputs) + 1)
+        self.size = n_conjunctions * n_disjunctions * self.per_dfa_size
+        self.dtype = np.min_scalar_type(max_states) # uint8 up to 255 states
+
+    def encode_dfa(self, dfa_):
+        """ The slot of dfa_, a DFA or a CompiledDFA, raises ValueError if it has more than max_states states """
+        if not isinstance(dfa_, CompiledDFA):
+            dfa_ = CompiledDFA.from_dfa(dfa_, self.inputs)
+        elif dfa_.inputs != self.inputs: # Reorder the columns before minimizing, for the same state order
+            dfa_ = CompiledDFA(self.inputs, dfa_.transitions[:, [dfa_.input_inds[a] for a in self.inputs]], dfa_.labels)
+        compiled = dfa_.minimize()
+        transitions = compiled.transitions
+        n_states, n_inputs = transitions.shape
+        if n_states > self.max_states:
+            raise ValueError(f"{n_states} states, at most {self.max_states} can be encoded")
+        seq = np.zeros(self.per_dfa_size, dtype=self.dtype)
+        seq[0] = n_states
+        seq[1:1 + n_states * n_inputs] = transitions.reshape(-1)
+        labels_start = 1 + self.max_states * n_inputs
+        seq[labels_start:labels_start + n_states] = compiled.labels
+        return seq
+
+    def encode(self, dfa_goal):
+        seq = np.zeros((self.n_conjunctions, self.n_disjunctions, self.per_dfa_size), dtype=self.dtype)
+        for i, dfa_clause in enumerate(dfa_goal):
+            for j, dfa_ in enumerate(dfa_clause):
+                seq[i, j] = self.encode_dfa(dfa_)
+        return seq.reshape(-1)
+
+    def decode_tables(self, seq):
+        """ The (transitions, labels) of the DFAs of each clause of an encoded goal """
+        seq = np.asarray(seq).astype(np.int64).reshape(self.n_conjunctions, self.n_disjunctions, self.per_dfa_size)
+        n_inputs = len(self.inputs)
+        labels_start = 1 + self.max_states * n_inputs
+        dfa_goal = []
+        for clause_seq in seq:
+            dfa_clause = []
+            for dfa_seq in clause_seq:
+                n_states = dfa_seq[0]
+                if n_states > 0:
+                    transitions = dfa_seq[1:1 + n_states * n_inputs].reshape(n_states, n_inputs)
+                    labels = dfa_seq[labels_start:labels_start + n_states].astype(bool)
+                    dfa_clause.append((transitions, labels))
+            dfa_goal.append(tuple(dfa_clause))
+        return dfa_goal
+
+    def decode(self, seq):
+        return [tuple(CompiledDFA(self.inputs, *table) for table in dfa_clause) for dfa_clause in self.decode_tables(seq)]
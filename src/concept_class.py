@@ -1,5 +1,9 @@
 from __future__ import annotations
-from functools import lru_cache, partial
+import time
+import pickle
+import multiprocessing
+from collections import deque, OrderedDict
+from functools import partial, lru_cache
 from typing import Any, Optional, Sequence
 
 import attr
@@ -17,10 +21,50 @@ from diss import DemoPrefixTree as PrefixTree
 from diss.learn import surprisal
 from diss.concept_classes.dfa_concept import DFAConcept
 
+from identification_cache import cached, hash_key, Uncacheable
+from incremental_identification import find_dfas_incremental
+from compiled_dfa import CompiledDFA, find_subset_ce
+from identification_portfolio import portfolio_find_dfas
+from sat_deadline import bounded_solver_fact
+
 
 __all__ = ['to_concept', 'ignore_white']
 
 
+# Number of (uncached) DFA identifications and the time spent in them,
+# read by the relabel workers to report the SAT time of each relabel.
+identification_stats = {"calls": 0, "time": 0.0}
+
+# For each identifier (by identifier_key), the last example sets augmented by
+# augment, as (positive, negative, derived negatives) triples.
+augment_closures = {}
+AUGMENT_MEMORY = 256
+AUGMENT_CLOSURES_SIZE = 1000 # Identifiers, cleared when full
+
+# Subset counterexamples of the candidate DFAs, by (partial int, inputs, compiled candidate), least recently used first
+subset_ces = OrderedDict()
+SUBSET_CE_CACHE_SIZE = 100000
+
+
+def dfas_to_bytes(dfas):
+    # DFAs are cached by their integer encoding, which uses the sorted inputs
+    return pickle.dumps([(dfa.to_int(), sorted(dfa.inputs)) for dfa in dfas])
+
+
+def dfas_from_bytes(value):
+    return [DFA.from_int(dfa_int, inputs) for dfa_int, inputs in pickle.loads(value)]
+
+
+def identifier_key(identifier):
+    partial = identifier.partial.dfa
+    return (
+        partial.to_int(), sorted(partial.inputs),
+        identifier.base_examples.positive, identifier.base_examples.negative,
+        identifier.encoding_upper, identifier.max_dfas, identifier.bounds, identifier.extra_clauses, identifier.incremental,
+        identifier.portfolio, identifier.portfolio_mode, identifier.portfolio_budget,
+    )
+
+
 def transition(s, c):
     if c == 'red':
         return s | 0b01
@@ -50,6 +94,15 @@ def dont_count(aps):
             continue
         yield curr
 
+
+compile_partial = lru_cache(maxsize=64)(CompiledDFA.from_dfa)
+
+
+@lru_cache(maxsize=64)
+def partial_int(partial, inputs):
+    return compile_partial(partial, inputs).to_int()
+
+
 def subset_check_wrapper(dfa_candidate):
     partial = partial_dfa(dfa_candidate.inputs)
     return find_subset_counterexample(dfa_candidate, partial) is None
@@ -93,8 +146,9 @@ BASE_EXAMPLES = LabeledExamples(
 )
 
 
-@lru_cache
-def find_dfas2(accepting, rejecting, alphabet, order_by_stutter=False, N=20):
+@cached("find_dfas2", dumps=dfas_to_bytes, loads=dfas_from_bytes)
+def find_dfas2(accepting, rejecting, alphabet, order_by_stutter=False, N=20, incremental=False):
+    start_time = time.time()
     reach1 = set.union(*map(set, accepting)) if accepting else set()
     avoid = set.union(*map(set, rejecting)) if rejecting else set()
     reach2 = reach1 - avoid
@@ -116,7 +170,7 @@ def find_dfas2(accepting, rejecting, alphabet, order_by_stutter=False, N=20):
         assert all(not (set(w) & avoid) for w in accepting)
         rejecting = {w for w in rejecting if not (set(w) & avoid)}
 
-    dfas = find_dfas(
+    dfas = (find_dfas_incremental if incremental else partial(find_dfas, solver_fact=bounded_solver_fact()))(
         accepting,
         rejecting,
         alphabet=alphabet,
@@ -125,19 +179,49 @@ def find_dfas2(accepting, rejecting, alphabet, order_by_stutter=False, N=20):
     if avoid:
         dfas = (minimize(lang & avoid_lang) for lang in dfas)
 
-    return fn.take(N, dfas)
+    dfas = fn.take(N, dfas)
+    identification_stats["calls"] += 1
+    identification_stats["time"] += time.time() - start_time
+    return dfas
 
 
-@lru_cache
 def augment(self: PartialDFAIdentifier, data: LabeledExamples) -> LabeledExamples:
     data = data.map(ignore_white) @ self.base_examples
 
+    # The derived negatives are rejected by the partial DFA, so they also hold
+    # for any superset of an earlier example set: start from its closure.
+    try:
+        key = hash_key(identifier_key(self))
+    except Uncacheable: # The closures of this identifier cannot be told apart from others
+        key = None
+    if key is None:
+        memory = deque(maxlen=AUGMENT_MEMORY)
+    else:
+        if key not in augment_closures and len(augment_closures) >= AUGMENT_CLOSURES_SIZE:
+            augment_closures.clear()
+        memory = augment_closures.setdefault(key, deque(maxlen=AUGMENT_MEMORY))
+    closures = [(len(pos) + len(neg), derived) for pos, neg, derived in memory if pos <= data.positive and neg <= data.negative]
+    seed = frozenset()
+    if closures:
+        _, derived = max(closures, key=lambda x: x[0])
+        seed = frozenset(derived - data.positive - data.negative)
+
+    closure = augment_closure(self, data, seed)
+    memory.append((data.positive, data.negative, closure.negative - data.negative))
+    return closure
+
+
+# The closure depends on the seed, so the seed is part of the key
+@cached("augment", key_fn=lambda self, data, seed: (identifier_key(self), data.positive, data.negative, seed))
+def augment_closure(self: PartialDFAIdentifier, data: LabeledExamples, seed: frozenset) -> LabeledExamples:
+    data @= LabeledExamples(negative=seed)
     for i in range(20):
         tests = find_dfas2(
             data.positive,
             data.negative,
             order_by_stutter=True,
             alphabet=self.partial.dfa.inputs,
+            incremental=self.incremental,
         )
         new_data = LabeledExamples()
         for test in tests:
@@ -145,16 +229,17 @@ def augment(self: PartialDFAIdentifier, data: LabeledExamples) -> LabeledExample
             ce = self.subset_ce(test)
             if ce is None:
                 continue
+            ce = tuple(ce)
             new_data @= LabeledExamples(negative=[ce])
             partial = self.partial_dfa(test.inputs)
             for k, lbl in enumerate(partial.transduce(ce)):
                 prefix = ce[:k]
                 if not lbl:
                     new_data @= LabeledExamples(negative=[prefix])
-            data @= new_data
 
-        if new_data.size == -1:
+        if new_data.negative <= data.negative:
             break
+        data @= new_data
     return data
 
 
@@ -168,14 +253,29 @@ class PartialDFAIdentifier:
     max_dfas: int = 20
     bounds: tuple[int, int] = (None, None)
     extra_clauses: ExtraClauseGenerator = None,
+    incremental: bool = False # Reuse SAT solvers across identifications, see incremental_identification.py
+    portfolio: tuple = () # PortfolioConfigs run in parallel by find_dfas3, see identification_portfolio.py
+    portfolio_mode: str = "first"
+    portfolio_budget: float = None
 
     def partial_dfa(self, inputs) -> DFA:
         assert inputs <= self.partial.dfa.inputs
         return attr.evolve(self.partial.dfa, inputs=inputs)
 
     def subset_ce(self, candidate: DFA) -> Optional[Sequence[Any]]:
-        partial = self.partial_dfa(candidate.inputs)
-        return find_subset_counterexample(candidate, partial)
+        assert candidate.inputs <= self.partial.dfa.inputs
+        inputs = tuple(sorted(candidate.inputs))
+        # Keyed on the table of the candidate, compiled by a single pass, to skip its minimization and int encoding
+        compiled = CompiledDFA.from_dfa(candidate, inputs)
+        key = (partial_int(self.partial.dfa, inputs), inputs, compiled)
+        if key in subset_ces:
+            subset_ces.move_to_end(key)
+            return subset_ces[key]
+        ce = find_subset_ce(compiled, compile_partial(self.partial.dfa, inputs))
+        subset_ces[key] = ce
+        while len(subset_ces) > SUBSET_CE_CACHE_SIZE:
+            subset_ces.popitem(last=False)
+        return ce
 
     def is_subset(self, candidate: DFA) -> Optional[Sequence[Any]]:
         return self.subset_ce(candidate) is None
@@ -199,8 +299,9 @@ class PartialDFAIdentifier:
         return attr.evolve(concept, size=concept.size - self.partial.size)
 
 
-    @lru_cache
+    @cached("find_dfas3", key_fn=lambda self, **kwargs: (identifier_key(self), kwargs), dumps=dfas_to_bytes, loads=dfas_from_bytes)
     def find_dfas3(self, accepting, rejecting, alphabet, order_by_stutter=False, N=20):
+        start_time = time.time()
         reach1 = set.union(*map(set, accepting)) if accepting else set()
         avoid = set.union(*map(set, rejecting)) if rejecting else set()
         reach2 = reach1 - avoid
@@ -222,19 +323,25 @@ class PartialDFAIdentifier:
             assert all(not (set(w) & avoid) for w in accepting)
             rejecting = {w for w in rejecting if not (set(w) & avoid)}
 
-        if self.extra_clauses == None:
-            extra_clauses = lambda *_: ()
+        if self.incremental:
+            dfas = find_dfas_incremental(accepting, rejecting, alphabet=alphabet, order_by_stutter=order_by_stutter, extra_clauses=self.extra_clauses, bounds=self.bounds)
         else:
-            extra_clauses = self.extra_clauses
-
-        dfas = find_dfas(
-            accepting,
-            rejecting,
-            alphabet=alphabet,
-            order_by_stutter=order_by_stutter,
-            extra_clauses=extra_clauses,
-            bounds=self.bounds,
-        )
+            if self.extra_clauses == None:
+                extra_clauses = lambda *_: ()
+            else:
+                extra_clauses = self.extra_clauses
+
+            find = partial(find_dfas, solver_fact=bounded_solver_fact())
+            if self.portfolio:
+                find = partial(portfolio_find_dfas, configs=self.portfolio, N=N, mode=self.portfolio_mode, time_budget=self.portfolio_budget)
+            dfas = find(
+                accepting,
+                rejecting,
+                alphabet=alphabet,
+                order_by_stutter=order_by_stutter,
+                extra_clauses=extra_clauses,
+                bounds=self.bounds,
+            )
         if avoid:
             dfas = (minimize(lang & avoid_lang) for lang in dfas)
 
@@ -243,12 +350,37 @@ class PartialDFAIdentifier:
         dfas = filter(size_filter, dfas)
 
         # try:
-        return fn.take(N, dfas)
+        dfas = fn.take(N, dfas)
+        identification_stats["calls"] += 1
+        identification_stats["time"] += time.time() - start_time
+        return dfas
         # except Exception as e:
             # print(f"Exception during concept identification: {e}")
             # raise ConceptIdException
 
 
+# Set in each scoring worker of enumerative_search by _init_scoring
+_scoring = None
+
+
+def _init_scoring(concepts, tree, to_chain, competency):
+    global _scoring
+    # The OpenMP pool of torch does not survive the fork, so the worker scores on a single thread
+    try:
+        import torch
+        torch.set_num_threads(1)
+    except ImportError:
+        pass
+    _scoring = (concepts, tree, to_chain, competency)
+
+
+def _score_concept(i):
+    concepts, tree, to_chain, competency = _scoring
+    concept = concepts[i]
+    chain = to_chain(concept, tree, competency(concept, tree))
+    return i, surprisal(chain, tree)
+
+
 def enumerative_search(
     demos: Demos, 
     identifer: PartialDFAIdentifier(),
@@ -257,7 +389,17 @@ def enumerative_search(
     n_iters: int = 25,
     size_weight: float = 1,
     surprise_weight: float = 1,
+    n_workers: int = 0,
+    chunk_size: int = 1,
+    to_chains = None,
 ):
+    """
+    With n_workers > 0, the concepts are scored by a pool of n_workers forked
+    processes (single-threaded for torch), chunk_size concepts at a time, and
+    yielded by increasing energy.
+    Otherwise, to_chains (e.g., NNPlanner.plan_batch) can build the chains of
+    all the concepts at once.
+    """
     tree = PrefixTree.from_demos(demos)
     weights = np.array([size_weight, surprise_weight])
     data = augment(identifer, LabeledExamples())
@@ -266,7 +408,8 @@ def enumerative_search(
         rejecting=data.negative,
         order_by_stutter=True,
         allow_unminimized=True,
-        alphabet=identifer.partial.dfa.inputs
+        alphabet=identifer.partial.dfa.inputs,
+        solver_fact=bounded_solver_fact(),
     )
     dfas = (attr.evolve(d, outputs={True, False}) for d in dfas)
     dfas = filter(identifer.is_subset, dfas)
@@ -281,8 +424,21 @@ def enumerative_search(
     concepts = fn.take(n_iters, concepts)
     print(f'Sorting by size')
     concepts = sorted(concepts, key=lambda c: c.size)
-    for concept in concepts:
-        chain = to_chain(concept, tree, competency(concept, tree))
+    if n_workers > 0:
+        # The tree and the concepts are passed once to each worker, the tasks are concept indices.
+        # The workers are forked since to_chain usually holds the q_net and the env, which do not pickle.
+        scoring = (concepts, tree, to_chain, competency)
+        with multiprocessing.get_context("fork").Pool(n_workers, initializer=_init_scoring, initargs=scoring) as pool:
+            surprisals = dict(pool.imap_unordered(_score_concept, range(len(concepts)), chunksize=chunk_size))
+        energies = [weights @ [concept.size, surprisals[i]] for i, concept in enumerate(concepts)]
+        for i in np.argsort(energies, kind="stable"):
+            yield LabeledExamples(), concepts[i], {'energy': energies[i]}
+        return
+    if to_chains is not None:
+        chains = to_chains(concepts, tree)
+    else:
+        chains = (to_chain(concept, tree, competency(concept, tree)) for concept in concepts)
+    for concept, chain in zip(concepts, chains):
         metadata = {
             'energy': weights @ [concept.size, surprisal(chain, tree)],
         }
@@ -8,9 +8,8 @@ given template(s).
 
 import random
 import numpy as np
-from functools import reduce
 from dfa import DFA, dict2dfa
-import operator as OP
+from compiled_dfa import DFAGoal, compile_cnf
 import math
 
 class DFASampler():
@@ -21,11 +20,10 @@ class DFASampler():
         candidate = self._sample()
         while self.reject(candidate):
             candidate = self._sample()
-        return candidate
+        return DFAGoal(candidate)
 
     def reject(self, dfa_goal):
-        mono = reduce(OP.and_, map(lambda dfa_clause: reduce(OP.or_, dfa_clause), dfa_goal))
-        return mono.find_word() is None
+        return compile_cnf(dfa_goal).is_empty()
 
     def _sample(self):
         raise NotImplemented
@@ -51,6 +49,10 @@ class DFASampler():
     def get_n_alphabet(self):
         return len(self.propositions)
 
+    def get_state_bound(self):
+        """ Upper bound on the number of states of the DFAs of the sampled goals """
+        raise ValueError(f"{type(self).__name__} has no bound on the number of states of its DFAs")
+
     def get_size_bound(self):
         return self._get_size_bound()
 
@@ -80,6 +82,18 @@ class JoinSampler(DFASampler):
     def _get_size_bound(self):
         return max(sampler._get_size_bound() for sampler in self.samplers)
 
+    def get_n_states(self):
+        return max(sampler.get_n_states() for sampler in self.samplers)
+
+    def get_n_conjunctions(self):
+        return max(sampler.get_n_conjunctions() for sampler in self.samplers)
+
+    def get_n_disjunctions(self):
+        return max(sampler.get_n_disjunctions() for sampler in self.samplers)
+
+    def get_state_bound(self):
+        return max(sampler.get_state_bound() for sampler in self.samplers)
+
 class UntilTaskSampler(DFASampler):
     def __init__(self, propositions, min_levels=1, max_levels=2, min_conjunctions=1 , max_conjunctions=2):
         super().__init__(propositions)
@@ -112,6 +126,10 @@ class UntilTaskSampler(DFASampler):
     def get_n_disjunctions(self):
         return 1
 
+    def get_state_bound(self):
+        # Remaining levels of each conjunct, or the rejecting sink
+        return (self.levels[1] + 1)**self.conjunctions[1] + 1
+
     def _sample(self):
         # Sampling a conjuntion of *n_conjs* (not p[0]) Until (p[1]) formulas of *n_levels* levels
         n_conjs = random.randint(*self.conjunctions)
@@ -205,6 +223,10 @@ class CompositionalUntilTaskSampler(DFASampler):
     def get_n_disjunctions(self):
         return 1
 
+    def get_state_bound(self):
+        # Remaining levels, or the rejecting sink
+        return self.levels[1] + 2
+
     def get_size_bound(self):
         return self._get_size_bound()*self.get_n_disjunctions()*self.get_n_conjunctions()
 
@@ -294,6 +316,10 @@ class EventuallySampler(DFASampler):
     def get_n_disjunctions(self):
         return 1
 
+    def get_state_bound(self):
+        # Remaining levels of each conjunct
+        return (self.levels[1] + 1)**self.conjunctions[1]
+
     def _sample(self):
         conjs = random.randint(*self.conjunctions)
         seqs = tuple(self.sample_sequence() for _ in range(conjs))
@@ -392,6 +418,10 @@ class CompositionalEventuallySampler(DFASampler):
     def get_n_disjunctions(self):
         return 1
 
+    def get_state_bound(self):
+        # Remaining levels
+        return self.levels[1] + 1
+
     def get_size_bound(self):
         return self._get_size_bound()*self.get_n_disjunctions()*self.get_n_conjunctions()
 
@@ -488,6 +518,9 @@ class AdversarialEnvSampler(DFASampler):
     def get_n_disjunctions(self):
         return 1
 
+    def get_state_bound(self):
+        return 3
+
 class ReachAvoidFixSampler(DFASampler):
     def __init__(self, propositions, min_levels=1, max_levels=2, min_conjunctions=1 , max_conjunctions=2):
         super().__init__(propositions)
@@ -520,6 +553,10 @@ class ReachAvoidFixSampler(DFASampler):
     def get_n_disjunctions(self):
         return 1
 
+    def get_state_bound(self):
+        # Remaining levels of each conjunct and the recovery mode
+        return 2*(self.levels[1] + 1)**self.conjunctions[1]
+
     def _sample(self):
         # Sampling a conjuntion of *n_conjs* (not p[0]) Until (p[1]) formulas of *n_levels* levels
         n_conjs = random.randint(*self.conjunctions)
@@ -620,6 +657,10 @@ class CompositionalReachAvoidFixSampler(DFASampler):
     def get_n_disjunctions(self):
         return 1
 
+    def get_state_bound(self):
+        # Remaining levels and the recovery mode
+        return 2*(self.levels[1] + 1)
+
     def get_size_bound(self):
         return self._get_size_bound()*self.get_n_disjunctions()*self.get_n_conjunctions()
 
@@ -711,6 +752,10 @@ class ParitySampler(DFASampler):
     def get_n_disjunctions(self):
         return 1
 
+    def get_state_bound(self):
+        # Remaining levels of each conjunct and the recovery mode
+        return 2*(self.levels[1] + 1)**self.conjunctions[1]
+
     def _sample(self):
         # Sampling a conjuntion of *n_conjs* (not p[0]) Until (p[1]) formulas of *n_levels* levels
         n_conjs = random.randint(*self.conjunctions)
@@ -811,6 +856,10 @@ class CompositionalParitySampler(DFASampler):
     def get_n_disjunctions(self):
         return 1
 
+    def get_state_bound(self):
+        # Remaining levels and the recovery mode
+        return 2*(self.levels[1] + 1)
+
     def get_size_bound(self):
         return self._get_size_bound()*self.get_n_disjunctions()*self.get_n_conjunctions()
 
@@ -898,6 +947,10 @@ class GeneralDFASampler(DFASampler):
     def get_n_disjunctions(self):
         return 1
 
+    def get_state_bound(self):
+        # Including the accepting and rejecting sinks, mutations do not add states
+        return self.max_size + 2
+
     def reach_avoid_sampler(self, prob_stutter=0.9):
         n_tokens = len(self.propositions)
         assert n_tokens > 1
@@ -1002,6 +1055,9 @@ class CompositionalGeneralDFASampler(DFASampler):
     def get_n_disjunctions(self):
         return 1
 
+    def get_state_bound(self):
+        return self.general_dfa.get_state_bound()
+
     def get_size_bound(self):
         return self.general_dfa.get_size_bound()*self.max_conjs
 
@@ -0,0 +1,106 @@
+from collections import OrderedDict
+
+import numpy as np
+from stable_baselines3.common import env_util
+from stable_baselines3.common.vec_env import VecEnv
+
+from compiled_dfa import goal_ints
+
+
+class DFAVecEnv(VecEnv):
+    """
+    Steps N DFAEnvs together: their base envs are stepped one by one, then all
+    the N goals are advanced at once through the progression cache of the first
+    DFAEnv, which is shared by all of them, so each distinct (goal, event) pair
+    of the step is progressed (or looked up) once. Observations are batched
+    {"features", "dfa"} arrays and the envs are reset when they are done, like
+    in DummyVecEnv. Goals are grouped by their ints, see DFAGoal.
+    """
+
+    def __init__(self, envs):
+        self.envs = list(envs)
+        env = self.envs[0]
+        super().__init__(len(self.envs), env.observation_space, env.action_space)
+        self.progress = env.progress
+        self.buf_features = np.zeros((self.num_envs,) + env.observation_space["features"].shape, dtype=env.observation_space["features"].dtype)
+        self.buf_dfa = np.zeros((self.num_envs,) + env.observation_space["dfa"].shape, dtype=env.observation_space["dfa"].dtype)
+        self.buf_rews = np.zeros(self.num_envs, dtype=np.float32)
+        self.buf_dones = np.zeros(self.num_envs, dtype=bool)
+        self.actions = None
+
+    def step_async(self, actions):
+        self.actions = actions
+
+    def step_wait(self):
+        infos = []
+        events = []
+        for i, env in enumerate(self.envs):
+            next_obs, reward, done, info = env.env.step(self.actions[i])
+            env.obs = next_obs
+            self.buf_features[i] = next_obs
+            self.buf_rews[i] = reward
+            self.buf_dones[i] = done
+            events.append(env.get_events())
+            infos.append(info)
+
+        # Envs with the same goal and event share a single progression
+        groups = OrderedDict()
+        for i, (env, event) in enumerate(zip(self.envs, events)):
+            event = tuple(event) if isinstance(event, list) else event
+            groups.setdefault((goal_ints(env.dfa_goal), event), []).append(i)
+        for (_, event), inds in groups.items():
+            next_dfa_goal, changed, dfa_reward, dfa_done, int_seq = self.progress(self.envs[inds[0]].dfa_goal, event)
+            for i in inds:
+                env = self.envs[i]
+                env.dfa_goal = next_dfa_goal
+                if changed:
+                    env.dfa_goal_int_seq = int_seq
+                self.buf_dfa[i] = env.dfa_goal_int_seq
+                self.buf_rews[i] += dfa_reward
+                self.buf_dones[i] |= dfa_done
+
+        for i, env in enumerate(self.envs):
+            if self.buf_dones[i]:
+                infos[i]["terminal_observation"] = {"features": self.buf_features[i].copy(), "dfa": self.buf_dfa[i].copy()}
+                self._save_obs(i, env.reset())
+        return self._obs_from_buf(), np.copy(self.buf_rews), np.copy(self.buf_dones), infos
+
+    def reset(self):
+        for i, env in enumerate(self.envs):
+            self._save_obs(i, env.reset())
+        return self._obs_from_buf()
+
+    def _save_obs(self, i, obs):
+        self.buf_features[i] = obs["features"]
+        self.buf_dfa[i] = obs["dfa"]
+
+    def _obs_from_buf(self):
+        return {"features": np.copy(self.buf_features), "dfa": np.copy(self.buf_dfa)}
+
+    def close(self):
+        for env in self.envs:
+            env.close()
+
+    def seed(self, seed=None):
+        if seed is None:
+            return [env.seed(None) for env in self.envs]
+        return [env.seed(seed + i) for i, env in enumerate(self.envs)]
+
+    def get_images(self):
+        return [env.render(mode="rgb_array") for env in self.envs]
+
+    def _get_target_envs(self, indices):
+        return [self.envs[i] for i in self._get_indices(indices)]
+
+    def get_attr(self, attr_name, indices=None):
+        return [getattr(env, attr_name) for env in self._get_target_envs(indices)]
+
+    def set_attr(self, attr_name, value, indices=None):
+        for env in self._get_target_envs(indices):
+            setattr(env, attr_name, value)
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        return [getattr(env, method_name)(*method_args, **method_kwargs) for env in self._get_target_envs(indices)]
+
+    def env_is_wrapped(self, wrapper_class, indices=None):
+        return [env_util.is_wrapped(env, wrapper_class) for env in self._get_target_envs(indices)]
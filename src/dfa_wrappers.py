@@ -4,11 +4,32 @@ from gym import spaces
 import random
 from dfa_samplers import getDFASampler
 from dfa.utils import min_distance_to_accept_by_state
+from compiled_dfa import CompiledDFA, DFAGoal, TableEncoding, compile_cnf, goal_ints
 from functools import reduce
+from collections import OrderedDict
 import operator as OP
 
+class DFADynamics:
+    """
+    The symbolic dynamics of the env wrapped by a DFAEnv (see get_dynamics of
+    the envs) with the size N of the DFA encodings: what the DISS workers need
+    of the env, without its sampler and random state, and its TableEncoding
+    in the table mode.
+    """
+
+    def __init__(self, dynamics, N, table_encoding=None):
+        self.dynamics = dynamics
+        self.N = N
+        self.table_encoding = table_encoding
+
+    def __getattr__(self, name):
+        if name.startswith("_") or name in ("dynamics", "table_encoding"): # Not set yet while unpickling
+            raise AttributeError(name)
+        return getattr(self.dynamics, name)
+
+
 class DFAEnv(gym.Wrapper):
-    def __init__(self, env, dfa_sampler=None, reject_reward=-1):
+    def __init__(self, env, dfa_sampler=None, reject_reward=-1, progression_cache_size=10000, dfa_encoding="int_seq"):
         super().__init__(env)
         self.propositions = self.env.get_propositions()
         self.sampler = getDFASampler(dfa_sampler, self.propositions)
@@ -20,8 +41,20 @@ class DFAEnv(gym.Wrapper):
         self.dfa_n_disjunctions = self.sampler.get_n_disjunctions()
         self.per_dfa_int_seq_size = self.N // (self.dfa_n_conjunctions * self.dfa_n_disjunctions)
 
-        self.observation_space = spaces.Dict({"features": env.observation_space,
-                                              "dfa"     : spaces.Box(low=0, high=9, shape=(self.N,), dtype=np.int64)})
+        # int_seq: the decimal digits of the DFA ints, table: see TableEncoding
+        self.dfa_encoding = dfa_encoding
+        if dfa_encoding == "int_seq":
+            self.table_encoding = None
+            self.dfa_obs_size = self.N
+            self.observation_space = spaces.Dict({"features": env.observation_space,
+                                                  "dfa"     : spaces.Box(low=0, high=9, shape=(self.N,), dtype=np.int64)})
+        elif dfa_encoding == "table":
+            self.table_encoding = TableEncoding(self.propositions, self.sampler.get_state_bound(), self.dfa_n_conjunctions, self.dfa_n_disjunctions)
+            self.dfa_obs_size = self.table_encoding.size
+            self.observation_space = spaces.Dict({"features": env.observation_space,
+                                                  "dfa"     : spaces.Box(low=0, high=self.table_encoding.max_states, shape=(self.dfa_obs_size,), dtype=self.table_encoding.dtype)})
+        else:
+            raise ValueError(f"Unknown DFA encoding: {dfa_encoding}")
 
         # self.observation_space = spaces.Dict({"features": env.observation_space,
         #                                       "dfa"     : spaces.MultiBinary(n=self.N)})
@@ -31,10 +64,16 @@ class DFAEnv(gym.Wrapper):
 
         self.reject_reward = reject_reward
 
+        # (goal ints, event) -> (next goal, changed, reward, done, int seq), least recently used first
+        self.progression_cache = OrderedDict()
+        self.progression_cache_size = progression_cache_size
+        self.progression_hits = 0
+        self.progression_misses = 0
+
     def reset(self):
         self.obs = self.env.reset()
         self.dfa_goal = self.sampler.sample()
-        self.dfa_goal_int_seq = self._to_int_seq(self.dfa_goal)
+        self.dfa_goal_int_seq = self.encode(self.dfa_goal)
         dfa_obs = {"features": self.obs, "dfa": self.dfa_goal_int_seq}
         return dfa_obs
 
@@ -45,16 +84,11 @@ class DFAEnv(gym.Wrapper):
         # progressing the DFA formula
         truth_assignment = self.get_events()
 
-        old_dfa_goal = self.dfa_goal
-        self.dfa_goal = self._advance(self.dfa_goal, truth_assignment)
+        self.dfa_goal, changed, dfa_reward, dfa_done, int_seq = self.progress(self.dfa_goal, truth_assignment)
         self.obs      = next_obs
 
-        if old_dfa_goal != self.dfa_goal:
-            dfa_reward, dfa_done = self.get_dfa_reward(old_dfa_goal, self.dfa_goal)
-            # dfa_reward, dfa_done = self.get_depth_reward(old_dfa_goal, self.dfa_goal)
-            self.dfa_goal_int_seq = self._to_int_seq(self.dfa_goal)
-        else:
-            dfa_reward, dfa_done = 0.0, False
+        if changed:
+            self.dfa_goal_int_seq = int_seq
 
         dfa_obs = {"features": self.obs, "dfa": self.dfa_goal_int_seq}
 
@@ -68,17 +102,56 @@ class DFAEnv(gym.Wrapper):
 
         return dfa_obs, reward, done, info
 
+    def progress(self, dfa_goal, truth_assignment):
+        """
+        Cached progression of dfa_goal by truth_assignment: the next goal, whether
+        it changed, its reward and done flag (0 and False if it did not change),
+        and its int seq encoding.
+        """
+        event = tuple(truth_assignment) if isinstance(truth_assignment, list) else truth_assignment
+        key = (goal_ints(dfa_goal), event)
+        entry = self.progression_cache.get(key)
+        if entry is not None:
+            self.progression_hits += 1
+            self.progression_cache.move_to_end(key)
+            return entry
+        self.progression_misses += 1
+        next_dfa_goal = self._advance(dfa_goal, truth_assignment)
+        if next_dfa_goal.ints != key[0]:
+            dfa_reward, dfa_done = self.get_dfa_reward(dfa_goal, next_dfa_goal)
+            # dfa_reward, dfa_done = self.get_depth_reward(dfa_goal, next_dfa_goal)
+            entry = (next_dfa_goal, True, dfa_reward, dfa_done, self.encode(next_dfa_goal))
+        else:
+            entry = (dfa_goal, False, 0.0, False, None)
+        self.progression_cache[key] = entry
+        while len(self.progression_cache) > self.progression_cache_size:
+            self.progression_cache.popitem(last=False)
+        return entry
+
+    def progression_hit_rate(self):
+        n = self.progression_hits + self.progression_misses
+        return self.progression_hits / n if n > 0 else 0.0
+
     def step_given_obs(self, obs, action, time):
         raise NotImplemented
 
+    def get_dynamics(self):
+        return DFADynamics(self.env.get_dynamics(), self.N, self.table_encoding)
+
+    def encode(self, dfa_goal):
+        """ The dfa observation of dfa_goal """
+        if self.table_encoding is not None:
+            return self.table_encoding.encode(dfa_goal)
+        return self._to_int_seq(dfa_goal)
+
     def _to_monolithic_dfa(self, dfa_goal):
         return reduce(OP.and_, map(lambda dfa_clause: reduce(OP.or_, dfa_clause), dfa_goal))
 
     def get_dfa_reward(self, old_dfa_goal, dfa_goal):
-        mono_dfa = self._to_monolithic_dfa(dfa_goal)
-        if mono_dfa._label(mono_dfa.start):
+        mono_dfa = compile_cnf(dfa_goal)
+        if mono_dfa.labels[0]:
             return 1.0, True
-        if mono_dfa.find_word() is None:
+        if mono_dfa.is_empty():
             return -1.0, True
         return 0.0, False
 
@@ -108,7 +181,12 @@ class DFAEnv(gym.Wrapper):
         return depth_reward, False
 
     def _advance(self, dfa_goal, truth_assignment):
-        return tuple(tuple(dfa.advance(truth_assignment).minimize() for dfa in dfa_clause) for dfa_clause in dfa_goal)
+        # The advanced DFAs are backed by the tables of their compiled minimal DFAs
+        compiled = [[CompiledDFA.from_dfa(dfa).advance(truth_assignment).minimize() for dfa in dfa_clause] for dfa_clause in dfa_goal]
+        return DFAGoal(
+            [[dfa.to_dfa() for dfa in dfa_clause] for dfa_clause in compiled],
+            tuple(tuple(dfa.to_int() for dfa in dfa_clause) for dfa_clause in compiled)
+        )
 
     def get_events(self):
         return self.env.get_events()
@@ -125,7 +203,7 @@ class DFAEnv(gym.Wrapper):
         dfa_int_str = "".join(str(int(i)) for i in dfa_int_seq.squeeze().tolist())
         dfa_int = int(dfa_int_str)
         # dfa_int = int(dfa_int_str, 2)
-        dfa = DFA.from_int(dfa_int, self.propositions)
+        dfa = CompiledDFA.from_int(dfa_int, self.propositions).to_dfa()
         return dfa
 
     def _from_int_seq(self, dfa_int_seq):
@@ -133,9 +211,9 @@ class DFAEnv(gym.Wrapper):
 
     def _to_int_seq(self, dfa_goal):
         seqs = []
-        for dfa_clause in dfa_goal:
-            for dfa in dfa_clause:
-                seqs.append(self.get_int_seq(dfa.to_int()))
+        for dfa_clause in goal_ints(dfa_goal):
+            for dfa_int in dfa_clause:
+                seqs.append(self.get_int_seq(dfa_int))
             for _ in range(self.dfa_n_disjunctions - len(dfa_clause)):
                 seqs.append(np.zeros(self.per_dfa_int_seq_size))
         for _ in range(self.dfa_n_conjunctions - len(dfa_goal)):
@@ -0,0 +1,87 @@
+"""
+Cache of DISS relabel results keyed by the lifted event trace.
+
+Many failed episodes produce the same sequence of events, so the candidate
+DFAs (and their energies) that DISS found for a trace are stored under
+(events, target number of states, extra clauses, model id). The model id is
+a fingerprint of the weights at the start of each bucket of consecutive
+weight versions, so versions, which restart at 0 every run, never serve the
+results of another run or checkpoint from a persisted cache.
+A repeated trace can then be relabeled by sampling from the cached candidates
+instead of running the SAT-backed search again. The cache is a bounded LRU
+and can optionally be persisted to disk between runs.
+"""
+
+import os
+import pickle
+from collections import OrderedDict
+
+
+class DissResultCache():
+
+    def __init__(self, max_size=10000, path=None, version_bucket_size=50):
+        """
+            max_size:
+                - (int) maximum number of cached traces, the least recently used one is evicted first
+            path:
+                - (str) if given, the cache is loaded from and saved to this file
+            version_bucket_size:
+                - (int) number of consecutive weight versions that share cached results, see model_id
+        """
+        self.max_size = max_size
+        self.path = path
+        self.version_bucket_size = version_bucket_size
+        self.entries = OrderedDict()
+        self.bucket = None
+        self.bucket_model_id = None
+        self.hits = 0
+        self.misses = 0
+        if self.path is not None and os.path.exists(self.path):
+            with open(self.path, "rb") as f:
+                self.entries = pickle.load(f)
+            self._evict()
+
+    def model_id(self, version, fingerprint):
+        """ The fingerprint() of the weights at the start of the bucket of version, fingerprint is only called on a new bucket """
+        bucket = version // self.version_bucket_size
+        if bucket != self.bucket:
+            self.bucket = bucket
+            self.bucket_model_id = fingerprint()
+        return self.bucket_model_id
+
+    def key(self, events_clean, target_num_states, extra_clauses, model_id):
+        extra_clauses_id = None if extra_clauses is None else getattr(extra_clauses, "__qualname__", repr(extra_clauses))
+        return (tuple(events_clean), target_num_states, extra_clauses_id, model_id)
+
+    def get(self, key):
+        candidates = self.entries.get(key)
+        if candidates is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return candidates
+
+    def put(self, key, candidates):
+        self.entries[key] = tuple(candidates)
+        self.entries.move_to_end(key)
+        self._evict()
+
+    def _evict(self):
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def hit_rate(self):
+        n = self.hits + self.misses
+        return self.hits / n if n > 0 else 0.0
+
+    def save(self):
+        if self.path is None:
+            return
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(self.entries, f)
+        os.replace(tmp_path, self.path)
+
+    def __len__(self):
+        return len(self.entries)
@@ -9,6 +9,8 @@ import numpy as np
 import gym
 from stable_baselines3 import DQN
 
+from compiled_dfa import CompiledDFA
+
 
 
 class NNPolicyWrapper:
@@ -75,119 +77,193 @@ class NNPolicyWrapper:
             return {'features': torch.unsqueeze(torch.from_numpy(feature), dim=0).to(self.policy.device), 'dfa': torch.unsqueeze(torch.from_numpy(bin_seq), dim=0).to(self.policy.device)}
 
     def get_binary_seq(self, dfa):
+        if getattr(self.env, "table_encoding", None) is not None:
+            return self.env.table_encoding.encode(((dfa,),))
         binary_string = bin(dfa.to_int())[2:]
         binary_seq = np.array([int(i) for i in binary_string])
         return np.pad(binary_seq, (self.env.N - binary_seq.shape[0], 0), 'constant', constant_values=(0, 0))
 
 
+class ObservationTable:
+    """
+    Intern table of observations: each unique observation is stored once, in a
+    contiguous array, and the demos, prefix trees and paths carry its int id.
+    """
+
+    def __init__(self, obs_shape, obs_type, capacity=1024):
+        self.obs_shape = obs_shape
+        self.obs_type = obs_type
+        self.ids = {}
+        self.obss = np.empty((capacity,) + tuple(obs_shape), dtype=obs_type)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, obs_id):
+        return self.obss[obs_id]
+
+    def gather(self, obs_ids):
+        return self.obss[np.asarray(obs_ids, dtype=np.int64)]
+
+    def intern(self, obs):
+        obs = np.ascontiguousarray(obs, dtype=self.obs_type)
+        key = obs.tobytes()
+        obs_id = self.ids.get(key)
+        if obs_id is None:
+            obs_id = len(self.ids)
+            if obs_id == len(self.obss):
+                self.obss = np.concatenate([self.obss, np.empty_like(self.obss)])
+            self.obss[obs_id] = obs
+            self.ids[key] = obs_id
+        return obs_id
+
+    def intern_batch(self, obss):
+        return [self.intern(obs) for obs in obss]
+
+
+class PrefixTreeEdges:
+    """
+    The part of the edge probabilities of a prefix tree that does not depend on
+    the concept: the probabilities of the env edges, and the observations and
+    actions of the ego edges, batched for the q-network.
+    """
+
+    def __init__(self, tree: PrefixTree, env: gym.Env, observations: ObservationTable):
+        self.env_edge_probs = {}
+        self.ego_edges = []
+        ego_obs_ids = []
+        ego_acts = []
+        env_edges = []
+        env_obs_ids = [] # (prev_obs_id, act, obs_id) of each env edge
+        for tree_edge in tree.tree.edges:
+            v,w = tree_edge
+            if tree.is_ego(v):
+                _, next_act = tree.state(w) # this is (obs_id, next_act)
+                self.ego_edges.append(tree_edge)
+                ego_obs_ids.append(tree.state(v)) # this is obs_id
+                ego_acts.append(next_act)
+            else:
+                prev_obs_id, act = tree.state(v) # this is (prev_obs_id, act)
+                env_edges.append(tree_edge)
+                env_obs_ids.append((prev_obs_id, act, tree.state(w))) # tree.state(w) is obs_id
+        if env_edges and hasattr(env, "transition_probabilities"):
+            prev_obs_ids, acts, obs_ids = map(list, zip(*env_obs_ids))
+            probs = env.transition_probabilities(observations.gather(prev_obs_ids), acts, observations.gather(obs_ids))
+            self.env_edge_probs = dict(zip(env_edges, probs.tolist()))
+        else:
+            for tree_edge, (prev_obs_id, act, obs_id) in zip(env_edges, env_obs_ids):
+                self.env_edge_probs[tree_edge] = env.transition_probability(observations[prev_obs_id], act, observations[obs_id])
+        self.ego_obss = observations.gather(ego_obs_ids)
+        self.ego_acts = np.array(ego_acts, dtype=np.int64)
+
+
 class NNPlanner:
 
     def __init__(self, env, policy):
         self.env = env
         self.policy = policy
-        self.obs_shape = None
-        self.act_shape = None
-        self.obs_type = None
-        self.act_type = None
+        self.observations = None # The ObservationTable of the demos and sampled paths
+        self.edges_tree = None # The tree of tree_edges, DISS plans all its concepts on the same tree
+        self.tree_edges = None
 
-    def bytes2obs(self, byte):
-        return np.frombuffer(byte, dtype=self.obs_type).reshape(self.obs_shape)
-    def bytes2act(self, byte):
-        return np.frombuffer(byte, dtype=self.act_type).reshape(self.act_shape)
+    def get_tree_edges(self, tree):
+        if tree is not self.edges_tree:
+            self.edges_tree = tree
+            self.tree_edges = PrefixTreeEdges(tree, self.env, self.observations)
+        return self.tree_edges
 
     def plan(self, dfa_concept, tree, rationality=None):
 
         policy_wrapper = NNPolicyWrapper(self.policy, dfa_concept.dfa, self.env)
 
-        return NNMarkovChain(tree, policy_wrapper, dfa_concept.dfa, self.obs_shape, self.act_shape, self.obs_type, self.act_type)
+        return NNMarkovChain(tree, policy_wrapper, dfa_concept.dfa, self.observations, self.get_tree_edges(tree))
+
+    def plan_batch(self, dfa_concepts, tree):
+        """
+        Same chains as plan for each of the K concepts, with the edge probabilities of
+        all of them computed by one q-network forward over the K x (ego edges) batch.
+        """
+        tree_edges = self.get_tree_edges(tree)
+        policy_wrappers = [NNPolicyWrapper(self.policy, dfa_concept.dfa, self.env) for dfa_concept in dfa_concepts]
+        chains = [
+            NNMarkovChain(tree, policy_wrapper, policy_wrapper.dfa_goal, self.observations, tree_edges)
+            for policy_wrapper in policy_wrappers
+        ]
+        K, n_edges = len(chains), len(tree_edges.ego_edges)
+        ego_probs = [[] for _ in chains]
+        if K > 0 and n_edges > 0:
+            device = self.policy.device
+            features = torch.from_numpy(tree_edges.ego_obss)
+            bin_seqs = np.stack([policy_wrapper.get_binary_seq(policy_wrapper.dfa_goal) for policy_wrapper in policy_wrappers])
+            # Concept k is paired with all the ego edges in rows k * n_edges to (k + 1) * n_edges
+            obss = {
+                'features': features.repeat(K, *[1] * (features.dim() - 1)).to(device),
+                'dfa': torch.from_numpy(bin_seqs).repeat_interleave(n_edges, dim=0).to(device),
+            }
+            with torch.no_grad():
+                q_values = self.policy.policy.q_net(obss).reshape(K, n_edges, -1)
+            likelihoods = torch.softmax(q_values, dim=2)
+            acts = torch.from_numpy(tree_edges.ego_acts).long().to(device)
+            ego_probs = likelihoods.gather(2, acts.view(1, -1, 1).expand(K, -1, 1)).squeeze(2).cpu()
+
+        for chain, probs in zip(chains, ego_probs):
+            edge_probs = dict(tree_edges.env_edge_probs)
+            edge_probs.update(zip(tree_edges.ego_edges, probs))
+            chain.edge_probs_val = edge_probs
+        return chains
 
     def to_demo(self, obs_trc, act_trc):
         # start_action, *trc = trc
 
-        if self.obs_shape == None:
-            self.obs_shape = obs_trc.shape[1:]
-        if self.act_shape == None:
-            self.act_shape = act_trc.shape[1:]
-        if self.act_type == None:
-            self.act_type = act_trc.dtype
-        if self.obs_type == None:
-            self.obs_type = obs_trc.dtype
+        if self.observations is None:
+            self.observations = ObservationTable(obs_trc.shape[1:], obs_trc.dtype)
 
         # demo = [ (None, 'env'), (start_action, 'ego')]
         demo = []
-        for prev_obs, act, obs in zip(obs_trc, act_trc, obs_trc[1:]):
-            byte_act = act.tobytes()
-            byte_obs = obs.tobytes()
-            byte_prev_obs = prev_obs.tobytes()
+        obs_ids = self.observations.intern_batch(obs_trc)
+        acts = np.asarray(act_trc).reshape(len(act_trc), -1)[:, 0].tolist()
+        for prev_obs_id, act, obs_id in zip(obs_ids, acts, obs_ids[1:]):
             # alternate env and ego
             # env -> include what action was taken and what the previous state was - information needed to compute transition probability
             # ego -> just care about the action - information needed to compute policy probability
             demo.extend([
-                ((byte_prev_obs, byte_act), 'env'), # TODO double check that we can't simplify the information that needs to be here
-                (byte_obs, 'ego')
+                ((prev_obs_id, act), 'env'), # TODO double check that we can't simplify the information that needs to be here
+                (obs_id, 'ego')
                 ])
         return demo
 
-    def lift_path(self, byte_path):
+    def lift_path(self, id_path):
         path = []
-        for i, byte in enumerate(byte_path):
+        for i, el in enumerate(id_path):
             if i % 2 == 0:
-                path.append((self.bytes2obs(byte[0]), self.bytes2act(byte[1])))
+                path.append((self.observations[el[0]], el[1]))
             else:
-                path.append(self.bytes2obs(byte))
+                path.append(self.observations[el])
 
         return tuple(self.env.lift_path(path))
 
 class NNMarkovChain(AnnotatedMarkovChain):
 
-    def __init__(self, tree: PrefixTree, policy: NNPolicyWrapper, dfa_goal: DFA, obs_shape, act_shape, obs_type, act_type):
+    def __init__(self, tree: PrefixTree, policy: NNPolicyWrapper, dfa_goal: DFA, observations: ObservationTable, tree_edges: PrefixTreeEdges = None):
         self.tree = tree
         self.policy = policy
         self.dfa_goal = dfa_goal
-        self.obs_shape = obs_shape
-        self.act_shape = act_shape
-        self.obs_type = obs_type
-        self.act_type = act_type
+        self.observations = observations
         self.edge_probs_val = None
-
-
-    def bytes2obs(self, byte):
-        return np.frombuffer(byte, dtype=self.obs_type).reshape(self.obs_shape)
-    def bytes2act(self, byte):
-        return np.frombuffer(byte, dtype=self.act_type).reshape(self.act_shape)
-
+        self.tree_edges = tree_edges
+        self.negated_dfa_goal = None
 
     @property
     def edge_probs(self) -> dict[Edge, float]:
         """Returns the probablity of edges in the demo prefix tree."""
         if self.edge_probs_val == None:
-            edge_probs = {}
-            ego_edge_query_edges = []
-            ego_edge_query_obs = []
-            ego_edge_query_acts = []
-            for tree_edge in self.tree.tree.edges:
-                v,w = tree_edge
-                if self.tree.is_ego(v):
-                    byte_obs = self.tree.state(v) # this is obs
-                    obs = self.bytes2obs(byte_obs)
-                    _, next_byte_act = self.tree.state(w) # this is (obs, next_act)
-                    next_act = self.bytes2act(next_byte_act)
-
-                    ego_edge_query_edges.append(tree_edge)
-                    ego_edge_query_obs.append(obs)
-                    ego_edge_query_acts.append(next_act[0])
-
-                else:
-                    prev_byte_obs, byte_act = self.tree.state(v) # this is (prev_obs, act)
-                    prev_obs = self.bytes2obs(prev_byte_obs)
-                    act = self.bytes2act(byte_act)
-                    byte_obs = self.tree.state(w) # this is obs
-                    obs = self.bytes2obs(byte_obs)
-                    edge_probs[tree_edge] = self.policy.transition_probability(prev_obs, act[0], obs)
-
-            pol_probs = self.policy.policy_probability(np.array(ego_edge_query_obs), np.array(ego_edge_query_acts), batched=True)
+            if self.tree_edges is None:
+                self.tree_edges = PrefixTreeEdges(self.tree, self.policy.env, self.observations)
+            # Only the ego edges depend on the concept
+            edge_probs = dict(self.tree_edges.env_edge_probs)
+            pol_probs = self.policy.policy_probability(self.tree_edges.ego_obss, self.tree_edges.ego_acts, batched=True)
             
-            for tree_edge, pol_prob in zip(ego_edge_query_edges, pol_probs):
+            for tree_edge, pol_prob in zip(self.tree_edges.ego_edges, pol_probs):
                 edge_probs[tree_edge] = pol_prob
 
             self.edge_probs_val = edge_probs
@@ -206,160 +282,156 @@ class NNMarkovChain(AnnotatedMarkovChain):
            an ego winning path, but no ego winning paths exist that pass
            through the pivot.
         """
-        ATTEMPTS = 10
-        for i in range(ATTEMPTS):
-            path, prob, is_win = self._sample(pivot, win)
-            if is_win == win:
-                # print(i)
-                return path, prob
-
-
-    def _sample(self, pivot, win):
-        assert pivot > 0
-
-        # sample_lprob: float = 0  # Causally conditioned logprob.
-        # path = list(self.tree.prefix(pivot))
-        # if policy.end_of_episode(state):
-        #      moves = []
-        # else:
-        #     prev_ego = isinstance(state[-1], str)
-
-        #     actions = {0, 1, 3} if prev_ego else set(GW.dynamics.ACTIONS_C)
-        #     neighbors = self.tree.tree.neighbors(pivot)
-        #     neighbor_actions = {self.tree2policy[s][-1] for s in neighbors}
-        #     actions -= neighbor_actions
-
-        #     # HACK: Don't allow eoe counter-factuals!
-        #     if prev_ego and (neighbor_actions <= {3, 4}):
-        #         return None
-
-        #     tmp = {policy.transition(state, a) for a in actions}
-
-        #     moves = list(m for m in tmp if policy.psat(m) != float(not win))
-
-        # if not moves:
-        #     return None  # Couldn't deviate
-
-        if win:
-            # just sample from NN controller directly
-            return self.sample_positive_path(pivot)
-        else:
-            return self.sample_negative_path(pivot)
-
-        
-        # # Sample suffix to path conditioned on win.
-        # while moves:
-        #     # Apply bayes rule to get Pr(s' | is_sat, s).
-        #     priors = np.array([policy.prob(state, m) for m in moves])
-        #     likelihoods = np.array([policy.psat(m) for m in moves])
-        #     normalizer = policy.psat(state)
-
-        #     if not win:
-        #         likelihoods = 1 - likelihoods
-        #         normalizer = 1 - normalizer
-
-        #     probs =  priors * likelihoods / normalizer
-        #     try:
-        #         prob, state = random.choices(list(zip(probs, moves)), probs)[0]
-        #     except:
-        #         return None  # Numerical stability problem!
-
-        #     if policy.policy.dag.nodes[state[0]]['kind'] == 'ego':
-        #         sample_lprob += np.log(prob)
-
-        #     # Note: win/lose are strings so the below still works...
-        #     action = state[-1]
-        #     path.append(action)
-
-        #     if policy.end_of_episode(state):
-        #         moves = []
-        #     else:
-        #         prev_ego = isinstance(action, str)
-        #         # TODO: update to include ending episode action.
-        #         actions = {0, 1, 3} if prev_ego else set(GW.dynamics.ACTIONS_C)
-        #         moves = [policy.transition(state, a) for a in actions]
-        # return path, sample_lprob
-
-
-    def sample_positive_path(self, pivot):
-        # build the initial observation
-
-        if self.tree.is_ego(pivot):
-            byte_obs = self.tree.state(pivot) # this is obs
-            feature = self.bytes2obs(byte_obs)
-
-            bin_seq = self.policy.get_binary_seq(self.dfa_goal)
-            obs = {'features': np.expand_dims(feature, axis=0), 'dfa': np.expand_dims(bin_seq, axis=0)}
-
-            return self.simulate_from_ego(obs, pivot)
-        else:
-            prev_byte_obs, byte_act = self.tree.state(pivot) # this is (prev_obs, act)
-            feature = self.bytes2obs(prev_byte_obs)
-            act = self.bytes2act(byte_act)
-
-            bin_seq = self.policy.get_binary_seq(self.dfa_goal)
-            obs = {'features': np.expand_dims(feature, axis=0), 'dfa': np.expand_dims(bin_seq, axis=0)}
-
-            return self.simulate_from_env(obs, act, pivot)
-
-
-    def sample_negative_path(self, pivot):
-
-        if self.tree.is_ego(pivot):
-            byte_obs = self.tree.state(pivot) # this is obs
-            feature = self.bytes2obs(byte_obs)
-
-            # build the initial observation
-            negated_dfa_goal = ~self.dfa_goal
-            bin_seq = self.policy.get_binary_seq(negated_dfa_goal)
-            obs = {'features': np.expand_dims(feature, axis=0), 'dfa': np.expand_dims(bin_seq, axis=0)}
-
-            path, prob, is_win = self.simulate_from_ego(obs, pivot)
-            return path, prob, not is_win
-        else:
-            prev_byte_obs, byte_act = self.tree.state(pivot) # this is (prev_obs, act)
-            feature = self.bytes2obs(prev_byte_obs)
-            act = self.bytes2act(byte_act)
-
-            negated_dfa_goal = ~self.dfa_goal
-            bin_seq = self.policy.get_binary_seq(negated_dfa_goal)
-            obs = {'features': np.expand_dims(feature, axis=0), 'dfa': np.expand_dims(bin_seq, axis=0)}
-
-            path, prob, is_win = self.simulate_from_env(obs, act, pivot)
-            return path, prob, not is_win
-
-
-    def simulate_from_ego(self, obs, pivot):
-        path = list(self.tree.prefix(pivot))
-        # path = []
-        done = False
-        reward = 0
-        time = int(len(path)/2)
-        while not done:
-            action, _ = self.policy.predict(obs)
-            path.append((obs['features'].astype(self.obs_type).tobytes(), action.astype(self.act_type).tobytes() ))
-            obs, reward, done, info = self.policy.env.step_given_obs(obs, action.item(), time)
-            time = info["time"]
-            path.append(obs["features"].astype(self.obs_type).tobytes())
-
-        return path, None, reward > 0
-
-    def simulate_from_env(self, obs, act, pivot):
-        path = list(self.tree.prefix(pivot))
-        time = int(len(path)/2)
-        obs, reward, done, info = self.policy.env.step_given_obs(obs, act.item(),time)
-        path.append(obs['features'].astype(self.obs_type).tobytes())
-
-        done = False
-        reward = 0
-        time = int(len(path)/2)
-        while not done:
-            action, _ = self.policy.predict(obs)
-            path.append((obs['features'].astype(self.obs_type).tobytes(), action.astype(self.act_type).tobytes() ))
-            obs, reward, done, info = self.policy.env.step_given_obs(obs, action.item(), time)
-            time = info["time"]
-            path.append(obs["features"].astype(self.obs_type).tobytes())
-
-        return path, None, reward > 0
-
+        return self.sample_many([(pivot, win)])[0]
 
+    def sample_many(self, requests, attempts=10):
+        """
+        Batched sample for a list of (pivot, win) requests. The attempts of all the
+        requests are simulated together, as one observation batch, and a rollout
+        leaves the batch once it is done or once its request is decided, i.e., the
+        first of its attempts (in order) with the requested outcome is known.
+        Returns the (path, prob) pair, or None, of each request.
+        """
+        n_rollouts = len(requests) * attempts
+        request_inds = np.repeat(np.arange(len(requests)), attempts)
+        wins = [requests[r][1] for r in request_inds]
+        # Win samples follow the goal, lose samples its negation
+        if self.negated_dfa_goal is None:
+            self.negated_dfa_goal = ~self.dfa_goal
+        goals = {True: GoalProgress(self.dfa_goal, self.policy), False: GoalProgress(self.negated_dfa_goal, self.policy)}
+
+        paths = []
+        obs_ids = np.zeros(n_rollouts, dtype=np.int64) # The current observation of each rollout
+        forced_acts = np.full(n_rollouts, -1) # The action of an env pivot, taken before the policy's
+        for i, r in enumerate(request_inds):
+            pivot = requests[r][0]
+            assert pivot > 0
+            paths.append(list(self.tree.prefix(pivot)))
+            if self.tree.is_ego(pivot):
+                obs_ids[i] = self.tree.state(pivot) # this is obs_id
+            else:
+                obs_ids[i], forced_acts[i] = self.tree.state(pivot) # this is (prev_obs_id, act)
+        features = self.observations.gather(obs_ids)
+        times = np.array([len(path) // 2 for path in paths])
+        outcomes = [None] * n_rollouts # Whether the goal followed by each finished rollout was accepted
+        active = np.ones(n_rollouts, dtype=bool)
+
+        # The goals start from the events of the prefix, i.e., of its observations
+        prefix_events = {}
+        for r, (pivot, _) in enumerate(requests):
+            if pivot not in prefix_events:
+                prefix_obss = self.observations.gather([x for x in self.tree.prefix(pivot) if not isinstance(x, tuple)])
+                prefix_events[pivot] = self.policy.env.get_events_given_obss(prefix_obss)
+        # Env steps left to each rollout, an env steps at most until its time exceeds the timeout
+        timeout = getattr(self.policy.env, "timeout", None)
+        steps_left = lambda i: None if timeout is None else timeout + 1 - times[i]
+        dfa_states = []
+        for i, r in enumerate(request_inds):
+            goal = goals[wins[i]]
+            dfa_states.append(goal.progress(goal.start, prefix_events[requests[r][0]]))
+            accepted, decided = goal.outcome(dfa_states[i], steps_left(i))
+            if decided:
+                active[i] = False
+                outcomes[i] = accepted
+
+        results = [None] * len(requests)
+        undecided = set(range(len(requests)))
+        while True:
+            for r in list(undecided):
+                for i in range(r * attempts, (r + 1) * attempts):
+                    if outcomes[i] is None:
+                        break
+                    if outcomes[i]: # The goal it followed (negated for lose samples) was accepted
+                        results[r] = (paths[i], None)
+                        break
+                else:
+                    undecided.discard(r)
+                    continue
+                if results[r] is not None:
+                    undecided.discard(r)
+                    active[r * attempts:(r + 1) * attempts] = False
+            if not undecided:
+                return results
+
+            rows = np.flatnonzero(active)
+            forced = forced_acts[rows] >= 0
+            obs = {
+                'features': features[rows],
+                'dfa': np.array([goals[wins[i]].encoding(dfa_states[i]) for i in rows]),
+            }
+            actions, _ = self.policy.predict(obs)
+            actions = np.where(forced, forced_acts[rows], np.asarray(actions).reshape(-1))
+            forced_acts[rows] = -1
+            for i, action, f in zip(rows, actions, forced):
+                if not f:
+                    paths[i].append((int(obs_ids[i]), int(action)))
+
+            next_features, env_dones = self.step_features(features[rows], actions, times[rows])
+            events = self.policy.env.get_events_given_obss(next_features)
+            features[rows] = next_features
+            obs_ids[rows] = self.observations.intern_batch(next_features)
+            times[rows] += 1
+            for i, event, env_done in zip(rows, events, env_dones):
+                paths[i].append(int(obs_ids[i]))
+                goal = goals[wins[i]]
+                dfa_states[i] = goal.step(dfa_states[i], event)
+                accepted, decided = goal.outcome(dfa_states[i], steps_left(i))
+                if env_done or decided:
+                    active[i] = False
+                    outcomes[i] = accepted
+
+    def step_features(self, features, actions, times):
+        """ Next features and env done flags of a batch of features, see the step_from_obss of the dynamics """
+        return self.policy.env.step_from_obss(features, actions, times)
+
+
+class GoalProgress:
+    """
+    Progression of a goal DFA, compiled to tables, along the events of simulated
+    rollouts, with the rewards of DFAEnv.get_dfa_reward, the number of events
+    needed to accept and the policy encoding of each DFA state. State 0 is the start.
+    """
+
+    def __init__(self, dfa_goal: DFA, policy: NNPolicyWrapper):
+        self.dfa = CompiledDFA.from_dfa(dfa_goal)
+        self.policy = policy
+        self.start = 0
+        self.transitions = self.dfa.transitions.tolist()
+        self.labels = self.dfa.labels.tolist()
+        self.distances = self.dfa.min_distance_to_accept().tolist()
+        self.encodings = {}
+
+    def step(self, state, event):
+        ind = self.dfa.input_inds.get(event)
+        if ind is None: # Including the empty event
+            return state
+        return self.transitions[state][ind]
+
+    def progress(self, state, events):
+        for event in events:
+            state = self.step(state, event)
+        return state
+
+    def reward(self, state):
+        if self.labels[state]:
+            return 1.0, True
+        if self.distances[state] == float("inf"): # Cannot be accepted anymore
+            return -1.0, True
+        return 0.0, False
+
+    def outcome(self, state, steps_left=None):
+        """
+        (accepted, decided): decided once the goal is accepted, rejected, or cannot
+        be accepted within steps_left more events, i.e., env steps.
+        """
+        reward, done = self.reward(state)
+        if done:
+            return reward > 0, True
+        if steps_left is not None and self.distances[state] > steps_left:
+            return False, True
+        return False, False
+
+    def encoding(self, state):
+        if state not in self.encodings:
+            self.encodings[state] = self.policy.get_binary_seq(self.dfa.with_start(state))
+        return self.encodings[state]
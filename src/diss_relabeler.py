@@ -9,7 +9,7 @@ from dfa import DFA
 from dfa.utils import dfa2dict
 from dfa.utils import dict2dfa
 
-from concept_class import PartialDFAIdentifier
+from concept_class import PartialDFAIdentifier, identification_stats, enumerative_search
 from diss import LabeledExamples
 from diss import diss
 from diss.concept_classes import DFAConcept
@@ -19,312 +19,582 @@ from stable_baselines3.common.type_aliases import DictReplayBufferSamples
 
 from diss_interface import NNPlanner
 
-import multiprocessing
-from softDQN import SoftDQN
+import io
+import os
+import time
+import tempfile
 import pickle
+from collections import deque
+from typing import Callable, NamedTuple, Optional
+from softDQN import SoftDQN
+from diss_worker_pool import DissWorkerPool, RelabelTask, RelabelResult, SharedWeights
+from diss_cache import DissResultCache
+from chain_sampler import ChainSampler
+from compiled_dfa import CompiledDFA
+from relabel_stats import RelabelStats
+import identification_cache
+from sat_deadline import time_limit, IdentificationTimeout
 
 DISS_ARGMAX = False
 DISS_SOFTMAX_SAMPLE = not DISS_ARGMAX
 
-def get_diss_dfas(feature, action, propositions, extra_clauses, target_num_states, q):
-    try:
-        # sample as many DFAs as we can afford to without impacting the fps
-        # maybe 10 to 100?
-        dfa_sample_size = 10
-        dfas = []
-        energies = []
-        model = SoftDQN.load("data/model")
-        env = None
-        with open('env.pkl', 'rb') as f:
-            env = pickle.load(f)
-        if env is not None:
-            planner = NNPlanner(env, model)
-            events_clean = tuple(filter(lambda x: x != "", env.get_events_given_obss(feature)))
-            universal = DFA(
-                start=True,
-                inputs=propositions,
-                outputs={True, False},
-                label=lambda s: s,
-                transition=lambda s, c: True,
-            )
-            identifer = PartialDFAIdentifier( # possible change this identifier? to decomposed?
-                partial = universal,
-                base_examples = LabeledExamples(negative=[], positive=[events_clean]),
-                try_reach_avoid=True, # TODO check this flag
-                encoding_upper=env.N,
-                max_dfas=1,
-                # bounds=(None,None),
-                bounds=(target_num_states, target_num_states),
-                extra_clauses=extra_clauses,
-            )
-            dfa_search = diss(
-                demos=[planner.to_demo(feature, action)],
-                to_concept=identifer,
-                to_chain=planner.plan,
-                competency=lambda *_: 10,
-                lift_path=planner.lift_path,
-                n_iters=100, # maximum number of iterations
-                reset_period=30,
-                surprise_weight=1,
-                size_weight=1/50,
-                sgs_temp=1/4,
-                example_drop_prob=1e-2, #1e-2,
-                synth_timeout=1,
-            )
-            # """ take a hyperparameter number of dfas from dfa_search and then,
-            #         1) sample from metadata['energy'], or
-            #         2) take argmax over energy """
+def get_diss_dfas(feature, action, propositions, extra_clauses, target_num_states, model, env, time_budget=None, stats=None, incremental_sat=False, portfolio=(), portfolio_mode="first", portfolio_budget=None,
+                  search="diss", search_workers=0, search_chunk_size=1):
+    """
+    time_budget is the wall-clock budget (in seconds) of the search. Once it is
+    spent, the search stops and the lowest-energy DFA found so far is returned.
+    If stats is a dict, the number of DISS iterations and their time are added to it.
+    With incremental_sat, the identifications reuse the SAT solvers of the previous ones.
+    Otherwise, a non-empty portfolio runs each identification under all its configurations at once.
+    With search="enumerative", the first DFAs consistent with the demo are scored instead of running DISS,
+    with search_workers forked processes (search_chunk_size DFAs at a time) or, with no workers, with one
+    batched q_net call, see enumerative_search and NNPlanner.plan_batch.
+    env is the DFAEnv or just its dynamics, see DFAEnv.get_dynamics.
+    """
+    start_time = time.time()
+    truncated = False
+    # sample as many DFAs as we can afford to without impacting the fps
+    # maybe 10 to 100?
+    dfa_sample_size = 10
+    dfas = []
+    energies = []
+    planner = NNPlanner(env, model)
+    events_clean = tuple(filter(lambda x: x != "", env.get_events_given_obss(feature)))
+    universal = DFA(
+        start=True,
+        inputs=propositions,
+        outputs={True, False},
+        label=lambda s: s,
+        transition=lambda s, c: True,
+    )
+    identifer = PartialDFAIdentifier( # possible change this identifier? to decomposed?
+        partial = universal,
+        base_examples = LabeledExamples(negative=[], positive=[events_clean]),
+        try_reach_avoid=True, # TODO check this flag
+        encoding_upper=env.N,
+        max_dfas=1,
+        # bounds=(None,None),
+        bounds=(target_num_states, target_num_states),
+        extra_clauses=extra_clauses,
+        incremental=incremental_sat,
+        portfolio=portfolio,
+        portfolio_mode=portfolio_mode,
+        portfolio_budget=portfolio_budget,
+    )
+    demo = planner.to_demo(feature, action)
+    if search == "enumerative":
+        dfa_search = enumerative_search(
+            demos=[demo],
+            identifer=identifer,
+            to_chain=planner.plan,
+            competency=lambda *_: 10,
+            n_iters=dfa_sample_size,
+            size_weight=1/50,
+            n_workers=search_workers,
+            chunk_size=search_chunk_size,
+            to_chains=planner.plan_batch,
+        )
+    else:
+        dfa_search = diss(
+            demos=[demo],
+            to_concept=identifer,
+            to_chain=planner.plan,
+            competency=lambda *_: 10,
+            lift_path=planner.lift_path,
+            n_iters=100, # maximum number of iterations
+            reset_period=30,
+            surprise_weight=1,
+            size_weight=1/50,
+            sgs_temp=1/4,
+            example_drop_prob=1e-2, #1e-2,
+            synth_timeout=1,
+        )
+    # """ take a hyperparameter number of dfas from dfa_search and then,
+    #         1) sample from metadata['energy'], or
+    #         2) take argmax over energy """
+    # The budget also bounds the SAT calls of the identifications, see sat_deadline.py
+    with time_limit(None if time_budget is None else time_budget - (time.time() - start_time)):
+        try:
             for i, (data, concept, metadata) in zip(range(dfa_sample_size), dfa_search):
                 dfas.append(concept.dfa)
                 energies.append(metadata['energy'])
-
-            if DISS_ARGMAX:
-                idx_min = np.argmin(energies)
-                dfa_min = dfas[idx_min]
-                relabeled_dfa = dfa_min
-            elif DISS_SOFTMAX_SAMPLE:
-                exp_energies = np.exp(energies) # TODO make this temperature tuneable
-                likelihood = exp_energies / exp_energies.sum()
-                softmax_sampled_dfa = np.random.choice(dfas, p=likelihood)
-                relabeled_dfa = softmax_sampled_dfa
-            relabeled_dfa_int = relabeled_dfa.to_int()
-            q.put(relabeled_dfa_int)
-    except:
-        q.put(None)
+                if time_budget is not None and time.time() - start_time > time_budget:
+                    truncated = i + 1 < dfa_sample_size
+                    break
+        except IdentificationTimeout:
+            truncated = True
+
+    if stats is not None:
+        stats["diss_iters"] = len(dfas)
+        stats["diss_time"] = time.time() - start_time
+
+    if len(dfas) == 0:
+        return None, None, (), truncated
+
+    candidates = tuple((dfa.to_int(), float(energy)) for dfa, energy in zip(dfas, energies))
+    if truncated:
+        idx = np.argmin(energies)
+        dfa_int, energy = candidates[idx]
+    else:
+        dfa_int, energy = select_relabel(candidates)
+    return dfa_int, energy, candidates, truncated
+
+def select_relabel(candidates):
+    """ candidates is a sequence of (dfa_int, energy) pairs found by DISS """
+    dfa_ints, energies = zip(*candidates)
+    if DISS_ARGMAX:
+        idx = np.argmin(energies)
+    elif DISS_SOFTMAX_SAMPLE:
+        exp_energies = np.exp(energies) # TODO make this temperature tuneable
+        likelihood = exp_energies / exp_energies.sum()
+        idx = np.random.choice(len(dfa_ints), p=likelihood)
+    return dfa_ints[idx], energies[idx]
+
+class DissRelabelerConfig(NamedTuple):
+    """ Settings of a DissRelabeler and its workers, built once, e.g., from the command line arguments """
+    extra_clauses: Optional[Callable] = None
+    n_workers: int = 2
+    max_tasks_per_worker: Optional[int] = None # None (or 0) means never recycled
+    cache_size: int = 10000 # See DissResultCache
+    cache_path: Optional[str] = None
+    cache_version_bucket: int = 50
+    max_pending: int = 4 # DISS batches in flight, see submit
+    time_budget: Optional[float] = None # Soft, per trace, the search returns its best DFA so far
+    hard_time_limit: Optional[float] = None # Hard, per trace, the worker is killed and the trace is not relabeled
+    identification_cache_path: Optional[str] = None # None for a file in the log directory of the run
+    identification_cache_size: int = 100000
+    incremental_sat: bool = False
+    portfolio: tuple = () # See identification_portfolio.py
+    portfolio_mode: str = "first"
+    portfolio_budget: Optional[float] = None
+    search: str = "diss" # diss or enumerative, see get_diss_dfas
+    search_workers: int = 0
+    search_chunk_size: int = 1
+
+class PendingRelabel(NamedTuple):
+    batch_size: int
+    samples: DictReplayBufferSamples
+    relabeled_dfa_ints: list
+    futures: list # (index in the batch, cache key, future) for each submitted trace
+    submit_time: float
+
+    def done(self):
+        return all(future.done() for _, _, future in self.futures)
+
+class DissRelabelWorker():
+    """
+    Per-process state of a relabel worker. The model and the env dynamics are loaded once
+    when the worker starts and reused for all the traces it relabels. The q_net
+    weights are then kept up to date through the shared weights published by the learner.
+    """
+
+    def __init__(self, model_bytes, dynamics_bytes, weights, propositions, config, identification_cache_config=None):
+        if identification_cache_config is not None:
+            identification_cache.configure(**identification_cache_config)
+        self.model = SoftDQN.load(io.BytesIO(model_bytes))
+        self.dynamics = pickle.loads(dynamics_bytes)
+        self.weights = weights
+        self.weights_version = None
+        self.propositions = propositions
+        self.config = config # A DissRelabelerConfig
+
+    def __call__(self, task):
+        start_time = time.time()
+        self.weights_version = self.weights.load_into(self.model.policy.q_net, self.weights_version)
+        stats = {"weights_load_time": time.time() - start_time}
+        sat_calls, sat_time = identification_stats["calls"], identification_stats["time"]
+        id_cache = identification_cache.get_cache()
+        id_cache_hits, id_cache_misses, id_cache_evictions = id_cache.hits, id_cache.misses, id_cache.evictions
+        config = self.config
+        dfa_int, energy, candidates, truncated = get_diss_dfas(task.feature, task.action, self.propositions, config.extra_clauses, task.target_num_states, self.model, self.dynamics, config.time_budget, stats,
+                                                                  config.incremental_sat, config.portfolio, config.portfolio_mode, config.portfolio_budget,
+                                                                  config.search, config.search_workers, config.search_chunk_size)
+        stats["sat_calls"] = identification_stats["calls"] - sat_calls
+        stats["sat_time"] = identification_stats["time"] - sat_time
+        stats["id_cache_hits"] = id_cache.hits - id_cache_hits
+        stats["id_cache_misses"] = id_cache.misses - id_cache_misses
+        stats["id_cache_evictions"] = id_cache.evictions - id_cache_evictions
+        return RelabelResult(task.trace_id, dfa_int, energy, candidates, truncated=truncated, stats=stats)
 
 class DissRelabeler():
 
-    def __init__(self, model, env, extra_clauses=None):
+    def __init__(self, model, env, config=None):
+        self.config = DissRelabelerConfig() if config is None else config
         self.model = model
         self.env = env
         self.propositions = env.get_propositions()
+        self.inputs = sorted(self.propositions) # Columns of the transition tables
+        self.input_inds = {a: i for i, a in enumerate(self.inputs)}
         self.replay_buffer = model.replay_buffer
-        self.extra_clauses = extra_clauses
+        self.weights = None
+        self.pool = None # Started lazily on the first DISS relabel
+        self.next_trace_id = 0
+        self.cache = DissResultCache(max_size=self.config.cache_size, path=self.config.cache_path, version_bucket_size=self.config.cache_version_bucket)
+        self.pending = deque() # Submitted DISS batches that are not written to the replay buffer yet
+        self.identification_cache_config = {"path": self.config.identification_cache_path, "max_entries": self.config.identification_cache_size}
+        self.stats = RelabelStats()
+        self.replay_buffer.relabel_stats = self.stats
+        self.relabel_seconds = 0.0
+        self.n_relabeled = 0
 
         # self.num_states_upper = env.num_states_upper
 
     def relabel(self, relabeler_name, batch_size):
         if relabeler_name == "diss":
             self.relabel_diss(batch_size)
-        elif relabeler_name == "baseline_chain":
+            self.stats.log(self.model.logger)
+            return
+        start_time = time.time()
+        backlog = len(self.replay_buffer.not_relabeled_traces)
+        if relabeler_name == "baseline_chain":
             self.relabel_baseline_chain(batch_size)
         elif relabeler_name == "baseline_chain_sink":
             self.relabel_baseline_chain_sink(batch_size)
         else:
             raise NotImplemented
+        self.relabel_seconds += time.time() - start_time
+        self.n_relabeled += backlog - len(self.replay_buffer.not_relabeled_traces)
+        self.stats.log(self.model.logger)
+
+    def pop_relabel_stats(self):
+        """
+        Returns the relabel time and the number of traces relabeled since the
+        last call. DISS relabels count the time spent by the workers, divided
+        by the number of workers since they run in parallel.
+        """
+        stats = (self.relabel_seconds, self.n_relabeled)
+        self.relabel_seconds = 0.0
+        self.n_relabeled = 0
+        return stats
+
+    def get_goal_state_table(self, dfa_goal):
+        """
+        Compiles a relabeled goal, i.e., ((dfa,),) with a DFA or a CompiledDFA, into per-state tables:
+        transitions over the sorted propositions, the observation encoding of
+        the goal advanced to that state, its reward and done flags, and an id
+        that is equal for two states iff their advanced goals are the same.
+        """
+        (dfa,), = dfa_goal
+        compiled = dfa if isinstance(dfa, CompiledDFA) else CompiledDFA.from_dfa(dfa, self.inputs) # The start state is 0
+        n_states = compiled.n_states
+        encodings = np.zeros((n_states, self.env.dfa_obs_size), dtype=np.float32)
+        ids = np.zeros(n_states, dtype=np.int64)
+        encoding_ids = {}
+        for i in range(n_states):
+            encodings[i] = self.encode_dfa(compiled.with_start(i))
+            ids[i] = encoding_ids.setdefault(encodings[i].tobytes(), len(encoding_ids))
+        # Same as DFAEnv.get_dfa_reward: accepted, or no accepting state reachable
+        dead = compiled.min_distance_to_accept() == np.inf
+        rewards = np.where(compiled.labels, 1.0, np.where(dead, -1.0, 0.0)).astype(np.float32)
+        dones = compiled.labels | dead
+        return compiled.transitions, encodings, rewards, dones, ids
+
+    def get_int_seq(self, dfa_int):
+        # Same as DFAEnv._to_int_seq for a goal with a single DFA
+        int_seq = np.zeros(self.env.N, dtype=np.float32)
+        int_seq[:self.env.per_dfa_int_seq_size] = self.env.get_int_seq(dfa_int)
+        return int_seq
+
+    def encode_dfa(self, compiled):
+        # Same as DFAEnv.encode for a goal with a single DFA
+        if self.env.table_encoding is not None:
+            return self.env.table_encoding.encode(((compiled,),))
+        return self.get_int_seq(compiled.to_int())
 
     def step_and_write_relabeled_dfas(self, relabeled_dfa_goals, samples):
-
-        features, dfas = samples.observations["features"], samples.observations["dfa"]
-        actions = samples.actions
-        next_features, next_dfas = samples.next_observations["features"], samples.next_observations["dfa"]
-        dones = samples.dones
-        rewards = samples.rewards
-
-        end_of_episode_inds, end_of_step_inds = dones.squeeze().nonzero()
-
-        for init_dfa_goal, end_of_episode_ind, end_of_step_ind in zip(relabeled_dfa_goals, end_of_episode_inds, end_of_step_inds):
-
-            if init_dfa_goal is None: # If subprocess returns None, then do not relabel, just the old dfa
+        trace_inds = []
+        tables = []
+        for trace_ind, dfa_goal in enumerate(relabeled_dfa_goals):
+            if dfa_goal is None: # If subprocess returns None, then do not relabel, just the old dfa
                 warnings.warn("Relabelling failed!")
                 continue
-
-            events = self.env.get_events_given_obss(features[end_of_episode_ind])
-
-            dfa_goal = init_dfa_goal
             try:
-                dfa_binary_seq = self.env._to_int_seq(dfa_goal)
+                tables.append(self.get_goal_state_table(dfa_goal))
             except ValueError as e:
-                warnings.warn(f"Description size of the relabeled DFA is more that the upper bound. DFA: {dfa}; description size of the DFA: {binary_seq.shape[0]}, description size upper bound: {self.env.N}, error message: {e}")
-
-            # for step_ind in range(end_of_step_ind + 1):
-            for step_ind in range(self.env.timeout + 1):
-
-                dfas[end_of_episode_ind][step_ind] = dfa_binary_seq
-
-                dfa_goal = self.env._minimize(self.env._advance(dfa_goal, events[step_ind]))
-                reward, done, dfa_goal = self.env.get_dfa_goal_reward_and_done(dfa_goal)
-
-                done = done or step_ind == self.env.timeout
-
-                dones[end_of_episode_ind][step_ind] = done
-                rewards[end_of_episode_ind][step_ind] = reward
-
-                dfa_binary_seq = self.env._to_int_seq(dfa_goal)
-                next_dfas[end_of_episode_ind][step_ind] = dfa_binary_seq
-
-                if done: # It is guaranteed that the done signal will be 1 within the episode.
-                    features[end_of_episode_ind][step_ind + 1:] = np.zeros(features[end_of_episode_ind][step_ind + 1:].shape)
-                    dfas[end_of_episode_ind][step_ind + 1:] = np.zeros(dfas[end_of_episode_ind][step_ind + 1:].shape)
-                    actions[end_of_episode_ind][step_ind + 1:] = np.zeros(actions[end_of_episode_ind][step_ind + 1:].shape)
-                    next_features[end_of_episode_ind][step_ind + 1:] = np.zeros(next_features[end_of_episode_ind][step_ind + 1:].shape)
-                    next_dfas[end_of_episode_ind][step_ind + 1:] = np.zeros(next_dfas[end_of_episode_ind][step_ind + 1:].shape)
-                    dones[end_of_episode_ind][step_ind + 1:] = np.zeros(dones[end_of_episode_ind][step_ind + 1:].shape)
-                    rewards[end_of_episode_ind][step_ind + 1:] = np.zeros(rewards[end_of_episode_ind][step_ind + 1:].shape)
-                    break
-
-    def relabel_baseline_chain_sink(self, batch_size):
+                warnings.warn(f"Description size of the relabeled DFA is more that the upper bound. DFA: {dfa_goal}; description size upper bound: {self.env.N}, error message: {e}")
+                continue
+            trace_inds.append(trace_ind)
 
-        samples = self.replay_buffer.sample_traces(batch_size, self.model._vec_normalize_env)
-        if samples is None:
+        if len(trace_inds) == 0:
             return
 
+        # Pad the per-trace tables to the same number of states, padded states are never reached
+        n_traces = len(trace_inds)
+        n_states = max(table[0].shape[0] for table in tables)
+        transitions = np.zeros((n_traces, n_states, len(self.inputs)), dtype=np.int64)
+        encodings = np.zeros((n_traces, n_states, self.env.dfa_obs_size), dtype=np.float32)
+        state_rewards = np.zeros((n_traces, n_states), dtype=np.float32)
+        state_dones = np.zeros((n_traces, n_states), dtype=bool)
+        state_ids = np.zeros((n_traces, n_states), dtype=np.int64)
+        for i, (table_transitions, table_encodings, table_rewards, table_dones, table_ids) in enumerate(tables):
+            k = table_transitions.shape[0]
+            transitions[i, :k] = table_transitions
+            encodings[i, :k] = table_encodings
+            state_rewards[i, :k] = table_rewards
+            state_dones[i, :k] = table_dones
+            state_ids[i, :k] = table_ids
+
+        self.write_relabeled_traces(np.array(trace_inds), transitions, encodings, state_rewards, state_dones, state_ids, samples)
+
+    def write_relabeled_traces(self, trace_inds, transitions, encodings, state_rewards, state_dones, state_ids, samples):
+        """
+        Runs the relabeled goals, given as per-state tables (see
+        get_goal_state_table) with the start state at 0, over the events of
+        the traces trace_inds of samples, and rewrites the traces in place.
+        """
+
         features, dfas = samples.observations["features"], samples.observations["dfa"]
         actions = samples.actions
         next_features, next_dfas = samples.next_observations["features"], samples.next_observations["dfa"]
         dones = samples.dones
         rewards = samples.rewards
 
-        end_of_episode_inds, end_of_step_inds = dones.squeeze().nonzero()
-
-        relabeled_dfa_goals = []
-
-        for end_of_episode_ind, end_of_step_ind in zip(end_of_episode_inds, end_of_step_inds):
-
-            events = self.env.get_events_given_obss(features[end_of_episode_ind])
-            events_clean = list(filter(lambda x: x != "", self.env.get_events_given_obss(features[end_of_episode_ind])))
-
-            _, chain_length, num_avoid = self.env.sampler.get_concept_class()
-
-            if len(events_clean) < chain_length:
-                # skip this relabel
-                relabeled_dfa_goals.append(None)
-                continue
-
-            probs = np.array([1 for i in range(1, len(events_clean)+1)])
-            probs = probs / np.sum(probs) # This is not geometric distribution, it is uniform
-
-            num_rejection_sample_tries = 10
-            found_sample = False
-            for _ in range(num_rejection_sample_tries):
-                rand_idxs = sorted(np.random.choice(range(len(events_clean)), size=chain_length, replace=False, p=probs))
-                avoid_events = []
-                for i in range(len(rand_idxs)):
-                    # sample random events that we didn't see (we aw events_clean rand_idxs
-                    slice_start = 0 if i == 0 else rand_idxs[i-1]+1
-                    slice_end = rand_idxs[i]+1
-                    seen_set = events_clean[slice_start:slice_end]
-                    avoid_props = list(set(self.propositions) - set(seen_set))
-                    if len(avoid_props) < num_avoid:
-                        continue
-                    avoid_set = np.random.choice(avoid_props, size=num_avoid, replace=False)
-                    avoid_events.append(avoid_set)
-                found_sample = True
-                break
-
-            if not found_sample:
-                # skip this relabel
-                relabeled_dfa_goals.append(None)
-                continue
-
-            sampled_events = [events_clean[idx] for idx in rand_idxs]
-
-            def transition(s, c):
-                if s < chain_length and c == sampled_events[s]:
-                    s = s + 1
-                elif s < chain_length and c in avoid_events[s]:
-                    s = chain_length + 1 # put in final state
-                return s
-
-            dfa = DFA(start=0,
-                    inputs=self.propositions,
-                    outputs={False, True},
-                    label=lambda s: s == chain_length,
-                    transition=transition)
-
-
-            dfa_goal = ((dfa,),)
-            relabeled_dfa_goals.append(dfa_goal)
+        n_traces = len(trace_inds)
+        n_states = transitions.shape[1]
+        n_steps = self.env.timeout + 1
+        rows = np.arange(n_traces)
+
+        events = [self.env.get_events_given_obss(features[trace_ind][:n_steps]) for trace_ind in trace_inds]
+        event_symbols = sorted(set(event for trace_events in events for event in trace_events))
+        event_inds = {event: i for i, event in enumerate(event_symbols)}
+        # Transitions over the events seen in the traces, the empty event leaves the state unchanged
+        event_transitions = np.zeros((n_traces, n_states, len(event_symbols)), dtype=np.int64)
+        for i, event in enumerate(event_symbols):
+            next_states = np.broadcast_to(np.arange(n_states), (n_traces, n_states))
+            for c in event:
+                next_states = transitions[rows[:, None], next_states, self.input_inds[c]]
+            event_transitions[:, :, i] = next_states
+
+        # Run all the relabeled DFAs over their traces at once
+        trace_event_inds = np.array([[event_inds[event] for event in trace_events] for trace_events in events], dtype=np.int64)
+        state_seqs = np.zeros((n_traces, n_steps + 1), dtype=np.int64)
+        for step_ind in range(n_steps):
+            state_seqs[:, step_ind + 1] = event_transitions[rows, state_seqs[:, step_ind], trace_event_inds[:, step_ind]]
+
+        curr_states, next_states = state_seqs[:, :-1], state_seqs[:, 1:]
+        rows = rows[:, None]
+        # Like DFAEnv.step, the reward and done signals are only given when the goal changes
+        changed = state_ids[rows, curr_states] != state_ids[rows, next_states]
+        step_dones = (changed & state_dones[rows, next_states])
+        step_dones[:, -1] = True # Timeout
+        step_rewards = np.where(changed, state_rewards[rows, next_states], 0.0)
+        end_of_step_inds = step_dones.argmax(axis=1) # First done
+
+        dfas[trace_inds, :n_steps] = encodings[rows, curr_states]
+        next_dfas[trace_inds, :n_steps] = encodings[rows, next_states]
+        dones[trace_inds, :n_steps] = step_dones[..., None]
+        rewards[trace_inds, :n_steps] = step_rewards[..., None]
+
+        # Mask everything after the first done in place
+        tail = np.zeros(dones.shape[:2], dtype=bool)
+        tail[trace_inds] = np.arange(dones.shape[1])[None, :] > end_of_step_inds[:, None]
+        for arr in (features, dfas, actions, next_features, next_dfas, dones, rewards):
+            arr[tail] = 0
 
-        self.step_and_write_relabeled_dfas(relabeled_dfa_goals, samples)
-        self.replay_buffer.relabel_traces(batch_size, samples)
+    def relabel_baseline_chain_sink(self, batch_size):
+        _, chain_length, num_avoid = self.env.sampler.get_concept_class()
+        self.relabel_baseline(batch_size, ChainSampler(self.propositions, chain_length, num_avoid=num_avoid))
 
     def relabel_baseline_chain(self, batch_size):
+        _, chain_length = self.env.sampler.get_concept_class()
+        self.relabel_baseline(batch_size, ChainSampler(self.propositions, chain_length))
+
+    def relabel_baseline(self, batch_size, chain_sampler):
 
-        samples = self.replay_buffer.sample_traces(batch_size, self.model._vec_normalize_env)
+        with self.stats.timer("sample"):
+            samples = self.replay_buffer.sample_traces(batch_size, self.model._vec_normalize_env)
         if samples is None:
             return
 
-        features, dfas = samples.observations["features"], samples.observations["dfa"]
-        actions = samples.actions
-        next_features, next_dfas = samples.next_observations["features"], samples.next_observations["dfa"]
-        dones = samples.dones
-        rewards = samples.rewards
-
-        end_of_episode_inds, end_of_step_inds = dones.squeeze().nonzero()
-
-        relabeled_dfa_goals = []
+        features = samples.observations["features"]
+        events_clean = [list(filter(lambda x: x != "", self.env.get_events_given_obss(feature))) for feature in features]
+
+        # Traces with less events than the chain length (or no room for the avoid sets, or a goal too big
+        # for the table encoding) are not relabeled
+        with self.stats.timer("chain_sample"):
+            chain_events, avoids, valid = chain_sampler.sample(events_clean)
+            trace_inds = np.flatnonzero(valid)
+
+        if len(trace_inds) > 0:
+            with self.stats.timer("chain_encode"):
+                transitions = chain_sampler.get_transitions(chain_events[trace_inds], avoids[trace_inds])
+                if self.env.table_encoding is not None:
+                    encodings = []
+                    encoded = np.ones(len(trace_inds), dtype=bool)
+                    for k, trace_transitions in enumerate(transitions):
+                        try:
+                            encodings.append([self.encode_dfa(CompiledDFA.from_table(chain_sampler.inputs, trace_transitions, chain_sampler.accepting, state)) for state in range(chain_sampler.n_states)])
+                        except ValueError as e:
+                            warnings.warn(f"The chain goal does not fit the table encoding, the trace is not relabeled. Error message: {e}")
+                            encoded[k] = False
+                    trace_inds, transitions, encodings = trace_inds[encoded], transitions[encoded], np.array(encodings)
+                else:
+                    dfa_ints = chain_sampler.to_ints(transitions)
+                    encodings = np.array([[self.get_int_seq(dfa_int) for dfa_int in trace_dfa_ints] for trace_dfa_ints in dfa_ints])
+        self.stats.count("relabeled", len(trace_inds))
+        self.stats.count("failed", batch_size - len(trace_inds))
+
+        if len(trace_inds) > 0:
+            n_traces, n_states = len(trace_inds), chain_sampler.n_states
+            # The last link is accepting, the one after it is the sink
+            state_rewards = np.zeros((n_traces, n_states), dtype=np.float32)
+            state_rewards[:, chain_sampler.chain_length] = 1.0
+            state_rewards[:, chain_sampler.chain_length + 1] = -1.0
+            state_dones = np.broadcast_to(state_rewards != 0, (n_traces, n_states))
+            state_ids = np.broadcast_to(np.arange(n_states), (n_traces, n_states))
+            with self.stats.timer("writeback"):
+                self.write_relabeled_traces(trace_inds, transitions, encodings, state_rewards, state_dones, state_ids, samples)
 
-        for end_of_episode_ind, end_of_step_ind in zip(end_of_episode_inds, end_of_step_inds):
-
-            events = self.env.get_events_given_obss(features[end_of_episode_ind])
-            events_clean = list(filter(lambda x: x != "", self.env.get_events_given_obss(features[end_of_episode_ind])))
-
-            _, chain_length = self.env.sampler.get_concept_class()
-
-            if len(events_clean) < chain_length:
-                relabeled_dfa_goals.append(None)
-                continue
-
-            probs = np.array([1 for i in range(1, len(events_clean)+1)])
-            probs = probs / np.sum(probs) # This is not geometric distribution, it is uniform
-
-            rand_idxs = sorted(np.random.choice(range(len(events_clean)), size=chain_length, replace=False, p=probs))
-            sampled_events = [events_clean[idx] for idx in rand_idxs]
-
-            def transition(s, c):
-                if s < chain_length and c == sampled_events[s]:
-                    s = s + 1
-                return s
-
-            dfa = DFA(start=0,
-                    inputs=self.propositions,
-                    outputs={False, True},
-                    label=lambda s: s == chain_length,
-                    transition=transition)
-
-            dfa_goal = ((dfa,),) # In CNF format
-
-            relabeled_dfa_goals.append(dfa_goal)
-
-        self.step_and_write_relabeled_dfas(relabeled_dfa_goals, samples)
         self.replay_buffer.relabel_traces(batch_size, samples)
 
-    def relabel_diss(self, batch_size):
+    def get_pool(self):
+        if self.pool is None:
+            # The model and the env dynamics are serialized once, in memory, when the workers start
+            start_time = time.time()
+            model_buffer = io.BytesIO()
+            self.model.save(model_buffer)
+            dynamics_bytes = pickle.dumps(self.env.get_dynamics())
+            self.weights = SharedWeights(self.model.policy.q_net)
+            self.stats.add_time("serialize", time.time() - start_time)
+            if self.identification_cache_config["path"] is None:
+                # The workers share one cache per run, next to its logs
+                log_dir = self.model.logger.get_dir() or tempfile.mkdtemp(prefix="diss_")
+                self.identification_cache_config["path"] = os.path.join(log_dir, "identification_cache.sqlite")
+            start_time = time.time()
+            self.pool = DissWorkerPool(
+                DissRelabelWorker,
+                worker_args=(model_buffer.getvalue(), dynamics_bytes, self.weights, self.propositions, self.config, self.identification_cache_config),
+                n_workers=self.config.n_workers,
+                max_tasks_per_worker=self.config.max_tasks_per_worker,
+                hard_time_limit=self.config.hard_time_limit
+            )
+            self.stats.add_time("pool_start", time.time() - start_time)
+        return self.pool
+
+    def close(self):
+        self.pending.clear()
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
+        self.cache.save()
+
+    def submit_diss(self, batch_size):
+        """
+        Samples a batch of traces and submits the ones missing from the cache
+        to the worker pool without waiting for them. Returns None if there are
+        not enough traces to sample, otherwise the pending batch to finish.
+        """
 
         target_num_states = self.env.sampler.get_n_states()
 
         n = batch_size
-        samples = self.replay_buffer.sample_traces(n, self.model._vec_normalize_env) # This should also return actions
+        with self.stats.timer("sample"):
+            samples = self.replay_buffer.sample_traces(n, self.model._vec_normalize_env) # This should also return actions
         if samples == None:
-            return
+            return None
         observations = samples.observations
         # shape of features is (n, 76, 7, 7, 13)
         features, dfas = observations["features"], observations["dfa"]
         # shape of actions is (n, 76, 1)
         actions = samples.actions
 
-        queue = multiprocessing.Queue()
-        processes = []
+        pool = self.get_pool()
+        with self.stats.timer("publish"):
+            self.weights.publish(self.model.policy.q_net) # Workers reload the q_net only when the version changes
+        model_id = self.cache.model_id(self.weights.get_version(), self.weights.fingerprint)
+
+        # Traces whose events were already relabeled are sampled from the cached candidates
+        relabeled_dfa_ints = [None] * len(features)
+        futures = []
+        submit_time = time.time()
+        for i, (feature, action) in enumerate(zip(features, actions)):
+            with self.stats.timer("cache_lookup"):
+                events_clean = tuple(filter(lambda x: x != "", self.env.get_events_given_obss(feature)))
+                key = self.cache.key(events_clean, target_num_states, self.config.extra_clauses, model_id)
+                candidates = self.cache.get(key)
+            if candidates is not None:
+                relabeled_dfa_ints[i], _ = select_relabel(candidates)
+                continue
+            task = RelabelTask(self.next_trace_id, feature, action, target_num_states)
+            futures.append((i, key, pool.submit(task)))
+            self.next_trace_id += 1
+
+        return PendingRelabel(batch_size, samples, relabeled_dfa_ints, futures, submit_time)
+
+    def finish_diss(self, pending):
+        for i, key, future in pending.futures:
+            result = future.result()
+            if result.dfa_int is not None and not result.truncated: # Truncated searches are retried on the next miss
+                self.cache.put(key, result.candidates)
+            self.stats.count("truncated", result.truncated)
+            self.stats.count("timed_out", result.timed_out)
+            self.stats.add_time("worker", result.elapsed)
+            if result.stats is not None:
+                self.stats.add_time("weights_load", result.stats["weights_load_time"])
+                self.stats.add_time("diss", result.stats["diss_time"])
+                self.stats.add_time("sat", result.stats["sat_time"])
+                self.stats.add_value("diss_iters", result.stats["diss_iters"])
+                self.stats.add_value("sat_calls", result.stats["sat_calls"])
+                self.stats.count("id_cache_hits", result.stats["id_cache_hits"])
+                self.stats.count("id_cache_misses", result.stats["id_cache_misses"])
+                self.stats.count("id_cache_evictions", result.stats["id_cache_evictions"])
+            if result.energy is not None:
+                self.stats.add_value("energy", result.energy)
+            self.relabel_seconds += result.elapsed / self.config.n_workers
+            pending.relabeled_dfa_ints[i] = result.dfa_int
+        self.stats.add_time("turnaround", time.time() - pending.submit_time) # From submit to harvest
+        n_failed = sum(dfa_int is None for dfa_int in pending.relabeled_dfa_ints)
+        self.stats.count("relabeled", len(pending.relabeled_dfa_ints) - n_failed)
+        self.stats.count("failed", n_failed)
+
+        self.model.logger.record("relabel/cache_hits", self.cache.hits)
+        self.model.logger.record("relabel/cache_misses", self.cache.misses)
+        self.model.logger.record("relabel/cache_hit_rate", self.cache.hit_rate())
+        self.model.logger.record("relabel/cache_size", len(self.cache))
+        id_cache_lookups = self.stats.counts["id_cache_hits"] + self.stats.counts["id_cache_misses"]
+        if id_cache_lookups > 0:
+            self.model.logger.record("relabel/id_cache_hit_rate", self.stats.counts["id_cache_hits"] / id_cache_lookups)
+
         relabeled_dfa_goals = []
-        for feature, action, dfa in zip(features, actions, dfas):
-
-            self.model.save("data/model")
-            with open('env.pkl', 'wb') as f:
-                pickle.dump(self.env, f)
-
-            p = multiprocessing.Process(target=get_diss_dfas, args=(feature, action, self.propositions, self.extra_clauses, target_num_states, queue))
-            p.start()
-            processes.append(p)
-        for p in processes:
-            p.join()
-        for p in processes:
-            relabeled_dfa_int = queue.get()
-            dfa = DFA.from_int(relabeled_dfa_int, self.env.propositions)
+        for relabeled_dfa_int in pending.relabeled_dfa_ints:
+            if relabeled_dfa_int is None:
+                relabeled_dfa_goals.append(None)
+                continue
+            dfa = CompiledDFA.from_int(relabeled_dfa_int, self.inputs)
             dfa_goal = ((dfa,),) # In CNF format
             relabeled_dfa_goals.append(dfa_goal)
 
+        with self.stats.timer("writeback"):
+            self.step_and_write_relabeled_dfas(relabeled_dfa_goals, pending.samples)
+        self.replay_buffer.relabel_traces(pending.batch_size, pending.samples)
+        self.n_relabeled += pending.batch_size
 
-        self.step_and_write_relabeled_dfas(relabeled_dfa_goals, samples)
-        self.replay_buffer.relabel_traces(batch_size, samples)
-
+    def relabel_diss(self, batch_size):
+        pending = self.submit_diss(batch_size)
+        if pending is None:
+            return
+        self.finish_diss(pending)
+
+    def submit(self, relabeler_name, batch_size):
+        """
+        Non-blocking version of relabel. DISS relabels are queued and written
+        by later calls to harvest, the (cheap) baselines are written right away.
+        """
+        if relabeler_name != "diss":
+            self.relabel(relabeler_name, batch_size)
+            return
+        if len(self.pending) >= self.config.max_pending:
+            return # The workers are behind, do not queue more traces
+        pending = self.submit_diss(batch_size)
+        if pending is not None:
+            self.pending.append(pending)
+
+    def harvest(self):
+        """
+        Writes the pending DISS relabels whose traces are all done, in the
+        order they were submitted, into the replay buffer.
+        """
+        while self.pending and self.pending[0].done():
+            self.finish_diss(self.pending.popleft())
+        self.model.logger.record("relabel/pending_batches", len(self.pending))
+        self.stats.log(self.model.logger)
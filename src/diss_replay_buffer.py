@@ -74,6 +74,7 @@ class DissReplayBuffer(DictReplayBuffer):
         self.is_her_replay_buffer_relabeled_full = False
         self.her_ratio = 0.1
         self.env_indices = np.arange(self.n_envs)
+        self.relabel_stats = None # Set by the relabeler to time relabel_traces
 
     def add(
         self,
@@ -89,7 +90,7 @@ class DissReplayBuffer(DictReplayBuffer):
             self.her_replay_buffer_not_relabeled["features"][i][self.current_episode_idx_not_relabeled[i]][self.current_episode_step_idx_not_relabeled[i]] = np.array(obs["features"][i]).copy()
             self.her_replay_buffer_not_relabeled["dfa"][i][self.current_episode_idx_not_relabeled[i]][self.current_episode_step_idx_not_relabeled[i]] = np.array(obs["dfa"][i]).copy()
             self.her_replay_buffer_not_relabeled["action"][i][self.current_episode_idx_not_relabeled[i]][self.current_episode_step_idx_not_relabeled[i]] = np.array(action[i]).copy()
-            self.her_replay_buffer_not_relabeled["reward"][i][self.current_episode_idx_not_relabeled[i]][self.current_episode_step_idx_not_relabeled] = np.array(reward[i]).copy()
+            self.her_replay_buffer_not_relabeled["reward"][i][self.current_episode_idx_not_relabeled[i]][self.current_episode_step_idx_not_relabeled[i]] = np.array(reward[i]).copy()
             self.her_replay_buffer_not_relabeled["next_features"][i][self.current_episode_idx_not_relabeled[i]][self.current_episode_step_idx_not_relabeled[i]] = np.array(next_obs["features"][i]).copy()
             self.her_replay_buffer_not_relabeled["next_dfa"][i][self.current_episode_idx_not_relabeled[i]][self.current_episode_step_idx_not_relabeled[i]] = np.array(next_obs["dfa"][i]).copy()
             self.her_replay_buffer_not_relabeled["done"][i][self.current_episode_idx_not_relabeled[i]][self.current_episode_step_idx_not_relabeled[i]] = np.array(done[i]).copy()
@@ -141,24 +142,31 @@ class DissReplayBuffer(DictReplayBuffer):
         if batch_size <= 0 :
             return
 
-        _, end_of_step_inds = dict_replay_buffer_samples.dones.squeeze().nonzero()
-        self.episode_lengths[self.current_episode_idx_relabeled : self.current_episode_idx_relabeled + batch_size] = end_of_step_inds + 1
-
-        self.her_replay_buffer_relabeled["features"][self.current_episode_idx_relabeled : self.current_episode_idx_relabeled + batch_size] = dict_replay_buffer_samples.observations["features"]
-        self.her_replay_buffer_relabeled["dfa"][self.current_episode_idx_relabeled : self.current_episode_idx_relabeled + batch_size] = dict_replay_buffer_samples.observations["dfa"]
-        self.her_replay_buffer_relabeled["action"][self.current_episode_idx_relabeled : self.current_episode_idx_relabeled + batch_size] = dict_replay_buffer_samples.actions
-        self.her_replay_buffer_relabeled["reward"][self.current_episode_idx_relabeled : self.current_episode_idx_relabeled + batch_size] = dict_replay_buffer_samples.rewards
-        self.her_replay_buffer_relabeled["next_features"][self.current_episode_idx_relabeled : self.current_episode_idx_relabeled + batch_size] = dict_replay_buffer_samples.next_observations["features"]
-        self.her_replay_buffer_relabeled["next_dfa"][self.current_episode_idx_relabeled : self.current_episode_idx_relabeled + batch_size] = dict_replay_buffer_samples.next_observations["dfa"]
-        self.her_replay_buffer_relabeled["done"][self.current_episode_idx_relabeled : self.current_episode_idx_relabeled + batch_size] = dict_replay_buffer_samples.dones
-        for i in range(batch_size):
-            self.her_replay_buffer_relabeled["is_ready_to_use"][self.current_episode_idx_relabeled + i][:end_of_step_inds[i] + 1] = True
-            self.her_replay_buffer_relabeled["is_ready_to_use"][self.current_episode_idx_relabeled + i][end_of_step_inds[i] + 1:] = False
-
-        temp = self.current_episode_idx_relabeled
-        self.current_episode_idx_relabeled = (self.current_episode_idx_relabeled + batch_size) % (self.n_envs * self.her_replay_buffer_size)
-        if temp >= self.current_episode_idx_relabeled:
+        start_time = time.time()
+
+        # One done per trace, the batch may wrap around the end of the buffer
+        end_of_step_inds = dict_replay_buffer_samples.dones.nonzero()[1]
+        size = self.n_envs * self.her_replay_buffer_size
+        inds = (self.current_episode_idx_relabeled + np.arange(batch_size)) % size
+        self.episode_lengths[inds] = end_of_step_inds + 1
+
+        self.her_replay_buffer_relabeled["features"][inds] = dict_replay_buffer_samples.observations["features"]
+        self.her_replay_buffer_relabeled["dfa"][inds] = dict_replay_buffer_samples.observations["dfa"]
+        self.her_replay_buffer_relabeled["action"][inds] = dict_replay_buffer_samples.actions
+        self.her_replay_buffer_relabeled["reward"][inds] = dict_replay_buffer_samples.rewards
+        self.her_replay_buffer_relabeled["next_features"][inds] = dict_replay_buffer_samples.next_observations["features"]
+        self.her_replay_buffer_relabeled["next_dfa"][inds] = dict_replay_buffer_samples.next_observations["dfa"]
+        self.her_replay_buffer_relabeled["done"][inds] = dict_replay_buffer_samples.dones
+        for ind, end_of_step_ind in zip(inds, end_of_step_inds):
+            self.her_replay_buffer_relabeled["is_ready_to_use"][ind][:end_of_step_ind + 1] = True
+            self.her_replay_buffer_relabeled["is_ready_to_use"][ind][end_of_step_ind + 1:] = False
+
+        if self.current_episode_idx_relabeled + batch_size >= size:
             self.is_her_replay_buffer_relabeled_full = True
+        self.current_episode_idx_relabeled = (self.current_episode_idx_relabeled + batch_size) % size
+
+        if self.relabel_stats is not None:
+            self.relabel_stats.add_time("buffer_write", time.time() - start_time)
 
     def get_her_transitions_from_inds(self, her_batch_size, env):
         sample_space = np.argwhere(self.her_replay_buffer_relabeled["is_ready_to_use"])
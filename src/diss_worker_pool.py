@@ -0,0 +1,229 @@
+"""
+A long-lived pool of DISS relabel workers.
+
+Workers are started once and build their (expensive) per-process state a
+single time through a worker factory, e.g., loading the model and the env.
+Traces are submitted to the workers through a task queue and each submission
+returns a future right away. Each worker sends its results back through its
+own pipe, so terminating a worker can only break the pipe that is discarded
+with it. A collector thread reads the result pipes, resolves the futures and replaces the workers that exited, so the learner
+never blocks on the pool unless it waits on a future itself. Workers can
+optionally be recycled after a fixed number of tasks. With a hard time limit,
+a worker that spends longer than the limit on a single trace is terminated
+and replaced, and the future of that trace resolves to a timed out result.
+
+The learner broadcasts its q_net weights to the workers through SharedWeights,
+i.e., a state_dict in shared memory tagged with a version counter, so the
+workers never go through the disk to pick up new weights.
+"""
+
+import time
+import hashlib
+import threading
+import multiprocessing
+from multiprocessing import connection
+from concurrent.futures import Future, wait
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+
+class RelabelTask(NamedTuple):
+    trace_id: int
+    feature: np.ndarray
+    action: np.ndarray
+    target_num_states: int
+
+
+class RelabelResult(NamedTuple):
+    trace_id: int
+    dfa_int: Optional[int]
+    energy: Optional[float]
+    candidates: tuple = () # All the (dfa_int, energy) pairs found for the trace
+    truncated: bool = False # The search ran out of its time budget
+    timed_out: bool = False # The worker was killed for going past the hard time limit
+    elapsed: float = 0.0 # Seconds the worker spent on the trace
+    stats: Optional[dict] = None # Per-stage times and counters reported by the worker
+
+
+class SharedWeights():
+
+    def __init__(self, module):
+        # Shared memory is only available on the CPU, weights are copied to the module's device on load
+        self.tensors = {key: tensor.detach().cpu().clone().share_memory_() for key, tensor in module.state_dict().items()}
+        self.version = multiprocessing.Value("l", 0)
+
+    def publish(self, module):
+        with self.version.get_lock():
+            for key, tensor in module.state_dict().items():
+                self.tensors[key].copy_(tensor.detach())
+            self.version.value += 1
+
+    def fingerprint(self):
+        """ A hash of the published weights, identifies the model across runs """
+        digest = hashlib.sha1()
+        with self.version.get_lock():
+            for key in sorted(self.tensors):
+                digest.update(key.encode())
+                digest.update(self.tensors[key].numpy().tobytes())
+        return digest.hexdigest()
+
+    def get_version(self):
+        return self.version.value
+
+    def load_into(self, module, version):
+        """
+        Loads the published weights into the module if their version differs
+        from the given one. Returns the version of the weights the module has.
+        """
+        with self.version.get_lock():
+            current_version = self.version.value
+            if current_version != version:
+                module.load_state_dict(self.tensors)
+        return current_version
+
+
+def _worker_loop(worker_fact, worker_args, task_queue, result_conn, max_tasks, slot, start_times, trace_ids):
+    worker = worker_fact(*worker_args)
+    n_tasks = 0
+    while max_tasks is None or n_tasks < max_tasks:
+        task = task_queue.get()
+        if task is None: # Poison pill
+            break
+        # Let the pool know which trace this worker is on and since when
+        trace_ids[slot] = task.trace_id
+        start_time = time.time()
+        start_times[slot] = start_time
+        try:
+            result = worker(task)
+        except Exception:
+            result = RelabelResult(task.trace_id, None, None)
+        result = result._replace(elapsed=time.time() - start_time)
+        start_times[slot] = 0.0
+        result_conn.send(result)
+        n_tasks += 1
+
+
+class DissWorkerPool():
+
+    def __init__(self, worker_fact, worker_args=(), n_workers=2, max_tasks_per_worker=None, hard_time_limit=None, poll_interval=1.0):
+        """
+            worker_fact:
+                - (callable) called once in each worker process with worker_args; returns a callable mapping a RelabelTask to a RelabelResult
+            n_workers:
+                - (int) number of worker processes
+            max_tasks_per_worker:
+                - (int) number of tasks after which a worker is replaced by a fresh one, None (or 0) means never
+            hard_time_limit:
+                - (float) seconds a worker may spend on a single task before it is terminated, None (or 0) means no limit
+        """
+        assert n_workers > 0, "The pool needs at least one worker"
+        self.worker_fact = worker_fact
+        self.worker_args = worker_args
+        self.n_workers = n_workers
+        self.max_tasks_per_worker = max_tasks_per_worker if max_tasks_per_worker else None
+        self.hard_time_limit = hard_time_limit if hard_time_limit else None
+        self.poll_interval = poll_interval if self.hard_time_limit is None else min(poll_interval, self.hard_time_limit / 10)
+        self.start_times = multiprocessing.Array("d", n_workers, lock=False) # 0 when the worker is idle
+        self.trace_ids = multiprocessing.Array("l", n_workers, lock=False)
+        self.n_timed_out = 0
+        self.task_queue = multiprocessing.Queue()
+        self.result_conns = [None] * n_workers
+        self.workers = [self._spawn(i) for i in range(self.n_workers)]
+        self.futures = {}
+        self.futures_lock = threading.Lock()
+        self.closed = threading.Event()
+        self.collector = threading.Thread(target=self._collect, daemon=True)
+        self.collector.start()
+
+    def _spawn(self, slot):
+        self.start_times[slot] = 0.0
+        recv_conn, send_conn = multiprocessing.Pipe(duplex=False)
+        p = multiprocessing.Process(
+            target=_worker_loop,
+            args=(self.worker_fact, self.worker_args, self.task_queue, send_conn, self.max_tasks_per_worker, slot, self.start_times, self.trace_ids),
+            daemon=False # Workers may start their own subprocesses
+        )
+        p.start()
+        send_conn.close() # The worker holds the only send end, so its exit closes the pipe
+        self.result_conns[slot] = recv_conn
+        return p
+
+    def _drain(self, slot):
+        # Resolves the results a worker sent before it exited and closes its pipe
+        conn = self.result_conns[slot]
+        try:
+            while conn.poll():
+                self._resolve(conn.recv())
+        except (EOFError, OSError):
+            pass
+        conn.close()
+
+    def _maintain(self):
+        for i, p in enumerate(self.workers):
+            start_time = self.start_times[i]
+            if self.hard_time_limit is not None and start_time > 0 and time.time() - start_time > self.hard_time_limit:
+                p.terminate()
+                p.join()
+                self._drain(i)
+                self.n_timed_out += 1
+                self._resolve(RelabelResult(self.trace_ids[i], None, None, timed_out=True, elapsed=time.time() - start_time))
+                self.workers[i] = self._spawn(i)
+            elif not p.is_alive():
+                # Replace the workers that exited, e.g., after reaching max_tasks_per_worker,
+                # a worker that died on a trace (segfault, OOM kill, ...) fails that trace
+                p.join()
+                self._drain(i)
+                if start_time > 0:
+                    self._resolve(RelabelResult(self.trace_ids[i], None, None, elapsed=time.time() - start_time))
+                self.workers[i] = self._spawn(i)
+
+    def _resolve(self, result):
+        with self.futures_lock:
+            future = self.futures.pop(result.trace_id, None)
+        if future is not None:
+            future.set_result(result)
+
+    def _collect(self):
+        while not self.closed.is_set():
+            for conn in connection.wait(self.result_conns, timeout=self.poll_interval):
+                try:
+                    self._resolve(conn.recv())
+                except (EOFError, OSError): # The worker exited, _maintain replaces it
+                    pass
+            self._maintain()
+
+    def submit(self, task):
+        future = Future()
+        with self.futures_lock:
+            self.futures[task.trace_id] = future
+        self.task_queue.put(task)
+        return future
+
+    def n_pending(self):
+        with self.futures_lock:
+            return len(self.futures)
+
+    def map(self, tasks):
+        futures = [self.submit(task) for task in tasks]
+        wait(futures)
+        return [future.result() for future in futures]
+
+    def close(self):
+        self.closed.set()
+        self.collector.join()
+        with self.futures_lock:
+            for future in self.futures.values():
+                future.cancel()
+            self.futures = {}
+        for p in self.workers:
+            if p.is_alive():
+                self.task_queue.put(None)
+        for p in self.workers:
+            p.join(timeout=self.poll_interval)
+            if p.is_alive():
+                p.terminate()
+                p.join()
+        for conn in self.result_conns:
+            conn.close()
+        self.workers = []
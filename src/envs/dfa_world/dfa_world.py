@@ -9,6 +9,34 @@ from typing import Any, Literal, Optional, Union
 import attr
 import funcy as fn
 
+from envs.dynamics import Dynamics
+
+class DummyDynamics(Dynamics):
+    """
+    The symbolic dynamics of a DummyEnv: the observation is the index of the
+    proposition of the last action, or len(props) before the first one.
+    """
+
+    def __init__(self, props, timeout):
+        self.props = list(props)
+        self.timeout = timeout
+
+    def get_propositions(self):
+        return self.props
+
+    def get_events_given_obss(self, obss):
+        obss = np.asarray(obss).reshape(-1).astype(np.int64)
+        return [self.props[obs] if obs < len(self.props) else "" for obs in obss]
+
+    def step_from_obss(self, prev_obss, actions, times):
+        obss = np.asarray(actions).reshape(np.shape(prev_obss)).astype(np.asarray(prev_obss).dtype)
+        dones = (np.asarray(times) + 1) > self.timeout
+        return obss, dones
+
+    def transition_probabilities(self, obss, actions, target_obss):
+        return (np.asarray(target_obss).reshape(-1) == np.asarray(actions).reshape(-1)).astype(np.float64)
+
+
 class DummyEnv(gym.Env):
 
     def __init__(self, propositions, timeout):
@@ -28,6 +56,7 @@ class DummyEnv(gym.Env):
         self.timeout = timeout
         self.time = 0
         self.num_episodes = 0
+        self.dynamics = DummyDynamics(self.props, timeout)
 
     def step(self, action_idx):
         """
@@ -62,14 +91,25 @@ class DummyEnv(gym.Env):
         return self.props[self.state_prop]
 
     def get_events_given_obss(self, obss):
-        return [self.get_events_given_obs(obs) for obs in obss]
+        return self.dynamics.get_events_given_obss(obss)
 
     def get_events_given_obs(self, obs):
-        obs = obs.squeeze()
-        if obs == len(self.props):
-            return ""
-        else:
-            return self.props[int(obs)]
+        return self.dynamics.get_events_given_obs(obs)
+
+    def step_from_obss(self, prev_obss, actions, times):
+        return self.dynamics.step_from_obss(prev_obss, actions, times)
+
+    def transition_probabilities(self, obss, actions, target_obss):
+        return self.dynamics.transition_probabilities(obss, actions, target_obss)
+
+    def transition_probability(self, obs, action, target_obs):
+        return self.dynamics.transition_probability(obs, action, target_obs)
+
+    def lift_path(self, path):
+        return self.dynamics.lift_path(path)
+
+    def get_dynamics(self):
+        return self.dynamics
 
     def get_propositions(self):
         return self.props
@@ -0,0 +1,24 @@
+"""
+Base class of the symbolic dynamics of the envs, e.g., LetterDynamics.
+Subclasses implement the methods batched over observations
+(get_events_given_obss, step_from_obss and transition_probabilities),
+the per-observation ones and lift_path are derived from them.
+"""
+
+
+class Dynamics:
+
+    def get_events_given_obs(self, obs):
+        return self.get_events_given_obss(obs)[0]
+
+    def transition_probability(self, obs, action, target_obs):
+        return float(self.transition_probabilities(obs, [action], target_obs)[0])
+
+    def lift_path(self, path):
+        # The events of the observations of the env nodes, without repeats
+        events = self.get_events_given_obss([curr_el[0] for curr_el in path[::2]])
+        lifted_path = []
+        for curr_event in events:
+            if curr_event != "" and (len(lifted_path) == 0 or curr_event != lifted_path[-1]):
+                lifted_path.append(curr_event)
+        return lifted_path
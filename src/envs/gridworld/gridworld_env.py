@@ -9,6 +9,8 @@ from typing import Any, Literal, Optional, Union
 import attr
 import funcy as fn
 
+from envs.dynamics import Dynamics
+
 Player = Literal['ego', 'env']
 
 Action = Literal['↑', '↓', '←', '→']
@@ -26,8 +28,69 @@ __all__ = [
     'Action',
     'GridWorldNaive',
     'GridWorldState',
+    'GridworldDynamics',
 ]
 
+class GridworldDynamics(Dynamics):
+    """
+    The symbolic dynamics of a GridworldEnv: the grid size, the color of each
+    cell and the slip and end of episode probabilities. All the methods are
+    batched over observations, which are one-hot (dim, dim) grids of the (x-1, y-1)
+    of the agent.
+    """
+
+    def __init__(self, dim, overlay, props, slip_prob, end_ep_prob, actions):
+        self.dim = dim
+        self.props = list(props)
+        self.slip_prob = slip_prob
+        self.end_ep_prob = end_ep_prob
+        self.timeout = None
+        self.colors = np.full((dim, dim), -1, dtype=np.int64) # Index of the prop of each cell, -1 for white
+        for (x, y), color in overlay.items():
+            if color in self.props:
+                self.colors[x - 1, y - 1] = self.props.index(color)
+        self.action_deltas = np.array([ACTION2VEC[a] for a in actions])
+        self.slip_action = list(actions).index(SLIP_DIRECTION)
+
+    def get_propositions(self):
+        return self.props
+
+    def locations(self, obss):
+        obss = np.asarray(obss).reshape(-1, self.dim * self.dim)
+        return np.divmod(obss.argmax(axis=1), self.dim)
+
+    def moves(self, obss, actions):
+        """ The succeed and slip locations of each move and the probability to slip """
+        xs, ys = self.locations(obss)
+        actions = np.asarray(actions, dtype=np.int64).reshape(-1)
+        deltas = self.action_deltas[actions]
+        slip_dx, slip_dy = ACTION2VEC[SLIP_DIRECTION]
+        succeed = np.clip(xs + deltas[:, 0], 0, self.dim - 1), np.clip(ys + deltas[:, 1], 0, self.dim - 1)
+        slip = np.clip(xs + slip_dx, 0, self.dim - 1), np.clip(ys + slip_dy, 0, self.dim - 1)
+        same = (actions == self.slip_action) | ((succeed[0] == slip[0]) & (succeed[1] == slip[1]))
+        return succeed, slip, np.where(same, 0.0, self.slip_prob)
+
+    def get_events_given_obss(self, obss):
+        xs, ys = self.locations(obss)
+        return [self.props[k] if k >= 0 else "" for k in self.colors[xs, ys]]
+
+    def step_from_obss(self, prev_obss, actions, times):
+        (succeed_x, succeed_y), (slip_x, slip_y), slip_probs = self.moves(prev_obss, actions)
+        slipped = np.random.random(len(slip_probs)) < slip_probs
+        obss = np.zeros((len(slip_probs), self.dim, self.dim), dtype=np.uint8)
+        rows = np.arange(len(slip_probs))
+        obss[rows, np.where(slipped, slip_x, succeed_x), np.where(slipped, slip_y, succeed_y)] = 1
+        dones = np.random.random(len(slip_probs)) < self.end_ep_prob
+        return obss, dones
+
+    def transition_probabilities(self, obss, actions, target_obss):
+        (succeed_x, succeed_y), (slip_x, slip_y), slip_probs = self.moves(obss, actions)
+        xs, ys = self.locations(target_obss)
+        to_succeed = (xs == succeed_x) & (ys == succeed_y)
+        to_slip = (xs == slip_x) & (ys == slip_y)
+        return (1 - slip_probs) * to_succeed + slip_probs * to_slip
+
+
 class GridworldEnv(gym.Env):
     """
     TODO : fill this out
@@ -51,6 +114,7 @@ class GridworldEnv(gym.Env):
         self.observation_space = gym.spaces.Box(low=0, high=1, shape=(dim,dim), dtype=np.uint8)
         self.action_space = gym.spaces.Discrete(4)
         self.actions = list(ACTION2VEC.keys())
+        self.dynamics = GridworldDynamics(dim, overlay, self.props, slip_prob, end_ep_prob, self.actions)
 
     def _get_obs(self):
         obs = np.zeros(shape=(self.dim,self.dim),dtype=np.uint8)
@@ -95,6 +159,27 @@ class GridworldEnv(gym.Env):
     def get_propositions(self):
         return self.props
 
+    def get_events_given_obss(self, obss):
+        return self.dynamics.get_events_given_obss(obss)
+
+    def get_events_given_obs(self, obs):
+        return self.dynamics.get_events_given_obs(obs)
+
+    def step_from_obss(self, prev_obss, actions, times):
+        return self.dynamics.step_from_obss(prev_obss, actions, times)
+
+    def transition_probabilities(self, obss, actions, target_obss):
+        return self.dynamics.transition_probabilities(obss, actions, target_obss)
+
+    def transition_probability(self, obs, action, target_obs):
+        return self.dynamics.transition_probability(obs, action, target_obs)
+
+    def lift_path(self, path):
+        return self.dynamics.lift_path(path)
+
+    def get_dynamics(self):
+        return self.dynamics
+
 
 @attr.frozen
 class GridWorldState:
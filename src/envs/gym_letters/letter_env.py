@@ -8,6 +8,68 @@ import numpy as np
 import gym
 from gym import spaces
 
+from envs.dynamics import Dynamics
+
+class LetterDynamics(Dynamics):
+    """
+    The symbolic dynamics of a LetterEnv: only the grid parameters, letters and
+    actions, so it is cheap to pickle. All the methods are batched over observations.
+    """
+
+    def __init__(self, grid_size, letter_types, use_agent_centric_view, timeout, actions):
+        self.grid_size = grid_size
+        self.letter_types = list(letter_types)
+        self.use_agent_centric_view = use_agent_centric_view
+        self.timeout = timeout
+        self.actions = list(actions)
+        self.action_deltas = np.array(actions)
+
+    def get_propositions(self):
+        return self.letter_types
+
+    def agent_locations(self, obss):
+        """ The (i, j) of the agent in each observation """
+        obss = np.asarray(obss).reshape(-1, self.grid_size, self.grid_size, len(self.letter_types) + 1)
+        return np.divmod(obss[..., len(self.letter_types)].reshape(len(obss), -1).argmax(axis=1), self.grid_size)
+
+    def get_events_given_obss(self, obss):
+        n_letters = len(self.letter_types)
+        obss = np.asarray(obss).reshape(-1, self.grid_size, self.grid_size, n_letters + 1)
+        if len(obss) == 0:
+            return []
+        # The letters on the cells of the agent, the first one is the event
+        agent_cells = obss[..., n_letters:].any(axis=3, keepdims=True)
+        letters = ((obss[..., :n_letters] != 0) & agent_cells).any(axis=(1, 2))
+        letter_inds = letters.argmax(axis=1)
+        return [self.letter_types[k] if found else "" for k, found in zip(letter_inds, letters.any(axis=1))]
+
+    def step_from_obss(self, prev_obss, actions, times):
+        """
+        Batched step: prev_obss has shape (B, grid_size, grid_size, channels) and
+        actions and times have shape (B,). Returns the next observations and done flags.
+        """
+        n_letters = len(self.letter_types)
+        obss = np.zeros(prev_obss.shape)
+        obss[...] = prev_obss != 0
+        for action, (di, dj) in enumerate(self.actions):
+            rows = np.asarray(actions) == action
+            if self.use_agent_centric_view: # Letters move, the agent stays at the center
+                obss[rows, :, :, :n_letters] = np.roll(obss[rows, :, :, :n_letters], (-di, -dj), axis=(1, 2))
+            else:
+                obss[rows, :, :, n_letters:] = np.roll(obss[rows, :, :, n_letters:], (di, dj), axis=(1, 2))
+        dones = (np.asarray(times) + 1) > self.timeout
+        return obss, dones
+
+    def transition_probabilities(self, obss, actions, target_obss):
+        """ 1 if the agent moved by the action from each observation to its target, 0 otherwise """
+        curr_i, curr_j = self.agent_locations(obss)
+        target_i, target_j = self.agent_locations(target_obss)
+        deltas = self.action_deltas[np.asarray(actions, dtype=np.int64).reshape(-1)]
+        moved_i = (curr_i + deltas[:, 0]) % self.grid_size
+        moved_j = (curr_j + deltas[:, 1]) % self.grid_size
+        return ((moved_i == target_i) & (moved_j == target_j)).astype(np.float64)
+
+
 class LetterEnv(gym.Env):
     """
     This environment is a grid with randomly located letters on it
@@ -42,6 +104,7 @@ class LetterEnv(gym.Env):
         self.agent = (0,0)
         self.locations = [(i,j) for i in range(grid_size) for j in range(grid_size) if (i,j) != (0,0)]
         self.actions = [(-1,0),(1,0),(0,-1),(0,1)]
+        self.dynamics = LetterDynamics(grid_size, self.letter_types, use_agent_centric_view, timeout, self.actions)
 
 
     def step(self, action):
@@ -83,21 +146,17 @@ class LetterEnv(gym.Env):
 
         return obs, reward, done, info
 
+    def step_from_obss(self, prev_obss, actions, times):
+        return self.dynamics.step_from_obss(prev_obss, actions, times)
 
-    def transition_probability(self, obs, action, target_obs):
-
-        curr_agent = np.where(obs[:,:,len(self.letter_types)] == 1)
-        target_agent = np.where(target_obs[:,:,len(self.letter_types)] == 1)
+    def transition_probabilities(self, obss, actions, target_obss):
+        return self.dynamics.transition_probabilities(obss, actions, target_obss)
 
-        di,dj = self.actions[action]
-        agent_i = (curr_agent[0] + di + self.grid_size) % self.grid_size
-        agent_j = (curr_agent[1] + dj + self.grid_size) % self.grid_size
-        new_agent = agent_i,agent_j
+    def transition_probability(self, obs, action, target_obs):
+        return self.dynamics.transition_probability(obs, action, target_obs)
 
-        if new_agent == target_agent:
-            return 1.0
-        else:
-            return 0.0
+    def get_dynamics(self):
+        return self.dynamics
 
     def _get_observation(self):
         obs = np.zeros(shape=(self.grid_size,self.grid_size,len(self.letter_types)+1),dtype=np.uint8)
@@ -197,31 +256,13 @@ class LetterEnv(gym.Env):
         return ""
 
     def get_events_given_obss(self, obss):
-        return [self.get_events_given_obs(obs) for obs in obss]
+        return self.dynamics.get_events_given_obss(obss)
 
     def get_events_given_obs(self, obs):
-        obs = obs.squeeze()
-        pi, pj, pletter_idx = obs[:, :, :len(self.letter_types)].nonzero() # Don't include agent
-        ai, aj, aletter_idx = obs[:, :, len(self.letter_types):].nonzero() # Don't include agent
-        aletter_idx += len(self.letter_types)
-        for i, j, letter_idx in zip(pi, pj, pletter_idx):
-            if i == ai and j == aj:
-                return self.letter_types[letter_idx]
-        return ""
+        return self.dynamics.get_events_given_obs(obs)
 
     def lift_path(self, path):
-        lifted_path = []
-        for i, curr_el in enumerate(path):
-            if i % 2 == 0:
-                obs = curr_el[0]
-                curr_event = self.get_events_given_obs(obs)
-                if curr_event != "":
-                    if len(lifted_path) > 0:
-                        if curr_event != lifted_path[-1]:
-                            lifted_path.append(curr_event)
-                    else:
-                        lifted_path.append(curr_event)
-        return lifted_path
+        return self.dynamics.lift_path(path)
 
     def get_propositions(self):
         return self.letter_types
@@ -49,7 +49,7 @@ class CustomCombinedExtractor(BaseFeaturesExtractor):
         self.env_model = getEnvModel(env, observation_space.spaces["features"].shape)
 
     def preprocess_texts(self, texts, device=None):
-        dfa_builder = utils.DFABuilder(self.propositions, dfa_n_conjunctions=self.env.sampler.get_n_conjunctions(), dfa_n_disjunctions=self.env.sampler.get_n_disjunctions(), device=device)
+        dfa_builder = utils.DFABuilder(self.propositions, dfa_n_conjunctions=self.env.sampler.get_n_conjunctions(), dfa_n_disjunctions=self.env.sampler.get_n_disjunctions(), device=device, table_encoding=self.env.table_encoding)
         return np.array([[dfa_builder(text).to(device)] for text in texts])
 
     def preprocess_obss(self, features, dfa_int_seqs, device=None):
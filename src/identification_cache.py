@@ -0,0 +1,178 @@
+"""
+Bounded, cross-process cache of DFA identification results.
+
+The results of find_dfas2, find_dfas3 and augment (see concept_class.py) are
+stored in a sqlite database under a canonical hash of their arguments, so the
+relabel workers share the SAT identifications they already did, also across
+worker restarts and (with a file path) across runs. Entries are evicted least
+recently used first once the cache holds more than max_entries entries or
+max_bytes bytes. Without a path, each process gets its own in-memory cache.
+
+Each process opens its own connection, lazily, through get_cache, so the cache
+can be configured once before the workers are forked.
+
+Callables in the arguments (e.g., extra clause generators) are keyed by their
+module and qualified name, partials and bound methods by their parts too.
+Lambdas, closures and objects without a repr of their own cannot be told apart
+that way, so calls with them are not cached. Neither are the results that
+depend on timing, e.g., a truncated portfolio, see skip_caching.
+"""
+
+import os
+import time
+import pickle
+import sqlite3
+import hashlib
+import inspect
+from functools import partial, wraps
+
+_config = {"path": None, "max_entries": 100000, "max_bytes": 1 << 30}
+_cache = None
+
+
+def configure(path=None, max_entries=100000, max_bytes=1 << 30):
+    global _cache
+    _config.update(path=path, max_entries=max_entries, max_bytes=max_bytes)
+    _cache = None
+
+
+def get_cache():
+    global _cache
+    if _cache is None or _cache.pid != os.getpid():
+        _cache = IdentificationCache(**_config)
+    return _cache
+
+
+class Uncacheable(Exception):
+    """ The arguments of a call have no canonical representation """
+
+
+def canonical_callable(f):
+    if isinstance(f, partial):
+        return ("partial", canonical_callable(f.func), canonical(f.args), canonical(f.keywords))
+    if inspect.ismethod(f):
+        return ("method", canonical(f.__self__), canonical_callable(f.__func__))
+    if inspect.isfunction(f) or inspect.isbuiltin(f) or inspect.isclass(f):
+        qualname = getattr(f, "__qualname__", "<unknown>")
+        if "<" in qualname: # <lambda> or <locals>, may depend on captured state
+            raise Uncacheable(qualname)
+        return ("callable", getattr(f, "__module__", None), qualname)
+    if type(f).__repr__ is not object.__repr__: # Callable objects with a repr of their data
+        return ("object", type(f).__module__, type(f).__qualname__, repr(f))
+    raise Uncacheable(repr(f))
+
+
+def canonical(x):
+    """ A representation of x that does not depend on set or dict iteration order """
+    if isinstance(x, (set, frozenset)):
+        return ("set", tuple(sorted((canonical(y) for y in x), key=repr)))
+    if isinstance(x, dict):
+        return ("dict", tuple(sorted(((canonical(k), canonical(v)) for k, v in x.items()), key=repr)))
+    if isinstance(x, (tuple, list)):
+        return tuple(canonical(y) for y in x)
+    if callable(x):
+        return canonical_callable(x)
+    return repr(x)
+
+
+def hash_key(*parts):
+    return hashlib.sha256(repr(canonical(parts)).encode()).hexdigest()
+
+
+_n_skipped = 0
+
+
+def skip_caching():
+    """ Keeps the results of the cached calls in progress out of the cache """
+    global _n_skipped
+    _n_skipped += 1
+
+
+def cached(name, key_fn=None, dumps=pickle.dumps, loads=pickle.loads):
+    """
+    Decorator replacing lru_cache: the result of f is stored under a hash of
+    key_fn applied to the arguments of f (by name, defaults included), after
+    being serialized by dumps. key_fn defaults to the arguments themselves.
+    """
+    def decorator(f):
+        signature = inspect.signature(f)
+
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            cache = get_cache()
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            key_parts = bound.arguments if key_fn is None else key_fn(**bound.arguments)
+            try:
+                key = hash_key(name, key_parts)
+            except Uncacheable:
+                return f(*args, **kwargs)
+            value = cache.get(key)
+            if value is not None:
+                return loads(value)
+            n_skipped = _n_skipped
+            result = f(*args, **kwargs)
+            if _n_skipped == n_skipped:
+                cache.put(key, dumps(result))
+            return result
+        return wrapper
+    return decorator
+
+
+class IdentificationCache():
+
+    def __init__(self, path=None, max_entries=100000, max_bytes=1 << 30):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.pid = os.getpid()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.conn = sqlite3.connect(path if path is not None else ":memory:", timeout=30)
+        if path is not None:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value BLOB, size INTEGER, last_used REAL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+        self.conn.commit()
+
+    def get(self, key):
+        row = self.conn.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        try:
+            with self.conn:
+                self.conn.execute("UPDATE entries SET last_used = ? WHERE key = ?", (time.time(), key))
+        except sqlite3.OperationalError: # Locked by another process, the entry just looks older
+            pass
+        return row[0]
+
+    def put(self, key, value):
+        try:
+            with self.conn:
+                self.conn.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)", (key, value, len(value), time.time()))
+                self._evict()
+        except sqlite3.OperationalError: # Locked by another process, skip caching this one
+            pass
+
+    def _evict(self):
+        n_entries, n_bytes = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        while n_entries > self.max_entries or n_bytes > self.max_bytes:
+            # Drop the least recently used tenth of the entries at once
+            n = max(1, n_entries // 10)
+            n_dropped, n_dropped_bytes = self.conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM (SELECT size FROM entries ORDER BY last_used LIMIT ?)", (n,)
+            ).fetchone()
+            self.conn.execute("DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY last_used LIMIT ?)", (n,))
+            self.evictions += n_dropped
+            n_entries -= n_dropped
+            n_bytes -= n_dropped_bytes
+
+    def hit_rate(self):
+        n = self.hits + self.misses
+        return self.hits / n if n > 0 else 0.0
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
@@ -0,0 +1,156 @@
+"""
+Portfolio DFA identification.
+
+Runs dfa_identify.find_dfas under several configurations (state bounds, SAT
+solver, symmetry breaking) at once, one forked process per configuration, and
+keeps either the first configuration to find a DFA ("first") or the smallest
+DFAs found by all configurations within a time budget ("best"). The processes
+still running are then terminated, so a hard instance for one configuration
+does not hold up the others.
+
+The wait is also bounded by the deadline of sat_deadline.time_limit. Results
+cut short by a budget depend on timing, so they are never cached: without any
+DFA, the search raises instead of returning an empty list, and a truncated
+"best" pool is kept out of the identification cache.
+"""
+
+import os
+import time
+import ctypes
+import signal
+import threading
+import multiprocessing
+from multiprocessing.connection import wait
+from functools import partial
+from typing import NamedTuple, Optional
+
+import funcy as fn
+from dfa import DFA
+from dfa_identify import find_dfas
+from pysat.solvers import Solver
+
+from compiled_dfa import CompiledDFA
+from identification_cache import skip_caching
+from sat_deadline import IdentificationTimeout, get_deadline
+
+PR_SET_PDEATHSIG = 1
+
+
+def _exit_with_parent(parent_pid):
+    # A worker killed past its hard time limit never runs its cleanup, so its configurations stop by themselves
+    try:
+        if ctypes.CDLL(None, use_errno=True).prctl(PR_SET_PDEATHSIG, signal.SIGKILL) == 0:
+            if os.getppid() != parent_pid: # The parent died before prctl
+                os._exit(1)
+            return
+    except (OSError, AttributeError): # Not Linux
+        pass
+
+    def watch():
+        while os.getppid() == parent_pid:
+            time.sleep(0.5)
+        os._exit(1)
+    threading.Thread(target=watch, daemon=True).start()
+
+
+class PortfolioConfig(NamedTuple):
+    bounds: Optional[tuple] = None # None for the bounds of the identifier
+    solver: str = "glucose4" # Any pysat solver name
+    sym_mode: Optional[str] = "bfs"
+
+
+def make_portfolio(solvers=("glucose4",), sym_modes=("bfs",), bounds=(None,)):
+    """ All the combinations of the given solvers, symmetry breaking modes and bounds """
+    return tuple(PortfolioConfig(b, solver, sym_mode) for b in bounds for solver in solvers for sym_mode in sym_modes)
+
+
+def _run_config(conn, parent_pid, config, accepting, rejecting, alphabet, order_by_stutter, extra_clauses, bounds, N):
+    _exit_with_parent(parent_pid)
+    try:
+        dfas = find_dfas(
+            accepting,
+            rejecting,
+            alphabet=alphabet,
+            order_by_stutter=order_by_stutter,
+            extra_clauses=extra_clauses,
+            bounds=bounds if config.bounds is None else config.bounds,
+            solver_fact=partial(Solver, name=config.solver),
+            sym_mode=config.sym_mode,
+        )
+        conn.send([(dfa.to_int(), sorted(dfa.inputs)) for dfa in fn.take(N, dfas)])
+    except Exception as e:
+        conn.send(e)
+    finally:
+        conn.close()
+
+
+def portfolio_find_dfas(accepting, rejecting, alphabet, configs, order_by_stutter=False, extra_clauses=lambda *_: (), bounds=(None, None), N=20, mode="first", time_budget=None):
+    """
+    Returns at most N DFAs consistent with the examples. With mode "first", they
+    come from the first configuration that found any. With mode "best", the
+    results of all the configurations done within time_budget seconds (or all
+    of them, without a budget) are pooled and the N DFAs with the fewest states
+    are kept, earlier configurations first on ties.
+    Raises IdentificationTimeout if the deadline of sat_deadline.time_limit
+    passes, or TimeoutError (see diss's synth_timeout) if time_budget runs out,
+    before any DFA is found.
+    """
+    ctx = multiprocessing.get_context("fork") # extra_clauses may be a closure
+    procs, conns = [], []
+    try:
+        for config in configs:
+            recv_conn, send_conn = ctx.Pipe(duplex=False)
+            p = ctx.Process(
+                target=_run_config,
+                args=(send_conn, os.getpid(), config, accepting, rejecting, alphabet, order_by_stutter, extra_clauses, bounds, N),
+                daemon=True
+            )
+            p.start()
+            send_conn.close()
+            procs.append(p)
+            conns.append(recv_conn)
+
+        deadline = None if time_budget is None else time.time() + time_budget
+        sat_deadline = get_deadline()
+        if sat_deadline is not None and (deadline is None or sat_deadline < deadline):
+            deadline = sat_deadline
+        results = {}
+        pending = list(conns)
+        while pending:
+            timeout = None if deadline is None else max(0.0, deadline - time.time())
+            ready = wait(pending, timeout=timeout)
+            if not ready: # Out of time
+                if not any(results.values()):
+                    if deadline == sat_deadline:
+                        raise IdentificationTimeout()
+                    raise TimeoutError()
+                skip_caching() # Truncated "best" pool
+                break
+            for conn in ready:
+                pending.remove(conn)
+                try:
+                    result = conn.recv()
+                except EOFError: # The process died without an answer
+                    continue
+                if isinstance(result, Exception):
+                    continue
+                results[conns.index(conn)] = result
+            if mode == "first" and any(results.values()):
+                break
+
+        if mode == "first":
+            done = [i for i in range(len(conns)) if results.get(i)]
+            found = results[done[0]] if done else []
+        else:
+            found = [(CompiledDFA.from_int(*x).n_states, i, x) for i in sorted(results) for x in results[i]]
+            found = [x for _, _, x in sorted(found, key=lambda t: t[:2])]
+            found = list(fn.distinct(found, key=lambda x: x[0]))[:N]
+        return [DFA.from_int(dfa_int, inputs) for dfa_int, inputs in found]
+    finally:
+        for p in procs:
+            if p.is_alive():
+                p.terminate()
+        for p in procs:
+            p.join()
+        for conn in conns:
+            conn.close()
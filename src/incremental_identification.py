@@ -0,0 +1,236 @@
+"""
+Incremental SAT-based DFA identification.
+
+dfa_identify.find_dfas encodes the prefix tree of the examples into a new SAT
+instance on every call. Consecutive DISS iterations query almost the same
+examples, so here one solver is kept per (alphabet, number of states,
+symmetry breaking, extra clauses) and reused across queries:
+
+    - The DFA variables (accepting colors, transitions and the BFS symmetry
+      breaking ones) are encoded once with a Codec over the root node only.
+    - The prefix tree grows with the examples of each query. The coloring
+      clauses of a new node do not depend on any label, so they are permanent.
+    - The label of an example is only enforced under an activation literal,
+      which is passed as an assumption when the example is in the query. Dropped
+      examples are simply not assumed.
+    - Blocking clauses of an enumeration and the cardinality constraints used
+      to order models by stutter are also guarded by activation literals.
+
+A solver is rebuilt once its prefix tree exceeds max_nodes nodes.
+"""
+
+from dfa import DFA, dict2dfa
+from pysat.card import CardEnc
+from pysat.solvers import Glucose4
+
+from sat_deadline import solve_before
+
+from dfa_identify.encoding import (
+    Codec,
+    onehot_color_clauses,
+    onehot_parent_relation_clauses,
+    symmetry_breaking_common,
+    symmetry_breaking_bfs,
+)
+
+MAX_NODES = 5000
+
+_identifiers = {}
+
+
+class IncrementalIdentifier():
+
+    def __init__(self, alphabet, n_colors, sym_mode="bfs", extra_clauses=None, solver_fact=Glucose4):
+        self.inputs = sorted(alphabet)
+        self.tokens = {a: i for i, a in enumerate(self.inputs)}
+        self.n_colors = n_colors
+        # Node 0 is the root of the prefix tree, the other nodes get fresh variables
+        self.codec = Codec(1, n_colors, len(self.inputs), sym_mode)
+        self.solver = solver_fact()
+        self.top = self.codec.offsets[-1]
+
+        clauses = list(onehot_color_clauses(self.codec))
+        clauses.extend(onehot_parent_relation_clauses(self.codec))
+        if sym_mode == "bfs":
+            clauses.extend(symmetry_breaking_common(self.codec))
+            clauses.extend(symmetry_breaking_bfs(self.codec))
+        if extra_clauses is not None:
+            clauses.extend(extra_clauses(None, self.codec))
+        for clause in clauses:
+            self.add_clause(clause)
+
+        self.nodes = {(): 0}
+        self.node_vars = [[self.codec.color_node(0, c) for c in range(n_colors)]]
+        self.label_acts = {}
+        self.card_acts = {}
+
+        self.dfa_vars = list(range(1, self.codec.offsets[1] + 1)) + list(range(self.codec.offsets[2] + 1, self.codec.offsets[3] + 1))
+        self.non_stutter_lits = [
+            self.codec.parent_relation(token, c1, c2)
+            for token in range(len(self.inputs)) for c1 in range(n_colors) for c2 in range(n_colors) if c1 != c2
+        ]
+
+    def new_var(self):
+        self.top += 1
+        return self.top
+
+    def add_clause(self, clause):
+        self.top = max(self.top, max(map(abs, clause), default=0))
+        self.solver.add_clause(clause)
+
+    def add_word(self, word):
+        node = 0
+        for i, char in enumerate(word):
+            prefix = word[:i + 1]
+            child = self.nodes.get(prefix)
+            if child is None:
+                child = self.add_node(node, self.tokens[char])
+                self.nodes[prefix] = child
+            node = child
+        return node
+
+    def add_node(self, parent, token):
+        colors = range(self.n_colors)
+        node_vars = [self.new_var() for _ in colors]
+        self.add_clause(node_vars) # At least one color
+        for i in colors:
+            for j in range(i + 1, self.n_colors):
+                self.add_clause([-node_vars[i], -node_vars[j]]) # At most one color
+        parent_vars = self.node_vars[parent]
+        for i in colors:
+            for j in colors:
+                parent_rel = self.codec.parent_relation(token, i, j)
+                self.add_clause([-parent_vars[i], -node_vars[j], parent_rel])
+                self.add_clause([-parent_vars[i], node_vars[j], -parent_rel])
+        self.node_vars.append(node_vars)
+        return len(self.node_vars) - 1
+
+    def label_act(self, word, label):
+        act = self.label_acts.get((word, label))
+        if act is None:
+            node = self.add_word(word)
+            act = self.new_var()
+            for c in range(self.n_colors):
+                z = self.codec.color_accepting(c)
+                self.add_clause([-act, -self.node_vars[node][c], z if label else -z])
+            self.label_acts[word, label] = act
+        return act
+
+    def card_act(self, kind, bound):
+        act = self.card_acts.get((kind, bound))
+        if act is None:
+            enc = CardEnc.atmost if kind == "atmost" else CardEnc.equals
+            formula = enc(lits=self.non_stutter_lits, bound=bound, top_id=self.top)
+            self.top = max(self.top, formula.nv)
+            act = self.new_var()
+            for clause in formula.clauses:
+                self.add_clause([-act] + clause)
+            self.card_acts[kind, bound] = act
+        return act
+
+    def enum_models(self, assumptions):
+        query_act = self.new_var() # Guards the blocking clauses of this enumeration
+        try:
+            while solve_before(self.solver, assumptions + [query_act]):
+                model = self.solver.get_model()
+                yield model
+                self.add_clause([-query_act] + [-model[v - 1] for v in self.dfa_vars])
+        finally:
+            self.add_clause([-query_act])
+
+    def extract_dfa(self, model):
+        true = lambda lit: model[lit - 1] > 0
+        accepting = {c for c in range(self.n_colors) if true(self.codec.color_accepting(c))}
+        dfa_dict = {c: (c in accepting, {}) for c in range(self.n_colors)}
+        for token, a in enumerate(self.inputs):
+            for c1 in range(self.n_colors):
+                for c2 in range(self.n_colors):
+                    if true(self.codec.parent_relation(token, c1, c2)):
+                        dfa_dict[c1][1][a] = c2
+        start = next(c for c in range(self.n_colors) if true(self.codec.color_node(0, c)))
+        dfa_ = dict2dfa(dfa_dict, start=start)
+        return DFA(
+            start=dfa_.start,
+            inputs=dfa_.inputs,
+            outputs=dfa_.outputs,
+            label=dfa_._label,
+            transition=dfa_._transition,
+        )
+
+    def find_dfas(self, accepting, rejecting, order_by_stutter=False):
+        """ All the DFAs with n_colors states consistent with the examples, see dfa_identify.find_dfas """
+        assumptions = [self.label_act(word, True) for word in accepting]
+        assumptions += [self.label_act(word, False) for word in rejecting]
+        if not solve_before(self.solver, assumptions):
+            return
+        if not order_by_stutter:
+            yield from map(self.extract_dfa, self.enum_models(assumptions))
+            return
+        model = self.solver.get_model()
+
+        # Same search as dfa_identify.identify.order_models_by_stutter
+        def non_stutter_count(model):
+            return sum(model[x - 1] > 0 for x in self.non_stutter_lits)
+
+        def find_models(bound, kind):
+            return self.enum_models(assumptions + [self.card_act(kind, bound)])
+
+        candidate_bound = non_stutter_count(model)
+        hi = candidate_bound
+        lo = self.n_colors - 1
+        while lo < hi:
+            mid = (lo + hi) // 2
+            witness = next(find_models(mid, "atmost"), None)
+            if witness is not None:
+                hi = non_stutter_count(witness)
+                assert hi <= mid
+            else:
+                lo = mid + 1
+
+        naive_bound = len(self.non_stutter_lits)
+        for bound in range(lo, naive_bound + 1):
+            if bound > candidate_bound:
+                witness = next(find_models(bound, "atmost"), None)
+                if witness is None:
+                    break
+                candidate_bound = non_stutter_count(witness)
+            yield from map(self.extract_dfa, find_models(bound, "equals"))
+
+
+def get_identifier(alphabet, n_colors, sym_mode="bfs", extra_clauses=None):
+    key = (frozenset(alphabet), n_colors, sym_mode, extra_clauses)
+    identifier = _identifiers.get(key)
+    if identifier is None or len(identifier.node_vars) > MAX_NODES:
+        if identifier is not None:
+            identifier.solver.delete()
+        identifier = IncrementalIdentifier(alphabet, n_colors, sym_mode, extra_clauses)
+        _identifiers[key] = identifier
+    return identifier
+
+
+def find_dfas_incremental(accepting, rejecting, alphabet=None, order_by_stutter=False, extra_clauses=None, bounds=(None, None), sym_mode="bfs"):
+    """ Drop-in for dfa_identify.find_dfas that reuses the solvers across calls """
+    accepting = list(map(tuple, accepting))
+    rejecting = list(map(tuple, rejecting))
+    if set(accepting) & set(rejecting):
+        return
+    if alphabet is None:
+        alphabet = {char for word in accepting + rejecting for char in word}
+        if not alphabet:
+            raise ValueError('Need examples or an alphabet!')
+
+    # The prefix tree of the examples bounds the number of states needed
+    max_needed = len({word[:i] for word in accepting + rejecting for i in range(len(word) + 1)} | {()})
+    low, high = bounds
+    low = 1 if low is None else low
+    high = max(low, max_needed) if high is None else high
+
+    for n_colors in range(low, high + 1):
+        identifier = get_identifier(alphabet, n_colors, sym_mode, extra_clauses)
+        dfas = identifier.find_dfas(accepting, rejecting, order_by_stutter)
+        first = next(dfas, None)
+        if first is None:
+            continue
+        yield first
+        yield from dfas
+        return
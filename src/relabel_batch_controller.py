@@ -0,0 +1,61 @@
+"""
+Picks the number of traces to relabel at each training iteration.
+
+The controller keeps an exponential moving average of the relabel time per
+trace and of the train time per iteration, and sizes the next relabel batch
+so that relabeling takes about target_ratio times the train time, clipped to
+the number of traces waiting to be relabeled.
+"""
+
+import numpy as np
+
+
+class RelabelBatchController():
+
+    def __init__(self, target_ratio=0.5, min_batch_size=1, max_batch_size=64, init_batch_size=2, ema_decay=0.9):
+        """
+            target_ratio:
+                - (float) target ratio of relabel time to train time
+            min_batch_size, max_batch_size:
+                - (int) bounds on the chosen batch size
+            init_batch_size:
+                - (int) batch size used until both times are measured
+            ema_decay:
+                - (float) weight of the past in the moving averages
+        """
+        self.target_ratio = target_ratio
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max_batch_size
+        self.init_batch_size = init_batch_size
+        self.ema_decay = ema_decay
+        self.latency_per_trace = None
+        self.train_time = None
+        self.batch_size = init_batch_size
+
+    def _ema(self, avg, x):
+        return x if avg is None else self.ema_decay * avg + (1 - self.ema_decay) * x
+
+    def record_relabel(self, seconds, n_traces):
+        if n_traces > 0:
+            self.latency_per_trace = self._ema(self.latency_per_trace, seconds / n_traces)
+
+    def record_train(self, seconds):
+        self.train_time = self._ema(self.train_time, seconds)
+
+    def get_batch_size(self, backlog):
+        if self.latency_per_trace is None or self.train_time is None:
+            batch_size = self.init_batch_size
+        elif self.latency_per_trace <= 0:
+            batch_size = self.max_batch_size
+        else:
+            batch_size = int(self.target_ratio * self.train_time / self.latency_per_trace)
+        self.batch_size = int(np.clip(batch_size, self.min_batch_size, self.max_batch_size))
+        return min(self.batch_size, backlog)
+
+    def log(self, logger, backlog):
+        logger.record("relabel/batch_size", self.batch_size)
+        logger.record("relabel/backlog", backlog)
+        if self.latency_per_trace is not None:
+            logger.record("relabel/latency_per_trace", self.latency_per_trace)
+        if self.train_time is not None:
+            logger.record("relabel/train_time", self.train_time)
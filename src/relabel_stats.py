@@ -0,0 +1,57 @@
+"""
+Timers and counters of the relabel pipeline.
+
+Stage latencies and per-relabel values are kept over a sliding window and
+logged to the SB3 logger under relabel/, i.e., the mean of each window as a
+scalar and the whole window as a histogram (tensorboard only).
+"""
+
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+import numpy as np
+import torch as th
+
+HISTOGRAM_EXCLUDE = ("stdout", "log", "json", "csv") # Only tensorboard can plot histograms
+
+
+class RelabelStats():
+
+    def __init__(self, window=1000):
+        self.times = defaultdict(lambda: deque(maxlen=window))
+        self.values = defaultdict(lambda: deque(maxlen=window))
+        self.counts = defaultdict(int)
+        self.start_time = time.time()
+
+    @contextmanager
+    def timer(self, stage):
+        start_time = time.time()
+        try:
+            yield
+        finally:
+            self.times[stage].append(time.time() - start_time)
+
+    def add_time(self, stage, seconds):
+        self.times[stage].append(seconds)
+
+    def add_value(self, name, value):
+        self.values[name].append(value)
+
+    def count(self, name, n=1):
+        self.counts[name] += n
+
+    def log(self, logger):
+        for stage, times in self.times.items():
+            if len(times) == 0:
+                continue
+            logger.record(f"relabel/time/{stage}", np.mean(times))
+            logger.record(f"relabel/time/{stage}_hist", th.tensor(times), exclude=HISTOGRAM_EXCLUDE)
+        for name, values in self.values.items():
+            if len(values) == 0:
+                continue
+            logger.record(f"relabel/{name}", np.mean(values))
+            logger.record(f"relabel/{name}_hist", th.tensor(values), exclude=HISTOGRAM_EXCLUDE)
+        for name, n in self.counts.items():
+            logger.record(f"relabel/n_{name}", n)
+        logger.record("relabel/relabels_per_sec", self.counts["relabeled"] / (time.time() - self.start_time))
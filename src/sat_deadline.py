@@ -0,0 +1,75 @@
+"""
+Wall-clock deadline of the SAT calls of the DFA identifications.
+
+The soft time budget of a relabel is only checked between the concepts found
+by DISS, so a single long SAT call could run past it. Within time_limit, the
+solvers made by bounded_solver_fact (and the calls of solve_before) interrupt
+their search at the deadline and raise IdentificationTimeout, which is left
+uncached and stops the search of the relabel.
+"""
+
+import time
+import threading
+from contextlib import contextmanager
+
+from pysat.solvers import Glucose4
+
+
+class IdentificationTimeout(Exception):
+    """ Not a TimeoutError, which DISS swallows to skip to its next iteration """
+
+
+_deadline = None
+
+
+@contextmanager
+def time_limit(seconds):
+    """ Bounds the SAT calls made within the context to seconds from now, no bound if None """
+    global _deadline
+    previous = _deadline
+    _deadline = None if seconds is None else time.time() + seconds
+    try:
+        yield
+    finally:
+        _deadline = previous
+
+
+def get_deadline():
+    """ The deadline (time.time() based) of the current time_limit, None if unbounded """
+    return _deadline
+
+
+def solve_before(solver, assumptions=(), deadline=None):
+    """ solver.solve(assumptions) interrupted at deadline (default: the one of time_limit) """
+    deadline = _deadline if deadline is None else deadline
+    if deadline is None:
+        return solver.solve(assumptions=list(assumptions))
+    remaining = deadline - time.time()
+    if remaining <= 0:
+        raise IdentificationTimeout()
+    timer = threading.Timer(remaining, solver.interrupt)
+    timer.start()
+    try:
+        status = solver.solve_limited(assumptions=list(assumptions), expect_interrupt=True)
+    finally:
+        timer.cancel()
+    solver.clear_interrupt()
+    if status is None: # Interrupted
+        raise IdentificationTimeout()
+    return status
+
+
+def bounded_solver_fact(solver_fact=Glucose4):
+    """
+    solver_fact itself outside of time_limit, otherwise a factory of its solvers
+    whose solve (used by enum_models too) goes through solve_before.
+    """
+    deadline = _deadline
+    if deadline is None:
+        return solver_fact
+
+    def make_solver(*args, **kwargs):
+        solver = solver_fact(*args, **kwargs)
+        solver.solve = lambda assumptions=[]: solve_before(solver, assumptions, deadline)
+        return solver
+    return make_solver
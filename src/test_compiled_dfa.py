@@ -0,0 +1,151 @@
+import random
+
+import numpy as np
+import pytest
+from dfa import DFA
+from dfa.utils import find_equiv_counterexample, find_subset_counterexample, min_distance_to_accept_by_state, minimize
+
+from compiled_dfa import CompiledDFA, DFAGoal, TableEncoding, compile_cnf, find_subset_ce, goal_ints
+
+INPUTS = tuple("abcde")
+
+
+def random_dfa(rng, n_states, inputs=INPUTS):
+    transitions = {(s, a): rng.randrange(n_states) for s in range(n_states) for a in inputs}
+    accepting = {s for s in range(n_states) if rng.random() < 0.3}
+    return DFA(start=0, inputs=inputs, label=lambda s: s in accepting, transition=lambda s, a: transitions[s, a])
+
+
+def random_goal(rng, n_conjunctions, n_disjunctions, max_states):
+    return tuple(tuple(random_dfa(rng, rng.randint(1, max_states)) for _ in range(rng.randint(1, n_disjunctions)))
+                 for _ in range(rng.randint(0, n_conjunctions)))
+
+
+def random_word(rng, max_len=6):
+    return tuple(rng.choice(INPUTS) for _ in range(rng.randint(0, max_len)))
+
+
+def same_language(compiled, dfa):
+    return find_equiv_counterexample(compiled.to_dfa(), dfa) is None
+
+
+def test_int_encoding_matches_dfa():
+    rng = random.Random(5)
+    for _ in range(100):
+        dfa = random_dfa(rng, rng.randint(1, 8))
+        dfa_int = dfa.to_int()
+        assert CompiledDFA.from_dfa(dfa).to_int() == dfa_int
+        compiled = CompiledDFA.from_int(dfa_int, INPUTS)
+        assert same_language(compiled, DFA.from_int(dfa_int, INPUTS))
+        assert compiled.to_int() == dfa_int
+
+
+def test_minimize_matches_dfa():
+    rng = random.Random(6)
+    for _ in range(100):
+        dfa = random_dfa(rng, rng.randint(1, 10))
+        minimized = CompiledDFA.from_dfa(dfa).minimize()
+        assert minimized.n_states == len(minimize(dfa).states())
+        assert same_language(minimized, dfa)
+        # Canonical: the minimization of any other DFA of the language gives the same table
+        assert CompiledDFA.from_dfa(minimize(dfa)).minimize() == minimized
+
+
+def test_words_match_dfa():
+    rng = random.Random(7)
+    for _ in range(50):
+        dfa = random_dfa(rng, rng.randint(1, 8))
+        compiled = CompiledDFA.from_dfa(dfa)
+        for _ in range(20):
+            word = random_word(rng)
+            assert compiled.accepts(word) == dfa.label(word)
+            assert same_language(compiled.advance(word), dfa.advance(word))
+        word = compiled.find_word()
+        if word is None:
+            assert compiled.is_empty() and dfa.find_word() is None
+        else:
+            assert not compiled.is_empty() and dfa.label(word)
+            distances = min_distance_to_accept_by_state(dfa)
+            assert len(word) == distances[dfa.start] == compiled.min_distance_to_accept()[0]
+
+
+def test_products_match_dfa():
+    rng = random.Random(8)
+    for _ in range(50):
+        dfa1, dfa2 = random_dfa(rng, rng.randint(1, 6)), random_dfa(rng, rng.randint(1, 6))
+        compiled1, compiled2 = CompiledDFA.from_dfa(dfa1), CompiledDFA.from_dfa(dfa2)
+        assert same_language(compiled1 & compiled2, dfa1 & dfa2)
+        assert same_language(compiled1 | compiled2, dfa1 | dfa2)
+        assert same_language(compiled1 ^ compiled2, dfa1 ^ dfa2)
+        assert same_language(~compiled1, ~dfa1)
+
+
+def test_compile_cnf_matches_dfa():
+    rng = random.Random(9)
+    for _ in range(30):
+        dfa_goal = random_goal(rng, 3, 2, 4)
+        if not dfa_goal:
+            continue
+        clauses = [dfa_clause[0] if len(dfa_clause) == 1 else dfa_clause[0] | dfa_clause[1] for dfa_clause in dfa_goal]
+        mono = clauses[0]
+        for clause in clauses[1:]:
+            mono = mono & clause
+        assert same_language(compile_cnf(dfa_goal), mono)
+
+
+def test_subset_ce_matches_dfa():
+    rng = random.Random(10)
+    for _ in range(100):
+        smaller, bigger = random_dfa(rng, rng.randint(1, 6)), random_dfa(rng, rng.randint(1, 6))
+        word = find_subset_ce(CompiledDFA.from_dfa(smaller, INPUTS), CompiledDFA.from_dfa(bigger, INPUTS))
+        expected = find_subset_counterexample(smaller, bigger)
+        assert word == (None if expected is None else tuple(expected))
+
+
+def test_table_encoding_round_trip():
+    rng = random.Random(0)
+    encoding = TableEncoding(INPUTS, 8, 3, 2)
+    for _ in range(200):
+        dfa_goal = random_goal(rng, 3, 2, 8)
+        seq = encoding.encode(dfa_goal)
+        assert seq.shape == (encoding.size,) and seq.dtype == np.uint8
+        decoded = encoding.decode(seq.astype(np.float32)) # As the policy sees it
+        assert len(decoded) == 3
+        for dfa_clause, decoded_clause in zip(dfa_goal, decoded):
+            assert len(dfa_clause) == len(decoded_clause)
+            for dfa, compiled in zip(dfa_clause, decoded_clause):
+                assert compiled == CompiledDFA.from_dfa(dfa, INPUTS).minimize()
+        assert all(len(decoded_clause) == 0 for decoded_clause in decoded[len(dfa_goal):])
+
+
+def test_table_encoding_reorders_inputs():
+    rng = random.Random(1)
+    encoding = TableEncoding(INPUTS, 8, 1, 1)
+    for _ in range(50):
+        dfa = random_dfa(rng, rng.randint(1, 8))
+        reordered = CompiledDFA.from_dfa(dfa, tuple(reversed(INPUTS)))
+        assert np.array_equal(encoding.encode_dfa(reordered), encoding.encode_dfa(dfa))
+
+
+def test_table_encoding_dtype_from_bound():
+    assert TableEncoding(INPUTS, 255, 1, 1).dtype == np.uint8
+    assert TableEncoding(INPUTS, 1296, 1, 1).dtype == np.uint16
+    assert TableEncoding(INPUTS, 70000, 1, 1).dtype == np.uint32
+
+
+def test_table_encoding_too_many_states():
+    encoding = TableEncoding(INPUTS, 2, 1, 1)
+    chain = DFA(start=0, inputs=INPUTS, label=lambda s: s == 3, transition=lambda s, a: min(s + 1, 3) if a == "a" else s)
+    with pytest.raises(ValueError):
+        encoding.encode(((chain,),))
+
+
+def test_goal_ints():
+    rng = random.Random(4)
+    for _ in range(50):
+        dfa_goal = random_goal(rng, 3, 2, 6)
+        expected = tuple(tuple(dfa.to_int() for dfa in dfa_clause) for dfa_clause in dfa_goal)
+        assert goal_ints(dfa_goal) == expected
+        goal = DFAGoal(dfa_goal)
+        assert goal.ints == expected and goal == dfa_goal
+        assert goal_ints(goal) is goal.ints
@@ -0,0 +1,87 @@
+import attr
+from dfa import DFA
+from diss import LabeledExamples
+
+import concept_class
+import identification_cache
+from concept_class import PartialDFAIdentifier, augment, enumerative_search
+
+
+class ResidueChain:
+    # Ego moves are unlikely under two thirds of the concepts, so energies are not ordered by size
+    def __init__(self, concept, tree):
+        p = 0.9 if concept.dfa.to_int() % 3 == 0 else 1e-3
+        self.edge_probs = {edge: p for edge in tree.tree.edges}
+
+
+def make_identifier(positive=("a", "b")):
+    universal = DFA(start=True, inputs={"a", "b", "c"}, outputs={True, False}, label=lambda s: s, transition=lambda s, c: True)
+    return PartialDFAIdentifier(partial=universal, base_examples=LabeledExamples(negative=[], positive=[positive]), encoding_upper=100)
+
+
+def search(**kwargs):
+    demo = [((0, 0), "env"), (1, "ego"), ((1, 1), "env"), (2, "ego")]
+    results = enumerative_search(
+        demos=[demo],
+        identifer=make_identifier(),
+        to_chain=lambda concept, tree, psat: ResidueChain(concept, tree),
+        competency=lambda *_: 10,
+        n_iters=6,
+        **kwargs
+    )
+    return [(concept.dfa.to_int(), metadata["energy"]) for _, concept, metadata in results]
+
+
+def test_enumerative_search_workers_match_sequential():
+    sequential = search()
+    assert len(sequential) > 1
+    parallel = search(n_workers=2, chunk_size=2)
+    assert concept_class._scoring is None # Only set in the workers
+    # The pool yields by increasing energy, the sequential search by size
+    assert [e for _, e in parallel] == sorted(e for _, e in parallel)
+    assert [e for _, e in sequential] != sorted(e for _, e in sequential)
+    assert sorted(parallel) == sorted(sequential)
+
+
+def test_enumerative_search_batched_chains():
+    batched = search(to_chains=lambda concepts, tree: [ResidueChain(concept, tree) for concept in concepts])
+    assert batched == search()
+
+
+def test_augment_closures_bounded(monkeypatch):
+    monkeypatch.setattr(concept_class, "augment_closures", {})
+    monkeypatch.setattr(concept_class, "AUGMENT_CLOSURES_SIZE", 2)
+    for positive in [("a",), ("b",), ("c",), ("a", "b")]:
+        augment(make_identifier(positive), LabeledExamples())
+        assert 0 < len(concept_class.augment_closures) <= 2
+
+
+def test_subset_ce_cache(monkeypatch):
+    monkeypatch.setattr(concept_class, "subset_ces", concept_class.OrderedDict())
+    monkeypatch.setattr(concept_class, "SUBSET_CE_CACHE_SIZE", 2)
+    universal = make_identifier()
+    no_c = attr.evolve(universal, partial=DFA(start=True, inputs={"a", "b", "c"}, label=lambda s: s, transition=lambda s, c: s and c != "c"))
+    # Accept the words with an a, a b, and no words at all
+    candidates = [DFA(start=0, inputs={"a", "b", "c"}, label=lambda s: s == 1, transition=lambda s, c, x=x: 1 if c == x else s) for x in "abd"]
+    for candidate in candidates:
+        assert universal.subset_ce(candidate) is None
+    assert len(concept_class.subset_ces) == 2
+    # Same candidates, other partial
+    assert [no_c.is_subset(candidate) for candidate in candidates] == [False, False, True]
+    assert [no_c.is_subset(candidate) for candidate in candidates] == [False, False, True]
+    assert no_c.partial_dfa(candidates[0].inputs).label(no_c.subset_ce(candidates[0])) is False
+
+
+def test_cached_augment_independent_of_history(monkeypatch):
+    monkeypatch.setattr(concept_class, "augment_closures", {})
+    identification_cache.configure()
+    identifier = make_identifier()
+    data = LabeledExamples(positive=[("a", "a")], negative=[("c",)])
+    # A closure remembered from an earlier example set
+    key = concept_class.hash_key(concept_class.identifier_key(identifier))
+    concept_class.augment_closures[key] = concept_class.deque([(frozenset(), frozenset(), frozenset({("b", "b", "b")}))])
+    assert ("b", "b", "b") in augment(identifier, data).negative
+
+    concept_class.augment_closures.clear()
+    assert ("b", "b", "b") not in augment(identifier, data).negative
+    identification_cache.configure()
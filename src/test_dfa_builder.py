@@ -0,0 +1,39 @@
+import random
+
+import numpy as np
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("dgl")
+import networkx as nx
+
+from compiled_dfa import CompiledDFA, TableEncoding
+from test_compiled_dfa import random_goal
+from utils.dfa_builder import DFABuilder
+
+PROPOSITIONS = list("abcde")
+
+
+def to_nx(g):
+    nxg = nx.MultiDiGraph()
+    for v, (feat, is_root) in enumerate(zip(g.ndata["feat"].numpy(), g.ndata["is_root"].numpy())):
+        nxg.add_node(v, feat=tuple(feat.ravel()), is_root=tuple(is_root.ravel()))
+    for u, v, t in zip(*map(lambda x: x.tolist(), g.edges()), g.edata["type"].tolist()):
+        nxg.add_edge(u, v, type=t)
+    return nxg
+
+
+def test_table_graph_matches_int_seq_graph():
+    rng = random.Random(0)
+    encoding = TableEncoding(PROPOSITIONS, 6, 3, 1)
+    int_builder = DFABuilder(PROPOSITIONS, 3, 1)
+    table_builder = DFABuilder(PROPOSITIONS, 3, 1, table_encoding=encoding)
+    for _ in range(50):
+        dfa_goal = random_goal(rng, 3, 1, 6)
+        compiled_goal = [tuple(CompiledDFA.from_int(CompiledDFA.from_dfa(dfa, PROPOSITIONS).to_int(), PROPOSITIONS) for dfa in dfa_clause) for dfa_clause in dfa_goal]
+        g1 = int_builder._to_graph_one_layer(compiled_goal)
+        g2 = table_builder(encoding.encode(dfa_goal).astype(np.float32))
+        assert g1.ndata["feat"].shape[1:] == g2.ndata["feat"].shape[1:]
+        assert g1.ndata["feat"].dtype == g2.ndata["feat"].dtype
+        assert nx.is_isomorphic(to_nx(g1), to_nx(g2), node_match=dict.__eq__,
+                                edge_match=lambda a, b: sorted(e["type"] for e in a.values()) == sorted(e["type"] for e in b.values()))
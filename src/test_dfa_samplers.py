@@ -0,0 +1,44 @@
+import random
+
+import numpy as np
+import pytest
+
+from compiled_dfa import CompiledDFA, TableEncoding
+from dfa_samplers import DFASampler, getDFASampler
+
+PROPOSITIONS = list("abcdefghijkl")
+
+
+@pytest.mark.parametrize("sampler_id", [
+    "ReachAvoid_1_2_1_2",
+    "CompositionalReachAvoid_1_2_1_2",
+    "Eventually_1_5_1_4",
+    "CompositionalEventually_1_5_1_4",
+    "ReachAvoidFix_1_2_1_2",
+    "CompositionalReachAvoidFix_1_2_1_2",
+    "Parity_1_2_1_2",
+    "CompositionalParity_1_2_1_2",
+    "Adversarial",
+    "GeneralDFA",
+    "CompositionalGeneralDFA",
+    "Eventually_1_3_1_2_JOIN_ReachAvoid_1_2_1_2",
+])
+def test_state_bound(sampler_id):
+    random.seed(0)
+    np.random.seed(0)
+    sampler = getDFASampler(sampler_id, PROPOSITIONS)
+    bound = sampler.get_state_bound()
+    encoding = TableEncoding(PROPOSITIONS, bound, sampler.get_n_conjunctions(), sampler.get_n_disjunctions())
+    for _ in range(20):
+        dfa_goal = sampler.sample()
+        assert len(dfa_goal) <= sampler.get_n_conjunctions()
+        for dfa_clause in dfa_goal:
+            for dfa in dfa_clause:
+                assert CompiledDFA.from_dfa(dfa, PROPOSITIONS).minimize().n_states <= bound
+        assert encoding.encode(dfa_goal).shape == (encoding.size,)
+        assert dfa_goal.ints == tuple(tuple(dfa.to_int() for dfa in dfa_clause) for dfa_clause in dfa_goal)
+
+
+def test_no_state_bound():
+    with pytest.raises(ValueError):
+        DFASampler(PROPOSITIONS).get_state_bound()
@@ -0,0 +1,92 @@
+import random
+
+import numpy as np
+import pytest
+
+gym = pytest.importorskip("gym")
+pytest.importorskip("stable_baselines3")
+from gym import spaces
+
+from dfa_vec_env import DFAVecEnv
+from dfa_wrappers import DFAEnv
+
+PROPOSITIONS = list("abcdefghijkl")
+
+
+class EventEnv(gym.Env):
+    # Action i emits the i-th proposition, the last one no event
+    observation_space = spaces.Box(low=0, high=len(PROPOSITIONS), shape=(1,), dtype=np.float32)
+    action_space = spaces.Discrete(len(PROPOSITIONS) + 1)
+
+    def reset(self):
+        self.event = ""
+        self.time = 0
+        return np.zeros(1, dtype=np.float32)
+
+    def step(self, action):
+        self.event = (PROPOSITIONS + [""])[action]
+        self.time += 1
+        return np.full(1, action, dtype=np.float32), 0.0, self.time >= 20, {}
+
+    def get_events(self):
+        return self.event
+
+    def get_propositions(self):
+        return PROPOSITIONS
+
+
+def make_envs(n_envs, dfa_encoding):
+    envs = []
+    for _ in range(n_envs):
+        random.seed(0) # The size bound of the sampler depends on a sampled DFA
+        envs.append(DFAEnv(EventEnv(), "Eventually_1_3_1_2", dfa_encoding=dfa_encoding))
+    return envs
+
+
+@pytest.mark.parametrize("dfa_encoding", ["int_seq", "table"])
+def test_matches_dfa_envs(dfa_encoding):
+    n_envs = 4
+    rng = np.random.default_rng(0)
+    actions = rng.integers(0, len(PROPOSITIONS) + 1, size=(200, n_envs))
+
+    # Both runs sample the same goals, in the same order, from the same seeds
+    vec_env = DFAVecEnv(make_envs(n_envs, dfa_encoding))
+    random.seed(1)
+    np.random.seed(1)
+    vec_steps = [(vec_env.reset(), None, None, None)]
+    for step_actions in actions:
+        vec_steps.append(vec_env.step(step_actions))
+
+    envs = make_envs(n_envs, dfa_encoding)
+    random.seed(1)
+    np.random.seed(1)
+    obss = [env.reset() for env in envs]
+    for (vec_obs, _, _, _), step_actions, (_, vec_rews, vec_dones, vec_infos) in zip(vec_steps, actions, vec_steps[1:]):
+        assert np.array_equal(vec_obs["dfa"], np.stack([obs["dfa"] for obs in obss]))
+        assert np.array_equal(vec_obs["features"], np.stack([obs["features"] for obs in obss]))
+        for i, (env, action) in enumerate(zip(envs, step_actions)):
+            obs, rew, done, _ = env.step(action)
+            assert vec_rews[i] == rew and vec_dones[i] == done
+            if done:
+                assert np.array_equal(vec_infos[i]["terminal_observation"]["dfa"], obs["dfa"])
+                obs = env.reset()
+            obss[i] = obs
+    # The envs share the progression cache of the first one
+    assert vec_env.envs[0].progression_hits > 0
+    assert all(env.progression_hits == env.progression_misses == 0 for env in vec_env.envs[1:])
+
+
+def test_same_goal_and_event_progressed_once():
+    vec_env = DFAVecEnv(make_envs(3, "int_seq"))
+    vec_env.reset()
+    progress_env = vec_env.envs[0]
+    for env in vec_env.envs[1:]:
+        env.dfa_goal = type(env.dfa_goal)(list(progress_env.dfa_goal)) # Same goal, other DFA objects
+        env.dfa_goal_int_seq = progress_env.dfa_goal_int_seq
+    progress_env.progression_cache.clear()
+    misses = progress_env.progression_misses
+    vec_obs, _, dones, _ = vec_env.step(np.full(3, PROPOSITIONS.index("a")))
+    assert progress_env.progression_misses == misses + 1
+    assert not any(dones)
+    assert all(env.dfa_goal is progress_env.dfa_goal for env in vec_env.envs)
+    assert all(np.array_equal(vec_obs["dfa"][i], vec_obs["dfa"][0]) for i in range(3))
@@ -0,0 +1,55 @@
+import random
+
+import numpy as np
+import pytest
+
+gym = pytest.importorskip("gym")
+from gym import spaces
+
+from compiled_dfa import CompiledDFA, DFAGoal
+from dfa_wrappers import DFAEnv
+
+PROPOSITIONS = list("abcdefghijkl")
+
+
+class EventEnv(gym.Env):
+    # Emits a random proposition, or no event, at each step
+    observation_space = spaces.Box(low=0, high=1, shape=(1,), dtype=np.float32)
+    action_space = spaces.Discrete(2)
+
+    def reset(self):
+        self.event = ""
+        return np.zeros(1, dtype=np.float32)
+
+    def step(self, action):
+        self.event = random.choice(PROPOSITIONS + [""])
+        return np.zeros(1, dtype=np.float32), 0.0, False, {}
+
+    def get_events(self):
+        return self.event
+
+    def get_propositions(self):
+        return PROPOSITIONS
+
+
+def test_progression_keyed_on_goal_ints():
+    random.seed(0)
+    env = DFAEnv(EventEnv(), "Eventually_1_3_1_2")
+    env.reset()
+    for _ in range(100):
+        dfa_goal = env.dfa_goal
+        assert isinstance(dfa_goal, DFAGoal)
+        event = random.choice(PROPOSITIONS)
+        next_dfa_goal, changed, _, done, int_seq = env.progress(dfa_goal, event)
+        expected = tuple(tuple(CompiledDFA.from_dfa(dfa).advance(event).to_int() for dfa in dfa_clause) for dfa_clause in dfa_goal)
+        assert next_dfa_goal.ints == expected
+        assert changed == (expected != dfa_goal.ints)
+        if changed:
+            assert np.array_equal(int_seq, env.encode(next_dfa_goal))
+        # The same goal, with other DFA objects, hits the cache
+        hits = env.progression_hits
+        assert env.progress(DFAGoal(list(dfa_goal)), event)[0] is next_dfa_goal
+        assert env.progression_hits == hits + 1
+        env.dfa_goal = next_dfa_goal
+        if done:
+            env.reset()
@@ -0,0 +1,39 @@
+from diss_cache import DissResultCache
+
+EVENTS = ("a", "b")
+
+
+def test_model_id_per_bucket():
+    cache = DissResultCache(version_bucket_size=2)
+    calls = []
+
+    def fingerprint():
+        calls.append(None)
+        return len(calls)
+    assert [cache.model_id(version, fingerprint) for version in range(1, 6)] == [1, 2, 2, 3, 3]
+    assert len(calls) == 3
+
+
+def test_persisted_results_need_the_same_weights(tmp_path):
+    path = str(tmp_path / "diss_cache.pkl")
+    cache = DissResultCache(path=path)
+    key = cache.key(EVENTS, 3, None, cache.model_id(1, lambda: "weights of run 1"))
+    cache.put(key, [(123, 0.5)])
+    cache.save()
+
+    # Another run starts over from version 1 with other weights
+    cache = DissResultCache(path=path)
+    assert cache.get(cache.key(EVENTS, 3, None, cache.model_id(1, lambda: "weights of run 2"))) is None
+    cache = DissResultCache(path=path)
+    assert cache.get(cache.key(EVENTS, 3, None, cache.model_id(1, lambda: "weights of run 1"))) == ((123, 0.5),)
+
+
+def test_lru_eviction():
+    cache = DissResultCache(max_size=2)
+    keys = [cache.key((str(i),), 3, None, "model") for i in range(3)]
+    cache.put(keys[0], [(0, 0.0)])
+    cache.put(keys[1], [(1, 0.0)])
+    assert cache.get(keys[0]) is not None
+    cache.put(keys[2], [(2, 0.0)])
+    assert cache.get(keys[1]) is None
+    assert len(cache) == 2 and cache.hits == 1 and cache.misses == 1
@@ -0,0 +1,128 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("gym")
+pytest.importorskip("stable_baselines3")
+
+from dfa import DFA
+from diss import DemoPrefixTree as PrefixTree
+from diss.concept_classes import DFAConcept
+
+from diss_interface import NNPlanner
+
+N = 32 # Size of the binary DFA encodings
+
+
+class LineDynamics:
+    # The observation is a position, each move succeeds with probability 0.5
+    N = N
+
+    def transition_probabilities(self, obss, actions, target_obss):
+        return np.full(len(actions), 0.5)
+
+    def transition_probability(self, obs, action, target_obs):
+        return 0.5
+
+
+class QNet(torch.nn.Module):
+
+    def __init__(self):
+        super().__init__()
+        self.linear = torch.nn.Linear(1 + N, 3)
+
+    def forward(self, obss):
+        features = obss["features"].float().reshape(len(obss["features"]), -1)
+        return self.linear(torch.cat([features, obss["dfa"].float()], dim=1))
+
+
+def make_concepts():
+    dfas = [
+        DFA(start=False, inputs={"a", "b"}, label=lambda s: s, transition=lambda s, c: s or c == "a"),
+        DFA(start=False, inputs={"a", "b"}, label=lambda s: s, transition=lambda s, c: s or c == "b"),
+        DFA(start=0, inputs={"a", "b"}, label=lambda s: s == 2, transition=lambda s, c: min(2, s + 1) if c == "a" else s),
+    ]
+    return [DFAConcept.from_dfa(dfa) for dfa in dfas]
+
+
+def test_plan_batch_matches_plan():
+    torch.manual_seed(0)
+    policy = SimpleNamespace(device="cpu", policy=SimpleNamespace(q_net=QNet()), predict=None)
+    planner = NNPlanner(LineDynamics(), policy)
+    features = np.arange(5, dtype=np.float32).reshape(5, 1)
+    demo = planner.to_demo(features, np.array([1, 0, 2, 1]))
+    tree = PrefixTree.from_demos([demo])
+    concepts = make_concepts()
+
+    chains = planner.plan_batch(concepts, tree)
+    assert len(chains) == len(concepts)
+    for concept, chain in zip(concepts, chains):
+        expected = planner.plan(concept, tree).edge_probs
+        assert chain.edge_probs.keys() == expected.keys()
+        for edge, prob in expected.items():
+            assert float(chain.edge_probs[edge]) == pytest.approx(float(prob), rel=1e-5)
+    assert planner.plan_batch([], tree) == []
+
+
+class StepDynamics(LineDynamics):
+    # The observation is a position, actions 0 to 3 stay, move by 1, by -1 and by 2,
+    # positions 1 and 2 are labeled a and position -1 is labeled b. One step per rollout.
+    timeout = 1
+    moves = np.array([0, 1, -1, 2])
+
+    def step_from_obss(self, prev_obss, actions, times):
+        obss = prev_obss + self.moves[np.asarray(actions)].reshape(-1, 1)
+        return obss.astype(prev_obss.dtype), (np.asarray(times) + 1) > self.timeout
+
+    def get_events_given_obss(self, obss):
+        return [{1: "a", 2: "a", -1: "b"}.get(int(obs[0]), "") for obs in obss]
+
+
+class ScriptedPolicy:
+    # Takes the scripted actions of the active rollouts, in order
+
+    def __init__(self, *scripts):
+        self.scripts = list(scripts)
+        self.batch_sizes = []
+
+    def predict(self, obs):
+        self.batch_sizes.append(len(obs["features"]))
+        return np.array(self.scripts.pop(0)), None
+
+
+def sample_chain(positions, actions, policy):
+    env = StepDynamics()
+    planner = NNPlanner(env, policy)
+    demo = planner.to_demo(np.array(positions, dtype=np.float32).reshape(-1, 1), np.array(actions))
+    tree = PrefixTree.from_demos([demo])
+    eventually_a = DFA(start=False, inputs={"a", "b"}, label=lambda s: s, transition=lambda s, c: s or c == "a")
+    return planner.plan(DFAConcept.from_dfa(eventually_a), tree), tree, planner.observations
+
+
+def test_sample_many_returns_first_attempt_with_outcome():
+    # The wins of the first request reach a in attempts 1 and 2, the second request never wins
+    policy = ScriptedPolicy([2, 3, 1, 2, 0, 2])
+    chain, tree, observations = sample_chain([0, 0], [0], policy)
+    pivot = 1 # The ego node after the root
+    assert tree.is_ego(pivot)
+    prefix = list(tree.prefix(pivot))
+    win, no_win, lose = chain.sample_many([(pivot, True), (pivot, True), (pivot, False)], attempts=3)
+
+    start = observations.intern(np.array([0], dtype=np.float32))
+    assert win == (prefix + [(start, 3), observations.intern(np.array([2], dtype=np.float32))], None)
+    assert no_win is None
+    # Not accepting a yet accepts the negated goal, the lose request is decided by its prefix
+    assert lose == (prefix, None)
+    assert policy.batch_sizes == [6]
+
+
+def test_sample_forced_env_pivot_action():
+    # The pivot is the env node of the demo's second action, 1, which reaches a whatever the policy takes
+    policy = ScriptedPolicy([2])
+    chain, tree, observations = sample_chain([0, 0, 1], [0, 1], policy)
+    pivot = 2
+    assert not tree.is_ego(pivot) and tree.state(pivot)[1] == 1
+    path, _ = chain.sample(pivot, True)
+    assert path == list(tree.prefix(pivot)) + [observations.intern(np.array([1], dtype=np.float32))]
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("stable_baselines3")
+from gym import spaces
+from stable_baselines3.common.type_aliases import DictReplayBufferSamples
+
+from diss_replay_buffer import DissReplayBuffer
+
+MAX_EPISODE_LENGTH = 4
+
+
+def make_buffer(her_replay_buffer_size=3):
+    observation_space = spaces.Dict({"features": spaces.Box(low=0, high=1, shape=(2,)),
+                                     "dfa"     : spaces.Box(low=0, high=9, shape=(3,), dtype=np.int64)})
+    return DissReplayBuffer(16, observation_space, spaces.Discrete(2), max_episode_length=MAX_EPISODE_LENGTH,
+                            her_replay_buffer_size=her_replay_buffer_size, device="cpu")
+
+
+def make_samples(lengths, value):
+    batch_size, n_steps = len(lengths), MAX_EPISODE_LENGTH + 1
+    dones = np.zeros((batch_size, n_steps, 1), dtype=np.float32)
+    dones[np.arange(batch_size), np.array(lengths) - 1] = 1.0
+    obs = {"features": np.full((batch_size, n_steps, 2), value, dtype=np.float32),
+           "dfa": np.full((batch_size, n_steps, 3), value, dtype=np.float32)}
+    return DictReplayBufferSamples(observations=obs, actions=np.zeros((batch_size, n_steps, 1), dtype=np.int64),
+                                   next_observations=obs, dones=dones, rewards=dones.copy())
+
+
+def test_relabel_batch_of_one():
+    buffer = make_buffer()
+    buffer.relabel_traces(1, make_samples([2], 1.0))
+    assert buffer.episode_lengths[0] == 2
+    assert buffer.her_replay_buffer_relabeled["is_ready_to_use"][0].tolist() == [True, True, False, False, False]
+    assert buffer.current_episode_idx_relabeled == 1
+    assert not buffer.is_her_replay_buffer_relabeled_full
+
+
+def test_relabel_batch_across_buffer_end():
+    buffer = make_buffer(her_replay_buffer_size=3)
+    buffer.relabel_traces(2, make_samples([1, 2], 1.0))
+    buffer.relabel_traces(2, make_samples([3, 4], 2.0))
+    assert buffer.episode_lengths.tolist() == [4, 2, 3]
+    assert buffer.her_replay_buffer_relabeled["features"][:, 0, 0].tolist() == [2.0, 1.0, 2.0]
+    assert buffer.her_replay_buffer_relabeled["is_ready_to_use"].sum(axis=1).tolist() == [4, 2, 3]
+    assert buffer.current_episode_idx_relabeled == 1
+    assert buffer.is_her_replay_buffer_relabeled_full
+
+
+def test_relabel_batch_up_to_buffer_end():
+    buffer = make_buffer(her_replay_buffer_size=3)
+    buffer.relabel_traces(3, make_samples([1, 2, 3], 1.0))
+    assert buffer.current_episode_idx_relabeled == 0
+    assert buffer.is_her_replay_buffer_relabeled_full
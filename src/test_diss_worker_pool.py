@@ -0,0 +1,60 @@
+import os
+import time
+
+import numpy as np
+
+from diss_worker_pool import DissWorkerPool, RelabelResult, RelabelTask
+
+
+def make_worker():
+    def worker(task):
+        if task.target_num_states == -1: # Dies on the trace
+            os._exit(1)
+        if task.target_num_states == -2: # Stuck on the trace
+            time.sleep(60)
+        return RelabelResult(task.trace_id, task.target_num_states, 0.0)
+    return worker
+
+
+def make_task(trace_id, target_num_states):
+    return RelabelTask(trace_id, np.zeros(1), np.zeros(1), target_num_states)
+
+
+def test_map():
+    pool = DissWorkerPool(make_worker, n_workers=2, poll_interval=0.05)
+    try:
+        results = pool.map([make_task(i, i + 1) for i in range(6)])
+        assert [(result.trace_id, result.dfa_int) for result in results] == [(i, i + 1) for i in range(6)]
+    finally:
+        pool.close()
+
+
+def test_recycled_workers():
+    pool = DissWorkerPool(make_worker, n_workers=1, max_tasks_per_worker=2, poll_interval=0.05)
+    try:
+        results = pool.map([make_task(i, i + 1) for i in range(5)])
+        assert [result.dfa_int for result in results] == [1, 2, 3, 4, 5]
+    finally:
+        pool.close()
+
+
+def test_dead_worker_fails_its_trace():
+    pool = DissWorkerPool(make_worker, n_workers=1, poll_interval=0.05)
+    try:
+        dead = pool.submit(make_task(0, -1))
+        assert dead.result(timeout=10).dfa_int is None
+        assert pool.submit(make_task(1, 3)).result(timeout=10).dfa_int == 3 # Replaced
+    finally:
+        pool.close()
+
+
+def test_hard_time_limit():
+    pool = DissWorkerPool(make_worker, n_workers=1, hard_time_limit=0.5, poll_interval=0.05)
+    try:
+        stuck = pool.submit(make_task(0, -2))
+        result = stuck.result(timeout=10)
+        assert result.dfa_int is None and result.timed_out
+        assert pool.submit(make_task(1, 3)).result(timeout=10).dfa_int == 3
+        assert pool.n_timed_out == 1
+    finally:
+        pool.close()
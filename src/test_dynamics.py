@@ -0,0 +1,108 @@
+from itertools import product
+
+import numpy as np
+import pytest
+
+pytest.importorskip("envs") # gym and the env packages
+
+from dfa_wrappers import DFADynamics
+from envs.dfa_world.dfa_world import DummyDynamics
+from envs.gridworld.gridworld_env import ACTION2VEC, GridworldDynamics, GridWorldNaive, GridWorldState
+from envs.gym_letters.letter_env import LetterDynamics, LetterEnv
+
+
+def dynamics_and_obss():
+    # Each dynamics with a batch of 3 observations, the DISS planner steps batches through step_from_obss
+    dummy = DummyDynamics("abc", timeout=5)
+    yield dummy, np.array([[3], [0], [2]])
+    gridworld = GridworldDynamics(3, {(1, 2): "red"}, ["red"], 0.1, 0.0, list(ACTION2VEC))
+    grids = np.zeros((3, 3, 3), dtype=np.uint8)
+    grids[0, 0, 0] = grids[1, 1, 1] = grids[2, 2, 2] = 1
+    yield gridworld, grids
+    letters = LetterDynamics(3, "ab", False, 5, [(-1, 0), (1, 0), (0, -1), (0, 1)])
+    obss = np.zeros((3, 3, 3, 3), dtype=np.uint8)
+    obss[:, 0, 0, 2] = 1
+    obss[:, 1, 0, 0] = 1
+    yield letters, obss
+
+
+@pytest.mark.parametrize("dynamics, obss", list(dynamics_and_obss()))
+def test_step_from_obss_batched(dynamics, obss):
+    dynamics = DFADynamics(dynamics, N=10)
+    next_obss, dones = dynamics.step_from_obss(obss, np.array([0, 1, 0]), np.array([0, 1, 2]))
+    assert next_obss.shape == obss.shape
+    assert np.shape(dones) == (3,)
+    assert len(dynamics.get_events_given_obss(next_obss)) == 3
+
+
+def grid_obs(dim, x, y):
+    obs = np.zeros((dim, dim), dtype=np.uint8)
+    obs[x - 1, y - 1] = 1
+    return obs
+
+
+def test_gridworld_matches_naive_moves():
+    dim, overlay = 3, {(1, 2): "red"}
+    naive = GridWorldNaive(dim, GridWorldState(1, 1), overlay, slip_prob=0.25)
+    dynamics = GridworldDynamics(dim, overlay, ["red"], 0.25, 0.0, list(ACTION2VEC))
+    cells = list(product(range(1, dim + 1), repeat=2))
+    targets = np.array([grid_obs(dim, *cell) for cell in cells])
+    for (x, y), (i, a) in product(cells, enumerate(ACTION2VEC)):
+        moves = naive.moves(GridWorldState(x, y, action=a))
+        expected = [moves.get(GridWorldState(*cell), 0.0) for cell in cells]
+        obss = np.array([grid_obs(dim, x, y)] * len(cells))
+        assert np.allclose(dynamics.transition_probabilities(obss, [i] * len(cells), targets), expected)
+        assert [dynamics.transition_probability(obss[0], i, target) for target in targets] == pytest.approx(expected)
+
+
+def test_gridworld_step_slips():
+    np.random.seed(0)
+    dynamics = GridworldDynamics(3, {}, [], 0.25, 0.0, list(ACTION2VEC))
+    n = 4000
+    obss = np.array([grid_obs(3, 2, 2)] * n)
+    actions = np.full(n, list(ACTION2VEC).index("→"))
+    next_obss, dones = dynamics.step_from_obss(obss, actions, np.zeros(n))
+    probs = dynamics.transition_probabilities(obss, actions, next_obss)
+    assert (probs > 0).all() and not dones.any()
+    assert abs((probs == 0.25).mean() - 0.25) < 0.03
+
+
+def old_letter_transition_probability(env, obs, action, target_obs):
+    # The per-observation transition_probability of LetterEnv before the batched dynamics
+    curr_agent = np.where(obs[:,:,len(env.letter_types)] == 1)
+    target_agent = np.where(target_obs[:,:,len(env.letter_types)] == 1)
+    di,dj = env.actions[action]
+    agent_i = (curr_agent[0] + di + env.grid_size) % env.grid_size
+    agent_j = (curr_agent[1] + dj + env.grid_size) % env.grid_size
+    return 1.0 if (agent_i, agent_j) == target_agent else 0.0
+
+
+@pytest.mark.parametrize("use_agent_centric_view", [False, True])
+def test_letters_match_per_observation(use_agent_centric_view):
+    rng = np.random.RandomState(0)
+    env = LetterEnv(3, "ab", False, use_agent_centric_view, timeout=5)
+    n = 50
+    obss = np.zeros((n, 3, 3, 3), dtype=np.uint8)
+    for obs in obss:
+        obs[rng.randint(3), rng.randint(3), 2] = 1
+        for i, j in product(range(3), repeat=2):
+            if rng.random_sample() < 0.3:
+                obs[i, j, rng.randint(2)] = 1
+    actions, times = rng.randint(4, size=n), rng.randint(6, size=n)
+    next_obss, dones = env.dynamics.step_from_obss(obss, actions, times)
+    for obs, action, time, next_obs, done in zip(obss, actions, times, next_obss, dones):
+        expected_obs, _, expected_done, _ = env.step_from_obs(obs[None], action, time)
+        assert (next_obs == expected_obs[0]).all() and done == expected_done
+    targets = obss[rng.permutation(n)]
+    for target in [next_obss, targets]:
+        expected = [old_letter_transition_probability(env, *args) for args in zip(obss, actions, target)]
+        assert list(env.dynamics.transition_probabilities(obss, actions, target)) == expected
+        assert [env.transition_probability(*args) for args in zip(obss, actions, target)] == expected
+    assert env.get_events_given_obss(obss) == [env.get_events_given_obs(obs) for obs in obss]
+
+
+def test_lift_path():
+    dummy = DummyDynamics("abc", timeout=5)
+    # Observation nodes at the even positions, action nodes in between
+    path = [(np.array([3]),), (0,), (np.array([0]),), (0,), (np.array([0]),), (1,), (np.array([1]),)]
+    assert dummy.lift_path(path) == ["a", "b"]
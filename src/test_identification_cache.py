@@ -0,0 +1,85 @@
+from functools import partial
+
+import pytest
+
+import identification_cache
+from identification_cache import Uncacheable, cached, canonical, hash_key
+
+
+def clauses_upto(n, *args):
+    return ()
+
+
+@pytest.fixture(autouse=True)
+def memory_cache():
+    identification_cache.configure(max_entries=100)
+    yield
+    identification_cache.configure()
+
+
+def test_canonical_ignores_set_order():
+    assert canonical({"b", "a", "c"}) == canonical({"c", "a", "b"})
+    assert hash_key({1: {"x", "y"}}) == hash_key({1: {"y", "x"}})
+
+
+def test_callables_keyed_on_their_data():
+    assert hash_key(partial(clauses_upto, 2)) == hash_key(partial(clauses_upto, 2))
+    assert hash_key(partial(clauses_upto, 2)) != hash_key(partial(clauses_upto, 3))
+    assert hash_key(clauses_upto) != hash_key(partial(clauses_upto, 2))
+
+
+def test_closures_are_uncacheable():
+    def make(n):
+        return lambda *args: n
+    with pytest.raises(Uncacheable):
+        hash_key(make(1))
+    with pytest.raises(Uncacheable):
+        hash_key(partial(make(1), 2))
+
+    calls = []
+    @cached("test_closures")
+    def identify(extra_clauses):
+        calls.append(extra_clauses)
+        return extra_clauses()
+    assert identify(make(1)) == 1
+    assert identify(make(2)) == 2 # Would be a hit if keyed by name only
+    assert len(calls) == 2
+
+
+def test_cached_hits_and_misses():
+    calls = []
+    @cached("test_hits")
+    def identify(accepting, extra_clauses=clauses_upto):
+        calls.append(accepting)
+        return sorted(accepting)
+    assert identify({"b", "a"}) == ["a", "b"]
+    assert identify({"a", "b"}) == ["a", "b"]
+    assert identify({"a", "b"}, partial(clauses_upto, 1)) == ["a", "b"]
+    assert len(calls) == 2
+    cache = identification_cache.get_cache()
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_errors_are_not_cached():
+    calls = []
+    @cached("test_errors")
+    def identify(x):
+        calls.append(x)
+        raise TimeoutError()
+    for _ in range(2):
+        with pytest.raises(TimeoutError):
+            identify(1)
+    assert len(calls) == 2
+
+
+def test_eviction_bounds_entries():
+    identification_cache.configure(max_entries=10)
+    @cached("test_eviction")
+    def identify(x):
+        return x
+    for x in range(25):
+        identify(x)
+    cache = identification_cache.get_cache()
+    assert len(cache) <= 10
+    assert cache.evictions >= 15
+    assert identify(24) == 24
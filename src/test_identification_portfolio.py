@@ -0,0 +1,100 @@
+import os
+import time
+import signal
+import multiprocessing
+
+import pytest
+
+import identification_cache
+import identification_portfolio
+from identification_cache import cached
+from identification_portfolio import PortfolioConfig, make_portfolio, portfolio_find_dfas
+from sat_deadline import IdentificationTimeout, time_limit
+
+ACCEPTING = [("a",), ("a", "b")]
+REJECTING = [("b",), ()]
+
+
+def slow_config(delays):
+    """ find_dfas delayed by delays[solver name] seconds, which also reports its pid to a file """
+    find_dfas = identification_portfolio.find_dfas
+
+    def find(*args, solver_fact, **kwargs):
+        pid_dir = os.environ.get("PORTFOLIO_PID_DIR")
+        if pid_dir is not None:
+            open(os.path.join(pid_dir, str(os.getpid())), "w").close()
+        time.sleep(delays.get(solver_fact.keywords["name"], 0.0))
+        return find_dfas(*args, solver_fact=solver_fact, **kwargs)
+    return find
+
+
+@pytest.fixture(autouse=True)
+def memory_cache():
+    identification_cache.configure()
+    yield
+    identification_cache.configure()
+
+
+def test_portfolio_finds_dfas():
+    dfas = portfolio_find_dfas(ACCEPTING, REJECTING, {"a", "b"}, make_portfolio(solvers=("glucose4", "minisat22")), mode="best")
+    assert dfas
+    for dfa in dfas:
+        assert all(dfa.label(word) for word in ACCEPTING)
+        assert not any(dfa.label(word) for word in REJECTING)
+
+
+def test_budget_without_dfas_raises(monkeypatch):
+    monkeypatch.setattr(identification_portfolio, "find_dfas", slow_config({"glucose4": 30}))
+    configs = (PortfolioConfig(solver="glucose4"),)
+    start_time = time.time()
+    with pytest.raises(TimeoutError):
+        portfolio_find_dfas(ACCEPTING, REJECTING, {"a", "b"}, configs, time_budget=0.2)
+    with time_limit(0.2):
+        with pytest.raises(IdentificationTimeout):
+            portfolio_find_dfas(ACCEPTING, REJECTING, {"a", "b"}, configs) # No budget of its own
+    assert time.time() - start_time < 10
+
+
+def test_truncated_best_pool_not_cached(monkeypatch):
+    monkeypatch.setattr(identification_portfolio, "find_dfas", slow_config({"minisat22": 30}))
+    configs = make_portfolio(solvers=("glucose4", "minisat22"))
+    calls = []
+
+    @cached("test_portfolio")
+    def identify(accepting, rejecting):
+        calls.append(accepting)
+        return [dfa.to_int() for dfa in portfolio_find_dfas(accepting, rejecting, {"a", "b"}, configs, mode="best", time_budget=1.0)]
+
+    assert identify(ACCEPTING, REJECTING)
+    assert identify(ACCEPTING, REJECTING)
+    assert len(calls) == 2
+
+
+def _run_portfolio(delays):
+    identification_portfolio.find_dfas = slow_config(delays)
+    portfolio_find_dfas(ACCEPTING, REJECTING, {"a", "b"}, make_portfolio(solvers=tuple(delays)))
+
+
+def test_configs_exit_with_their_parent(tmp_path, monkeypatch):
+    monkeypatch.setenv("PORTFOLIO_PID_DIR", str(tmp_path))
+    parent = multiprocessing.get_context("fork").Process(target=_run_portfolio, args=({"glucose4": 60, "minisat22": 60},))
+    parent.start()
+    deadline = time.time() + 10
+    while len(os.listdir(tmp_path)) < 2 and time.time() < deadline:
+        time.sleep(0.05)
+    pids = [int(pid) for pid in os.listdir(tmp_path)]
+    assert len(pids) == 2
+    os.kill(parent.pid, signal.SIGKILL) # Like a relabel worker past its hard time limit
+    parent.join()
+
+    def alive(pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        # A zombie waiting for init to reap it is done too
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().split(")")[-1].split()[0] != "Z"
+    while any(map(alive, pids)) and time.time() < deadline:
+        time.sleep(0.05)
+    assert not any(map(alive, pids))
@@ -0,0 +1,63 @@
+import random
+import itertools
+
+import pytest
+from dfa_identify import find_dfas
+
+import incremental_identification
+from incremental_identification import find_dfas_incremental
+from sat_deadline import IdentificationTimeout, time_limit
+
+ALPHABET = {"a", "b"}
+MAX_DFAS = 100
+
+
+def random_examples(rng, n_words=6, max_len=4):
+    words = list({tuple(rng.choice(sorted(ALPHABET)) for _ in range(rng.randint(0, max_len))) for _ in range(n_words)})
+    accepting = [word for word in words if rng.random() < 0.5]
+    rejecting = [word for word in words if word not in accepting]
+    return accepting, rejecting
+
+
+def n_non_stutter(dfa):
+    return sum(dfa._transition(s, a) != s for s in dfa.states() for a in dfa.inputs)
+
+
+def check_against_find_dfas(accepting, rejecting):
+    expected = list(itertools.islice(find_dfas(accepting, rejecting, alphabet=ALPHABET), MAX_DFAS))
+    found = list(itertools.islice(find_dfas_incremental(accepting, rejecting, alphabet=ALPHABET), MAX_DFAS))
+    assert len(found[0].states()) == len(expected[0].states())
+    for dfa in found:
+        assert all(dfa.label(word) for word in accepting)
+        assert not any(dfa.label(word) for word in rejecting)
+    if len(expected) < MAX_DFAS: # All of them
+        assert {dfa.to_int() for dfa in found} == {dfa.to_int() for dfa in expected}
+
+    expected = next(find_dfas(accepting, rejecting, alphabet=ALPHABET, order_by_stutter=True))
+    found = next(find_dfas_incremental(accepting, rejecting, alphabet=ALPHABET, order_by_stutter=True))
+    assert n_non_stutter(found) == n_non_stutter(expected)
+
+
+def test_matches_find_dfas():
+    rng = random.Random(0)
+    for _ in range(20):
+        check_against_find_dfas(*random_examples(rng))
+
+
+def test_reused_solvers_match_find_dfas(monkeypatch):
+    # The same solvers answer all the queries, in another order, with the examples of the others dropped
+    monkeypatch.setattr(incremental_identification, "_identifiers", {})
+    rng = random.Random(1)
+    examples = [random_examples(rng) for _ in range(10)]
+    for accepting, rejecting in examples + examples[::-1]:
+        check_against_find_dfas(accepting, rejecting)
+
+
+def test_inconsistent_examples():
+    assert list(find_dfas_incremental([("a",)], [("a",)], alphabet=ALPHABET)) == []
+
+
+def test_time_limit():
+    with time_limit(0.0):
+        with pytest.raises(IdentificationTimeout):
+            next(find_dfas_incremental([("a",)], [("b",)], alphabet=ALPHABET))
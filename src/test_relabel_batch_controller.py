@@ -0,0 +1,32 @@
+from relabel_batch_controller import RelabelBatchController
+
+
+def test_init_batch_size_until_measured():
+    controller = RelabelBatchController(init_batch_size=2)
+    assert controller.get_batch_size(10) == 2
+    controller.record_train(1.0)
+    assert controller.get_batch_size(10) == 2
+
+
+def test_batch_size_from_times():
+    controller = RelabelBatchController(target_ratio=0.5, max_batch_size=64)
+    controller.record_train(2.0)
+    controller.record_relabel(0.4, 4) # 0.1s per trace
+    assert controller.get_batch_size(100) == 10
+
+
+def test_batch_size_clipped():
+    controller = RelabelBatchController(min_batch_size=3, max_batch_size=8)
+    controller.record_train(100.0)
+    controller.record_relabel(1.0, 10)
+    assert controller.get_batch_size(100) == 8
+    controller = RelabelBatchController(min_batch_size=3, max_batch_size=8)
+    controller.record_train(0.001)
+    controller.record_relabel(10.0, 1)
+    assert controller.get_batch_size(100) == 3
+
+
+def test_batch_size_capped_at_backlog():
+    controller = RelabelBatchController(min_batch_size=4)
+    assert controller.get_batch_size(1) == 1
+    assert controller.get_batch_size(0) == 0
@@ -0,0 +1,51 @@
+import time
+
+import pytest
+from pysat.examples.genhard import PHP
+from pysat.solvers import Glucose4
+
+from sat_deadline import IdentificationTimeout, bounded_solver_fact, solve_before, time_limit
+
+
+def hard_solver():
+    # Pigeonhole formulas are exponentially hard for CDCL solvers
+    return Glucose4(bootstrap_with=PHP(12).clauses)
+
+
+def test_solve_before_without_deadline():
+    with Glucose4(bootstrap_with=[[1, 2], [-1]]) as solver:
+        assert solve_before(solver)
+        assert not solve_before(solver, [-2])
+
+
+def test_solve_before_interrupts_at_deadline():
+    with hard_solver() as solver:
+        start_time = time.time()
+        with pytest.raises(IdentificationTimeout):
+            solve_before(solver, deadline=start_time + 0.2)
+        assert time.time() - start_time < 5
+
+
+def test_solve_before_past_deadline():
+    with Glucose4(bootstrap_with=[[1]]) as solver:
+        with pytest.raises(IdentificationTimeout):
+            solve_before(solver, deadline=time.time() - 1)
+
+
+def test_time_limit_bounds_the_solver_fact():
+    assert bounded_solver_fact() is Glucose4
+    with time_limit(0.2):
+        solver_fact = bounded_solver_fact()
+        assert solve_before(Glucose4(bootstrap_with=[[1]]))
+        with solver_fact(bootstrap_with=PHP(12).clauses) as solver:
+            with pytest.raises(IdentificationTimeout):
+                solver.solve()
+    assert bounded_solver_fact() is Glucose4
+
+
+def test_time_limit_nests():
+    with time_limit(None):
+        with time_limit(0.0):
+            with pytest.raises(IdentificationTimeout):
+                solve_before(Glucose4(bootstrap_with=[[1]]))
+        assert solve_before(Glucose4(bootstrap_with=[[1]]))
@@ -1,8 +1,8 @@
 #!/usr/bin/python3
 import os
+import time
 import torch
 import random
-import asyncio
 import argparse
 from utils import make_env
 from stable_baselines3 import DQN, SAC
@@ -11,10 +11,14 @@ from stable_baselines3.common.env_checker import check_env
 from features_extractor import CustomCombinedExtractor
 from stable_baselines3.common.off_policy_algorithm import OffPolicyAlgorithm
 from stable_baselines3.common.callbacks import BaseCallback, CheckpointCallback
+from stable_baselines3.common.vec_env import VecMonitor
 from stable_baselines3.common.type_aliases import GymEnv, MaybeCallback
 from typing import Optional
-from diss_relabeler import DissRelabeler
+from diss_relabeler import DissRelabeler, DissRelabelerConfig
 from diss_replay_buffer import DissReplayBuffer
+from dfa_vec_env import DFAVecEnv
+from relabel_batch_controller import RelabelBatchController
+from identification_portfolio import make_portfolio
 from env_model import getEnvModel
 from collections import deque
 from dfa_identify.concept_class_restrictions import enforce_chain, enforce_reach_avoid_seq
@@ -88,47 +92,26 @@ class DiscountedRewardCallback(BaseCallback):
 
         return True
 
-async def relabel(relabeler, relabeler_name, batch_size):
-    relabeler.relabel(relabeler_name, batch_size)
+class ProgressionCacheCallback(BaseCallback):
+    """
+    Logs the hit rate of the goal progression caches of the DFAEnvs.
+    """
 
-async def learn(
-    model: OffPolicyAlgorithm,
-    total_timesteps: int,
-    callback: MaybeCallback = None,
-    log_interval: int = 4,
-    eval_env: Optional[GymEnv] = None,
-    eval_freq: int = -1, 
-    n_eval_episodes: int = 5,
-    tb_log_name: str = "run",
-    eval_log_path: Optional[str] = None,
-    reset_num_timesteps: bool = True,
-    progress_bar: bool = False,
-):
+    def __init__(self, log_interval=1000, verbose=0):
+        self.log_interval = log_interval
+        super(ProgressionCacheCallback, self).__init__(verbose)
 
-    rollout = model.collect_rollouts(
-        model.env,
-        train_freq=model.train_freq,
-        action_noise=model.action_noise,
-        callback=callback,
-        learning_starts=model.learning_starts,
-        replay_buffer=model.replay_buffer,
-        log_interval=log_interval,
-    )
-
-    if rollout.continue_training is False:
-        return True, model
-
-    if model.num_timesteps > 0 and model.num_timesteps > model.learning_starts:
-        # If no `gradient_steps` is specified,
-        # do as many gradients steps as steps performed during the rollout
-        gradient_steps = model.gradient_steps if model.gradient_steps >= 0 else rollout.episode_timesteps
-        # Special case when the user passes `gradient_steps=0`
-        if gradient_steps > 0:
-            model.train(batch_size=model.batch_size, gradient_steps=gradient_steps)
-
-    return False, model
-
-async def learn_with_diss_async(
+    def _on_step(self):
+        if self.n_calls % self.log_interval != 0:
+            return True
+        hits = sum(self.training_env.get_attr("progression_hits"))
+        misses = sum(self.training_env.get_attr("progression_misses"))
+        if hits + misses > 0:
+            self.logger.record("env/progression_cache_hit_rate", hits / (hits + misses))
+        self.logger.record("env/progression_cache_size", sum(map(len, self.training_env.get_attr("progression_cache"))))
+        return True
+
+def learn_with_diss_async(
     model: OffPolicyAlgorithm,
     env,
     relabeler_name,
@@ -143,39 +126,61 @@ async def learn_with_diss_async(
     eval_log_path: Optional[str] = None,
     reset_num_timesteps: bool = True,
     progress_bar: bool = False,
-    extra_clauses = None,
+    relabeler_config: Optional[DissRelabelerConfig] = None,
+    batch_controller: Optional[RelabelBatchController] = None,
 ):
-    relabeler = DissRelabeler(model, env, extra_clauses=extra_clauses)
-
-    total_timesteps, callback = model._setup_learn(
-        total_timesteps,
-        eval_env,
-        callback,
-        eval_freq,
-        n_eval_episodes,
-        eval_log_path,
-        reset_num_timesteps,
-        tb_log_name,
-        progress_bar,
-    )
-
-    callback.on_training_start(locals(), globals())
-
-    while model.num_timesteps < total_timesteps:
-
-        task1 = asyncio.create_task(learn(model, total_timesteps=total_timesteps, callback=callback))
-        task2 = None
-        if model.num_timesteps > model.learning_starts:
-            task2 = asyncio.create_task(relabel(relabeler, relabeler_name, 2))
-
-        await task1
-        if task2 is not None:
-            await task2
+    relabeler = DissRelabeler(model, env, relabeler_config)
+    if batch_controller is None:
+        batch_controller = RelabelBatchController()
+
+    # Workers are not daemonic, they are stopped even if training fails
+    try:
+        total_timesteps, callback = model._setup_learn(
+            total_timesteps,
+            eval_env,
+            callback,
+            eval_freq,
+            n_eval_episodes,
+            eval_log_path,
+            reset_num_timesteps,
+            tb_log_name,
+            progress_bar,
+        )
 
-        done, model = task1.result()
-        if done:
-            break
+        callback.on_training_start(locals(), globals())
+
+        # DISS relabels run in the worker pool while rollouts are collected and the
+        # q_net is trained, finished batches are written on later iterations.
+        while model.num_timesteps < total_timesteps:
+            rollout = model.collect_rollouts(
+                model.env,
+                train_freq=model.train_freq,
+                action_noise=model.action_noise,
+                callback=callback,
+                learning_starts=model.learning_starts,
+                replay_buffer=model.replay_buffer,
+                log_interval=log_interval,
+            )
 
+            if rollout.continue_training is False:
+                break
+
+            if model.num_timesteps > 0 and model.num_timesteps > model.learning_starts:
+                relabeler.harvest()
+                batch_controller.record_relabel(*relabeler.pop_relabel_stats())
+                backlog = len(model.replay_buffer.not_relabeled_traces)
+                relabeler.submit(relabeler_name, batch_controller.get_batch_size(backlog))
+                batch_controller.log(model.logger, backlog)
+                # If no `gradient_steps` is specified,
+                # do as many gradients steps as steps performed during the rollout
+                gradient_steps = model.gradient_steps if model.gradient_steps >= 0 else rollout.episode_timesteps
+                # Special case when the user passes `gradient_steps=0`
+                if gradient_steps > 0:
+                    start_time = time.time()
+                    model.train(batch_size=model.batch_size, gradient_steps=gradient_steps)
+                    batch_controller.record_train(time.time() - start_time)
+    finally:
+        relabeler.close()
     callback.on_training_end()
 
 def learn_with_diss(
@@ -193,47 +198,58 @@ def learn_with_diss(
     eval_log_path: Optional[str] = None,
     reset_num_timesteps: bool = True,
     progress_bar: bool = False,
-    extra_clauses = None,
+    relabeler_config: Optional[DissRelabelerConfig] = None,
+    batch_controller: Optional[RelabelBatchController] = None,
 ):
-    relabeler = DissRelabeler(model, env, extra_clauses=extra_clauses)
-
-    total_timesteps, callback = model._setup_learn(
-        total_timesteps,
-        eval_env,
-        callback,
-        eval_freq,
-        n_eval_episodes,
-        eval_log_path,
-        reset_num_timesteps,
-        tb_log_name,
-        progress_bar,
-    )
-
-    callback.on_training_start(locals(), globals())
-
-    while model.num_timesteps < total_timesteps:
-        rollout = model.collect_rollouts(
-            model.env,
-            train_freq=model.train_freq,
-            action_noise=model.action_noise,
-            callback=callback,
-            learning_starts=model.learning_starts,
-            replay_buffer=model.replay_buffer,
-            log_interval=log_interval,
+    relabeler = DissRelabeler(model, env, relabeler_config)
+    if batch_controller is None:
+        batch_controller = RelabelBatchController()
+
+    # Workers are not daemonic, they are stopped even if training fails
+    try:
+        total_timesteps, callback = model._setup_learn(
+            total_timesteps,
+            eval_env,
+            callback,
+            eval_freq,
+            n_eval_episodes,
+            eval_log_path,
+            reset_num_timesteps,
+            tb_log_name,
+            progress_bar,
         )
 
-        if rollout.continue_training is False:
-            break
-
-        if model.num_timesteps > 0 and model.num_timesteps > model.learning_starts:
-            # If no `gradient_steps` is specified,
-            # do as many gradients steps as steps performed during the rollout
-            gradient_steps = model.gradient_steps if model.gradient_steps >= 0 else rollout.episode_timesteps
-            # Special case when the user passes `gradient_steps=0`
-            if gradient_steps > 0:
-                model.train(batch_size=model.batch_size, gradient_steps=gradient_steps)
-                relabeler.relabel(relabeler_name, 2)
+        callback.on_training_start(locals(), globals())
+
+        while model.num_timesteps < total_timesteps:
+            rollout = model.collect_rollouts(
+                model.env,
+                train_freq=model.train_freq,
+                action_noise=model.action_noise,
+                callback=callback,
+                learning_starts=model.learning_starts,
+                replay_buffer=model.replay_buffer,
+                log_interval=log_interval,
+            )
 
+            if rollout.continue_training is False:
+                break
+
+            if model.num_timesteps > 0 and model.num_timesteps > model.learning_starts:
+                # If no `gradient_steps` is specified,
+                # do as many gradients steps as steps performed during the rollout
+                gradient_steps = model.gradient_steps if model.gradient_steps >= 0 else rollout.episode_timesteps
+                # Special case when the user passes `gradient_steps=0`
+                if gradient_steps > 0:
+                    start_time = time.time()
+                    model.train(batch_size=model.batch_size, gradient_steps=gradient_steps)
+                    batch_controller.record_train(time.time() - start_time)
+                    backlog = len(model.replay_buffer.not_relabeled_traces)
+                    relabeler.relabel(relabeler_name, batch_controller.get_batch_size(backlog))
+                    batch_controller.record_relabel(*relabeler.pop_relabel_stats())
+                    batch_controller.log(model.logger, backlog)
+    finally:
+        relabeler.close()
     callback.on_training_end()
 
 if __name__ == "__main__":
@@ -269,10 +285,56 @@ if __name__ == "__main__":
                             help="load a pretrained gnn model from a path")
     parser.add_argument("--enforce-clause", default=None,
                             help="enforce diss to only find dfas in a specific class")
+    parser.add_argument("--diss-workers", type=int, default=2,
+                            help="number of persistent DISS relabel worker processes (default: 2)")
+    parser.add_argument("--diss-max-tasks-per-worker", type=int, default=0,
+                            help="number of relabels after which a DISS worker is recycled, 0 means never (default: 0)")
+    parser.add_argument("--diss-cache-size", type=int, default=10000,
+                            help="maximum number of event traces in the DISS relabel cache (default: 10000)")
+    parser.add_argument("--diss-cache-path", default=None,
+                            help="file to persist the DISS relabel cache across runs")
+    parser.add_argument("--diss-cache-version-bucket", type=int, default=50,
+                            help="number of weight broadcasts for which cached relabels stay valid (default: 50)")
+    parser.add_argument("--diss-max-pending", type=int, default=4,
+                            help="maximum number of DISS batches in flight with --async-diss (default: 4)")
+    parser.add_argument("--diss-time-budget", type=float, default=None,
+                            help="seconds of DISS search per trace before the best DFA found so far is used (default: no budget)")
+    parser.add_argument("--diss-hard-time-limit", type=float, default=None,
+                            help="seconds after which a DISS worker stuck on a trace is killed and replaced (default: no limit)")
+    parser.add_argument("--id-cache-path", default=None,
+                            help="sqlite file shared by the DISS workers to cache DFA identifications (default: a file in the log directory of the run)")
+    parser.add_argument("--id-cache-size", type=int, default=100000,
+                            help="maximum number of cached DFA identifications (default: 100000)")
+    parser.add_argument("--incremental-sat", action="store_true",
+                            help="reuse the SAT solvers of the DFA identifications across DISS iterations")
+    parser.add_argument("--portfolio-solvers", default=None,
+                            help="comma separated pysat solvers run in parallel for each DFA identification, e.g., glucose4,cadical153 (default: no portfolio)")
+    parser.add_argument("--portfolio-sym-modes", default=None,
+                            help="comma separated symmetry breaking modes (bfs, clique or none) run in parallel for each DFA identification (default: no portfolio)")
+    parser.add_argument("--portfolio-mode", default="first", choices=["first", "best"],
+                            help="keep the DFAs of the first configuration to finish, or the smallest ones found within --portfolio-budget (default: first)")
+    parser.add_argument("--portfolio-budget", type=float, default=None,
+                            help="seconds to wait for the portfolio configurations in best mode (default: wait for all)")
+    parser.add_argument("--diss-search", default="diss", choices=["diss", "enumerative"],
+                            help="search for relabels with DISS, or score the first DFAs consistent with each trace (default: diss)")
+    parser.add_argument("--diss-search-workers", type=int, default=0,
+                            help="processes forked by each relabel worker to score the DFAs of the enumerative search, 0 scores them with one batched q_net call (default: 0)")
+    parser.add_argument("--diss-search-chunk-size", type=int, default=1,
+                            help="DFAs sent at a time to the scoring processes of the enumerative search (default: 1)")
+    parser.add_argument("--relabel-time-ratio", type=float, default=0.5,
+                            help="target ratio of relabel time to train time used to pick the relabel batch size (default: 0.5)")
+    parser.add_argument("--relabel-min-batch-size", type=int, default=1,
+                            help="smallest number of traces relabeled per iteration (default: 1)")
+    parser.add_argument("--relabel-max-batch-size", type=int, default=64,
+                            help="largest number of traces relabeled per iteration (default: 64)")
     parser.add_argument("--async-diss", action=argparse.BooleanOptionalAction, default=False,
-                            help="run diss with asyncio (default: False)")
+                            help="relabel with diss in the background while collecting rollouts and training (default: False)")
     parser.add_argument("--mid-check", action=argparse.BooleanOptionalAction, default=False,
                             help="checkpointing during training (default: False)")
+    parser.add_argument("--n-envs", type=int, default=1,
+                            help="number of envs stepped together, their DFA goals share one progression cache (default: 1)")
+    parser.add_argument("--dfa-encoding", default="int_seq", choices=["int_seq", "table"],
+                            help="observation encoding of the DFA goals, decimal digits of their ints or padded transition tables (default: int_seq)")
     parser.add_argument("--policy", default="SDQN",
                             help="SAC | SDQN (default)")
     parser.add_argument("--disable-wandb", action=argparse.BooleanOptionalAction, default=False,
@@ -284,12 +346,13 @@ if __name__ == "__main__":
     random.seed(args.seed)
 
 
-    env = make_env(args.env, args.sampler, args.reject_reward, seed=args.seed)
-    # single_env = env
-    # num_env = 8
-    # env = DummyVecEnv([lambda: make_env(args.env, args.sampler, seed=args.seed+i) for i in range(num_env)])
-    # env = VecMonitor(env)
-    # single_env = make_env(args.env, args.sampler)
+    if args.n_envs > 1:
+        envs = [make_env(args.env, args.sampler, args.reject_reward, seed=None if args.seed is None else args.seed + i, dfa_encoding=args.dfa_encoding) for i in range(args.n_envs)]
+        single_env = envs[0]
+        env = VecMonitor(DFAVecEnv(envs))
+    else:
+        env = make_env(args.env, args.sampler, args.reject_reward, seed=args.seed, dfa_encoding=args.dfa_encoding)
+        single_env = env
 
     print("------------------------------------------------")
     print(env)
@@ -338,10 +401,11 @@ if __name__ == "__main__":
 
     discounted_reward_callback = DiscountedRewardCallback(args.gamma)
     callback_list.append(discounted_reward_callback)
+    callback_list.append(ProgressionCacheCallback())
 
     tensorboard_dir = "./wandb_sweep_relabel_" + args.relabeler
 
-    env_model = getEnvModel(env, env.observation_space['features'].shape)
+    env_model = getEnvModel(single_env, single_env.observation_space['features'].shape)
     features_dim = env_model.embedding_size + GNN_EMBEDDING_SIZE
 
     policy = None
@@ -360,7 +424,7 @@ if __name__ == "__main__":
             env=env,
             policy_kwargs=dict(
                 features_extractor_class=CustomCombinedExtractor,
-                features_extractor_kwargs=dict(env=env, gnn_load_path=args.load_gnn_path, features_dim=features_dim),
+                features_extractor_kwargs=dict(env=single_env, gnn_load_path=args.load_gnn_path, features_dim=features_dim),
                 ),
             verbose=args.verbosity,
             tensorboard_log=tensorboard_dir,
@@ -387,11 +451,11 @@ if __name__ == "__main__":
             env=env,
             policy_kwargs=dict(
                 features_extractor_class=CustomCombinedExtractor,
-                features_extractor_kwargs=dict(env=env, gnn_load_path=args.load_gnn_path, features_dim=features_dim)
+                features_extractor_kwargs=dict(env=single_env, gnn_load_path=args.load_gnn_path, features_dim=features_dim)
                 ),
             replay_buffer_class=DissReplayBuffer,
             replay_buffer_kwargs=dict(
-                max_episode_length=env.timeout,
+                max_episode_length=single_env.timeout,
                 her_replay_buffer_size=args.buffer_size
                 ),
             verbose=args.verbosity,
@@ -405,10 +469,40 @@ if __name__ == "__main__":
         pytorch_total_params = sum(p.numel() for p in model.policy.parameters() if p.requires_grad)
         print(pytorch_total_params)
         print(model.policy)
-        if args.async_diss:
-            asyncio.run(learn_with_diss_async(model, env, args.relabeler, "dqn", callback=callback_list, total_timesteps=args.total_timesteps, extra_clauses=extra_clauses))
-        else:
-            learn_with_diss(model, env, args.relabeler, "dqn", callback=callback_list, total_timesteps=args.total_timesteps, extra_clauses=extra_clauses)
+        batch_controller = RelabelBatchController(
+            target_ratio=args.relabel_time_ratio,
+            min_batch_size=args.relabel_min_batch_size,
+            max_batch_size=args.relabel_max_batch_size
+        )
+        portfolio = ()
+        if args.portfolio_solvers is not None or args.portfolio_sym_modes is not None:
+            portfolio = make_portfolio(
+                solvers=args.portfolio_solvers.split(",") if args.portfolio_solvers else ("glucose4",),
+                sym_modes=[None if m == "none" else m for m in args.portfolio_sym_modes.split(",")] if args.portfolio_sym_modes else ("bfs",)
+            )
+        relabeler_config = DissRelabelerConfig(
+            extra_clauses=extra_clauses,
+            n_workers=args.diss_workers,
+            max_tasks_per_worker=args.diss_max_tasks_per_worker,
+            cache_size=args.diss_cache_size,
+            cache_path=args.diss_cache_path,
+            cache_version_bucket=args.diss_cache_version_bucket,
+            max_pending=args.diss_max_pending,
+            time_budget=args.diss_time_budget,
+            hard_time_limit=args.diss_hard_time_limit,
+            identification_cache_path=args.id_cache_path,
+            identification_cache_size=args.id_cache_size,
+            incremental_sat=args.incremental_sat,
+            portfolio=portfolio,
+            portfolio_mode=args.portfolio_mode,
+            portfolio_budget=args.portfolio_budget,
+            search=args.diss_search,
+            search_workers=args.diss_search_workers,
+            search_chunk_size=args.diss_search_chunk_size,
+        )
+        learn = learn_with_diss_async if args.async_diss else learn_with_diss
+        learn(model, single_env, args.relabeler, "dqn", callback=callback_list, total_timesteps=args.total_timesteps,
+              relabeler_config=relabeler_config, batch_controller=batch_controller)
 
     MODEL_PATH = "checkpoint_final"
     model.save(os.path.join(model_save_path, "f{MODEL_PATH}.pkl"), include=[])
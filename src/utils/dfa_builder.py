@@ -8,6 +8,7 @@ import networkx as nx
 from copy import deepcopy
 from pysat.solvers import Solver
 from dfa import DFA
+from compiled_dfa import CompiledDFA
 from utils.parameters import edge_types, feature_inds
 
 """
@@ -16,19 +17,22 @@ code can generate trees in either Networkx or DGL formats. And uses caching to r
 generated trees.
 """
 class DFABuilder(object):
-    def __init__(self, propositions, dfa_n_conjunctions, dfa_n_disjunctions, device=None):
+    def __init__(self, propositions, dfa_n_conjunctions, dfa_n_disjunctions, device=None, table_encoding=None):
         super(DFABuilder, self).__init__()
         self.propositions = propositions
         self.device = device
         self.dfa_n_conjunctions = dfa_n_conjunctions
         self.dfa_n_disjunctions = dfa_n_disjunctions
         self.feature_size = len(self.propositions) + len(feature_inds)
+        self.table_encoding = table_encoding # The observations are int seqs if None
 
     # To make the caching work.
     def __ring_key__(self):
         return "DFABuilder"
 
     def __call__(self, dfa_int_seq, library="dgl"):
+        if self.table_encoding is not None:
+            return self._table_to_graph(dfa_int_seq)
         dfa_goal = self._seq2goal(dfa_int_seq)
         return self._to_graph(dfa_goal, library)
 
@@ -43,7 +47,7 @@ class DFABuilder(object):
                 dfa_int = int(dfa_int_str)
                 # dfa_int = int(dfa_int_str, 2)
                 if dfa_int > 0:
-                    dfa = DFA.from_int(dfa_int, self.propositions)
+                    dfa = CompiledDFA.from_int(dfa_int, self.propositions)
                     dfa_clause.append(dfa)
             dfa_goal.append(tuple(dfa_clause))
         return dfa_goal
@@ -131,6 +135,60 @@ class DFABuilder(object):
 
         return self._get_dgl_graph(nxg)
 
+    def _table_to_graph(self, dfa_table_seq):
+        """
+        Same graph as _to_graph_one_layer (up to the node order), built from the
+        tables of a TableEncoding observation without networkx. Their columns
+        are in the order of the propositions.
+        """
+        if isinstance(dfa_table_seq, torch.Tensor):
+            dfa_table_seq = dfa_table_seq.cpu().numpy()
+        dfa_goal = self.table_encoding.decode_tables(dfa_table_seq)
+
+        feats, U, V, types, init_nodes = [], [], [], [], []
+        n_nodes = 0
+        for dfa_clause in dfa_goal:
+            for transitions, labels in dfa_clause:
+                n_states, n_inputs = transitions.shape
+                states = np.arange(n_states)
+                # props[s, e, a] iff the a-th proposition leads from s to e != s
+                props = np.zeros((n_states, n_states, n_inputs), dtype=bool)
+                props[states[:, None], transitions, np.arange(n_inputs)[None, :]] = True
+                props[states, states] = False # We define self loops later
+                starts, ends = np.nonzero(props.any(axis=2))
+                temps = n_nodes + n_states + np.arange(len(starts))
+
+                feat = np.zeros((n_states + len(starts), self.feature_size))
+                feat[:n_states, feature_inds["normal"]] = 1.0
+                feat[:n_states, feature_inds["accepting"]] = labels
+                feat[:n_states, feature_inds["rejecting"]] = ~labels & (transitions == states[:, None]).all(axis=1)
+                feat[0, feature_inds["init"]] = 1.0
+                feat[n_states:, feature_inds["temp"]] = 1.0
+                feat[n_states:, :n_inputs] = props[starts, ends]
+                feats.append(feat)
+
+                U += [n_nodes + ends, temps]
+                V += [temps, n_nodes + starts]
+                types += [np.full(len(starts), edge_types["normal-to-temp"]), np.full(len(starts), edge_types["temp-to-normal"])]
+                init_nodes.append(n_nodes)
+                n_nodes += feat.shape[0]
+
+        and_node = n_nodes
+        and_feat = np.zeros((1, self.feature_size))
+        and_feat[0, feature_inds["AND"]] = 1.0
+        feats.append(and_feat)
+        U += [np.array(init_nodes, dtype=np.int64), np.arange(n_nodes + 1)]
+        V += [np.full(len(init_nodes), and_node), np.arange(n_nodes + 1)]
+        types += [np.full(len(init_nodes), edge_types["AND"]), np.full(n_nodes + 1, edge_types["self"])]
+        is_root = np.zeros((n_nodes + 1, 1))
+        is_root[and_node] = 1.0
+
+        g = dgl.graph((torch.from_numpy(np.concatenate(U).astype(np.int64)), torch.from_numpy(np.concatenate(V).astype(np.int64))), num_nodes=n_nodes + 1)
+        g.ndata["feat"] = torch.from_numpy(np.concatenate(feats)[:, None, :])
+        g.ndata["is_root"] = torch.from_numpy(is_root)
+        g.edata["type"] = torch.from_numpy(np.concatenate(types).astype(np.int64))
+        return g
+
     def _get_dgl_graph(self, nxg):
 
         edges = list(nxg.edges)
@@ -157,10 +215,9 @@ class DFABuilder(object):
         return g
 
     def min_distance_to_accept_by_state_normalized(self, dfa, state):
-        from dfa.utils import min_distance_to_accept_by_state
-        depths = min_distance_to_accept_by_state(dfa)
-        if state in depths:
-            return depths[state]/100.0
+        depth = dfa.min_distance_to_accept()[state]
+        if depth < np.inf:
+            return depth/100.0
         return 1.0
 
     def _unroll_dfa_loops(self, d, k=2):
@@ -181,32 +238,35 @@ class DFABuilder(object):
 
     @ring.lru(maxsize=1000000)
     def dfa_to_formatted_nxg(self, dfa):
+        """ dfa is a CompiledDFA, with the states of DFA.from_int """
 
         nxg = nx.DiGraph()
         new_node_name_counter = 0
         new_node_name_base_str = "temp_"
+        transitions = dfa.transitions.tolist()
+        labels = dfa.labels.tolist()
+        input_props = [self.propositions.index(a) for a in dfa.inputs]
 
-        for s in dfa.states():
+        for s in range(dfa.n_states):
             start = str(s)
             nxg.add_node(start)
             nxg.nodes[start]["feat"] = np.array([[0.0] * self.feature_size])
             nxg.nodes[start]["feat"][0][feature_inds["normal"]] = 1.0
             # Assumption: We never do more than chain length 7-8 so deviding by 100 is safe.
             # nxg.nodes[start]["feat"][0][feature_inds["distance_normalized"]] = self.min_distance_to_accept_by_state_normalized(dfa, s)
-            if dfa._label(s): # is accepting?
+            if labels[s]: # is accepting?
                 nxg.nodes[start]["feat"][0][feature_inds["accepting"]] = 1.0
-            elif sum(s != dfa._transition(s, a) for a in dfa.inputs) == 0: # is rejecting?
+            elif all(s == e for e in transitions[s]): # is rejecting?
                 nxg.nodes[start]["feat"][0][feature_inds["rejecting"]] = 1.0
             embeddings = {}
-            for a in dfa.inputs:
-                e = dfa._transition(s, a)
+            for prop_ind, e in zip(input_props, transitions[s]):
                 if s == e:
                     continue # We define self loops later when composing graphs
                 end = str(e)
                 if end not in embeddings.keys():
                     embeddings[end] = np.zeros(self.feature_size)
                     embeddings[end][feature_inds["temp"]] = 1.0 # Since it is a temp node
-                embeddings[end][self.propositions.index(a)] = 1.0
+                embeddings[end][prop_ind] = 1.0
             for end in embeddings.keys():
                 new_node_name = new_node_name_base_str + str(new_node_name_counter)
                 new_node_name_counter += 1
@@ -214,7 +274,7 @@ class DFABuilder(object):
                 nxg.add_edge(end, new_node_name, type=edge_types["normal-to-temp"])
                 nxg.add_edge(new_node_name, start, type=edge_types["temp-to-normal"])
 
-        init_node = str(dfa.start)
+        init_node = "0"
         nxg.nodes[init_node]["feat"][0][feature_inds["init"]] = 1.0
 
         return nxg, init_node
@@ -10,10 +10,10 @@ import envs.gym_letters
 import dfa_wrappers
 import pretrain_wrapper
 
-def make_env(env_key, sampler, reject_reward=-1, seed=None):
+def make_env(env_key, sampler, reject_reward=-1, seed=None, dfa_encoding="int_seq"):
     env = gym.make(env_key)
     env.seed(seed)
-    return dfa_wrappers.DFAEnv(env, sampler, reject_reward)
+    return dfa_wrappers.DFAEnv(env, sampler, reject_reward, dfa_encoding=dfa_encoding)
 
 def make_pretrain_env(env_key, sampler_mean, reject_reward=-1, seed=None):
     env = gym.make(env_key)